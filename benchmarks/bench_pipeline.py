@@ -0,0 +1,231 @@
+"""Benchmarks each stage of the parse -> validate -> export pipeline, and
+end-to-end upload latency through the Starlette app, with synthetic payloads
+for every record type in `READING_MAPPING`. Results are written as JSON, so
+runs can be compared across versions.
+
+Run from the root of the repository:
+
+    python -m benchmarks.bench_pipeline --sizes 1000,100000 --output results.json
+
+Stages:
+    decode:        json.loads of the request body
+    stream_parse:  ShortcutsStreamParser over the body, in 64 KiB chunks
+    validate:      Health._validate_input_fields
+    parse:         Health._parse_shortcuts_data (the ReadingBatch columns)
+    export_<fmt>:  Health.export to each output format (of readings parsed beforehand)
+    http:          POST / through an in-process TestClient, CSV export
+
+Every stage is timed `--repeat` times (the fastest run is reported), then run
+once more under tracemalloc for its peak allocation. `max_rss_bytes` is the
+process's peak resident set size after each case.
+"""
+
+import argparse, itertools, json, os, platform, sys, tempfile, time, tracemalloc, warnings
+from contextlib import redirect_stdout
+from heartbridge import codec
+from heartbridge.constants import EXPORT_CLS_MAP, READING_MAPPING
+from heartbridge.data import numpy
+from heartbridge.health import Health
+from heartbridge.stream import ShortcutsStreamParser
+from .payloads import synthetic_payload
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+DEFAULT_SIZES = (1_000, 10_000, 100_000)
+MAX_SAMPLES = 5_000_000
+CHUNK_SIZE = 65536
+
+
+def max_rss_bytes():
+    """The peak resident set size of this process so far, if available."""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes:
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def measure(stage, repeat: int, memory: bool) -> dict:
+    """Times `stage` (a function taking no arguments), and measures its peak
+    traced allocation.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        stage()
+        timings.append(time.perf_counter() - start)
+    result = {"seconds": min(timings), "runs": timings}
+    if memory:
+        tracemalloc.start()
+        try:
+            stage()
+            result["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def stream_parse(body: bytes):
+    parser = ShortcutsStreamParser()
+    for i in range(0, len(body), CHUNK_SIZE):
+        parser.feed(body[i : i + CHUNK_SIZE])
+    return parser.close()
+
+
+def export_stage(data: dict, output_format: str, scratch_dir: str):
+    """Exports readings parsed up front, so only the export is timed. Each run
+    writes to a new directory in `scratch_dir`.
+    """
+    health = Health(output_format=output_format)
+    health.load_from_shortcuts(dict(data))
+    runs = itertools.count()
+
+    def stage():
+        health.output_dir = os.path.join(
+            scratch_dir, "{}-{}".format(output_format, next(runs))
+        )
+        health.export()
+
+    return stage
+
+
+def http_stage(client, app, body: bytes):
+    def stage():
+        # The app echoes progress, which would end up in the JSON report:
+        with tempfile.TemporaryDirectory() as output_dir, redirect_stdout(sys.stderr):
+            app.state.OUTPUT_DIRECTORY = output_dir
+            app.state.OUTPUT_FORMAT = "csv"
+            response = client.post("/", content=body)
+            if response.status_code != 200:
+                raise RuntimeError("Upload failed: {}".format(response.text))
+
+    return stage
+
+
+def bench_case(reading_type: str, samples: int, args, client=None, app=None) -> dict:
+    body = json.dumps(synthetic_payload(reading_type, samples)).encode()
+    data = json.loads(body)
+    health = Health()
+    health.reading_type_slug = reading_type
+
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        stages = {
+            "decode": lambda: json.loads(body),
+            "stream_parse": lambda: stream_parse(body),
+            "validate": lambda: health._validate_input_fields(data, reading_type),
+            "parse": lambda: health._parse_shortcuts_data(data),
+        }
+        for output_format in args.formats:
+            stages["export_" + output_format] = export_stage(
+                data, output_format, scratch_dir
+            )
+        if client is not None:
+            stages["http"] = http_stage(client, app, body)
+
+        results = {}
+        for name, stage in stages.items():
+            result = measure(stage, args.repeat, args.memory)
+            result["samples_per_second"] = samples / result["seconds"]
+            results[name] = result
+            print(
+                "{:<24} {:>9,} {:<14} {:>8.3f}s {:>14,.0f} samples/s".format(
+                    reading_type,
+                    samples,
+                    name,
+                    result["seconds"],
+                    result["samples_per_second"],
+                ),
+                file=sys.stderr,
+            )
+    return {
+        "type": reading_type,
+        "samples": samples,
+        "body_bytes": len(body),
+        "stages": results,
+        "max_rss_bytes": max_rss_bytes(),
+    }
+
+
+def environment() -> dict:
+    try:
+        from importlib.metadata import version
+
+        heartbridge_version = version("heartbridge")
+    except Exception:
+        heartbridge_version = None
+    return {
+        "heartbridge": heartbridge_version,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": numpy is not None,
+        "json_codec": codec.codec.name,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def parse_sizes(value: str) -> list:
+    sizes = [int(size) for size in value.split(",")]
+    if any(size < 1 or size > MAX_SAMPLES for size in sizes):
+        raise argparse.ArgumentTypeError(
+            "sizes must be between 1 and {:,}".format(MAX_SAMPLES)
+        )
+    return sizes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        type=parse_sizes,
+        default=list(DEFAULT_SIZES),
+        help="Comma-separated sample counts (up to 5,000,000)",
+    )
+    parser.add_argument(
+        "--types",
+        default=",".join(READING_MAPPING),
+        help="Comma-separated record types (defaults to every type in READING_MAPPING)",
+    )
+    parser.add_argument(
+        "--formats",
+        default=",".join(EXPORT_CLS_MAP),
+        help="Comma-separated output formats to benchmark exports in",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--no-memory", dest="memory", action="store_false", help="Skip tracemalloc runs"
+    )
+    parser.add_argument(
+        "--no-http", dest="http", action="store_false", help="Skip end-to-end uploads"
+    )
+    parser.add_argument("--output", help="Write results to this file instead of stdout")
+    args = parser.parse_args()
+    args.formats = args.formats.split(",")
+
+    client = app = None
+    if args.http:
+        from starlette.testclient import TestClient
+        from heartbridge.app import app
+
+        client = TestClient(app)
+
+    results = []
+    with warnings.catch_warnings():
+        # The legacy record type warns about the old shortcut on every load:
+        warnings.simplefilter("ignore", FutureWarning)
+        for reading_type in args.types.split(","):
+            for samples in args.sizes:
+                results.append(bench_case(reading_type, samples, args, client, app))
+
+    report = json.dumps({"environment": environment(), "results": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(report + "\n")
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
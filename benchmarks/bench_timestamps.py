@@ -0,0 +1,59 @@
+"""Compares the fixed-layout timestamp engine in `heartbridge.timestamps` with
+the `datetime.strptime`/`strftime` path it replaced.
+
+Run from the root of the repository:
+
+    python -m benchmarks.bench_timestamps --samples 200000
+"""
+
+import argparse, timeit
+from datetime import datetime
+from heartbridge.timestamps import (
+    DATE_PARSE_STRING,
+    TimestampCodec,
+    datetime_to_epoch,
+    epoch_to_datetime,
+)
+from .payloads import synthetic_dates
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--samples", type=int, default=200_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    dates = synthetic_dates(args.samples)
+    epochs = TimestampCodec().parse_many(dates)
+
+    cases = {
+        "parse (strptime)": lambda: [
+            datetime_to_epoch(datetime.strptime(x, DATE_PARSE_STRING)) for x in dates
+        ],
+        "parse (parse_many)": lambda: TimestampCodec().parse_many(dates),
+        "format (strftime)": lambda: [
+            epoch_to_datetime(x).strftime(DATE_PARSE_STRING) for x in epochs
+        ],
+        "format (format_many)": lambda: list(TimestampCodec().format_many(epochs)),
+    }
+
+    timings = {
+        name: min(timeit.repeat(case, number=1, repeat=args.repeat))
+        for name, case in cases.items()
+    }
+    for name, seconds in timings.items():
+        print(
+            "{:<22} {:>8.3f}s  {:>12,.0f} samples/s".format(
+                name, seconds, args.samples / seconds
+            )
+        )
+    print(
+        "parse speedup: {:.1f}x, format speedup: {:.1f}x".format(
+            timings["parse (strptime)"] / timings["parse (parse_many)"],
+            timings["format (strftime)"] / timings["format (format_many)"],
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""Synthetic Shortcuts payloads for benchmarks, for any record type in
+`READING_MAPPING` and any number of samples.
+"""
+
+import random
+from array import array
+from heartbridge.constants import LEGACY_RECORD_TYPE
+from heartbridge.timestamps import datetime_to_epoch, format_many
+from datetime import datetime
+
+START = datetime(2021, 1, 1)
+
+# Plausible (low, high) values for each record type:
+VALUE_RANGES = {
+    "heart-rate": (45, 190),
+    "heart-rate-legacy": (45, 190),
+    "resting-heart-rate": (40, 80),
+    "heart-rate-variability": (10.0, 150.0),
+    "cycling-distance": (0.01, 2.5),
+    "steps": (1, 400),
+    "flights-climbed": (1, 5),
+}
+
+
+def synthetic_dates(samples: int, interval: int = 5) -> list:
+    """Shortcuts-style timestamps, `interval` seconds apart."""
+    start = datetime_to_epoch(START)
+    return list(
+        format_many(array("q", range(start, start + samples * interval, interval)))
+    )
+
+
+def synthetic_values(reading_type: str, samples: int, seed: int = 0) -> list:
+    """Values for `reading_type` as Shortcuts sends them (strings)."""
+    rng = random.Random(seed)
+    low, high = VALUE_RANGES.get(reading_type, (0.0, 100.0))
+    if isinstance(low, int):
+        return [str(rng.randint(low, high)) for _ in range(samples)]
+    return [repr(rng.uniform(low, high)) for _ in range(samples)]
+
+
+def record_type_name(reading_type: str) -> str:
+    """The record type as Shortcuts names it, e.g. heart-rate -> Heart Rate."""
+    return reading_type.replace("-", " ").title()
+
+
+def synthetic_payload(
+    reading_type: str, samples: int, interval: int = 5, seed: int = 0
+) -> dict:
+    """A payload like the one Shortcuts sends for `samples` readings of
+    `reading_type`, taken every `interval` seconds.
+    """
+    dates = synthetic_dates(samples, interval)
+    values = synthetic_values(reading_type, samples, seed)
+    if reading_type == LEGACY_RECORD_TYPE:
+        return {"hrDates": dates, "hrValues": values}
+    return {"type": record_type_name(reading_type), "dates": dates, "values": values}
@@ -0,0 +1,85 @@
+"""Admission control for uploads. Each upload holds its body and parsed samples
+in memory while it's processed, so processing any number of uploads at once
+can exhaust memory. `AdmissionControl` processes at most `max_concurrent`
+uploads at a time; the next `max_queued` wait for a turn (for up to
+`queue_timeout` seconds), and the rest are turned away straight away:
+
+    admission = AdmissionControl(max_concurrent=4, max_queued=16)
+    async with admission.admit():
+        ...  # read, parse and export the upload
+
+Rejected uploads raise `QueueFullError` (429) or, when they waited too long,
+`ServerBusyError` (503), each with the seconds to wait before retrying.
+"""
+
+import asyncio, math, time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+from .exceptions import QueueFullError, ServerBusyError
+
+# Weight of the latest upload in the running average of processing time:
+SMOOTHING = 0.2
+
+
+class AdmissionControl:
+    """Bounds the number of uploads processed at once, with a bounded queue of
+    uploads waiting for a turn. Uploads are admitted in the order they arrive.
+    """
+
+    def __init__(
+        self, max_concurrent: int, max_queued: int = 0, queue_timeout: float = 30
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiting = 0
+        # Running average of the seconds an upload takes, for Retry-After:
+        self.average_duration = 1.0
+        # Created on first use, so it belongs to the server's event loop:
+        self._semaphore = None
+
+    @asynccontextmanager
+    async def admit(self) -> AsyncIterator[None]:
+        """Waits for a turn to process an upload, raising `QueueFullError` if
+        the queue is full or `ServerBusyError` if no turn came within
+        `queue_timeout` seconds.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        if self._semaphore.locked():
+            if self.waiting >= self.max_queued:
+                raise QueueFullError(
+                    "{} uploads are in progress and {} are waiting".format(
+                        self.active, self.waiting
+                    ),
+                    self.retry_after(),
+                )
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                raise ServerBusyError(
+                    "No upload finished within {} seconds".format(self.queue_timeout),
+                    self.retry_after(),
+                )
+            finally:
+                self.waiting -= 1
+        else:
+            await self._semaphore.acquire()
+        self.active += 1
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._semaphore.release()
+            duration = time.monotonic() - started
+            self.average_duration += SMOOTHING * (duration - self.average_duration)
+
+    def retry_after(self) -> int:
+        """Estimated seconds until the uploads in progress and in the queue are
+        done, going by how long uploads have taken so far (at least 1).
+        """
+        rounds = (self.active + self.waiting) / self.max_concurrent
+        return max(1, math.ceil(rounds * self.average_duration))
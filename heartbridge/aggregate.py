@@ -0,0 +1,188 @@
+"""Resampling of readings into per-minute, per-hour or per-day buckets. Each
+bucket is reduced in a single pass over a `ReadingBatch`, vectorized with
+NumPy when it's installed, so rollups can be stored instead of every raw
+sample.
+"""
+
+import operator, re
+from array import array
+from itertools import groupby, islice
+from typing import Dict, List, Sequence, Union
+from .data import (
+    ColumnarBatch,
+    CyclingDistanceReading,
+    FlightsClimbedReading,
+    ReadingBatch,
+    StepsReading,
+    numpy,
+)
+
+BUCKET_SECONDS = {"minute": 60, "hour": 3600, "day": 86400}
+# Names of record types holding rollups, e.g. heart-rate-per-hour or steps-per-900s:
+ROLLUP_TYPE = re.compile(r"-per-(?:minute|hour|day|\d+s)$")
+
+REDUCERS = ("mean", "min", "max", "count", "sum")
+
+# Cumulative quantities are summed; everything else (heart rate, HRV, ...) is
+# summarized by its mean, range and sample count.
+DEFAULT_REDUCERS = ("mean", "min", "max", "count")
+CUMULATIVE_REDUCERS = ("sum",)
+CUMULATIVE_READINGS = (StepsReading, FlightsClimbedReading, CyclingDistanceReading)
+
+
+class RollupBatch(ColumnarBatch):
+    """Readings reduced into fixed-size time buckets. `timestamps` holds the start
+    of each bucket, and there is one column per reducer, named after the
+    reading's value attribute (e.g. `heart_rate_mean`, `step_count_sum`).
+    """
+
+    def __init__(
+        self,
+        reading_type: str,
+        value_attribute: str,
+        bucket: str,
+        timestamps: array,
+        reduced: Dict[str, array],
+    ):
+        self.reading_type = reading_type
+        self.value_attribute = value_attribute
+        self.bucket = bucket
+        self.timestamps = timestamps
+        self.reduced = reduced
+
+    @property
+    def field_names(self) -> List[str]:
+        return ["timestamp"] + [
+            "{}_{}".format(self.value_attribute, reducer) for reducer in self.reduced
+        ]
+
+    def columns(self) -> List[array]:
+        return list(self.reduced.values())
+
+    def __repr__(self) -> str:
+        return "{}({}, per {}, {} buckets)".format(
+            type(self).__name__, self.reading_type, self.bucket, len(self)
+        )
+
+
+def default_reducers(batch: ReadingBatch) -> Sequence[str]:
+    """The reducers used for a batch when none are given."""
+    if issubclass(batch.reading_cls, CUMULATIVE_READINGS):
+        return CUMULATIVE_REDUCERS
+    return DEFAULT_REDUCERS
+
+
+def resample(
+    batch: ReadingBatch, bucket: Union[str, int], reducers: Sequence[str] = None
+) -> RollupBatch:
+    """Reduces a batch of readings into time buckets.
+
+    Args:
+        batch: The readings to resample
+        bucket: minute, hour, day, or a bucket size in seconds
+        reducers: Any of mean, min, max, count and sum. Defaults to a sum for
+            cumulative record types (steps, flights climbed, cycling distance),
+            and mean/min/max/count for everything else.
+    """
+    seconds = BUCKET_SECONDS.get(bucket, bucket)
+    if not isinstance(seconds, int) or seconds <= 0:
+        raise ValueError(
+            "bucket must be one of {} or a number of seconds".format(
+                ", ".join(BUCKET_SECONDS)
+            )
+        )
+    reducers = tuple(reducers or default_reducers(batch))
+    unknown = set(reducers) - set(REDUCERS)
+    if unknown:
+        raise ValueError("Unknown reducers: {}".format(", ".join(sorted(unknown))))
+
+    if numpy is not None:
+        timestamps, reduced = _reduce_numpy(batch, seconds, reducers)
+    else:
+        timestamps, reduced = _reduce_streaming(batch, seconds, reducers)
+
+    reading_type = batch.reading_type or batch.value_attribute
+    if isinstance(bucket, str):
+        reading_type = "{}-per-{}".format(reading_type, bucket)
+    else:
+        reading_type = "{}-per-{}s".format(reading_type, seconds)
+    return RollupBatch(
+        reading_type, batch.value_attribute, str(bucket), timestamps, reduced
+    )
+
+
+def reducer_typecode(reducer: str, value_typecode: str) -> str:
+    """Typecode of a reducer's column, for values stored with `value_typecode`."""
+    if reducer == "mean":
+        return "d"
+    if reducer == "count":
+        return "q"
+    return value_typecode
+
+
+def _reduce_streaming(batch: ReadingBatch, seconds: int, reducers: Sequence[str]):
+    """Single pass over time-ordered samples, reducing each bucket as it ends."""
+    samples = zip(batch.timestamps, batch.values)
+    if any(map(operator.gt, batch.timestamps, islice(batch.timestamps, 1, None))):
+        samples = iter(sorted(samples, key=operator.itemgetter(0)))
+
+    typecode = batch.values.typecode
+    timestamps = array("q")
+    reduced = {
+        reducer: array(reducer_typecode(reducer, typecode)) for reducer in reducers
+    }
+    for bucket, group in groupby(samples, key=lambda sample: sample[0] // seconds):
+        values = [value for _, value in group]
+        timestamps.append(bucket * seconds)
+        total = sum(values)
+        for reducer, column in reduced.items():
+            if reducer == "mean":
+                column.append(total / len(values))
+            elif reducer == "min":
+                column.append(min(values))
+            elif reducer == "max":
+                column.append(max(values))
+            elif reducer == "count":
+                column.append(len(values))
+            else:
+                column.append(total)
+    return timestamps, reduced
+
+
+def _reduce_numpy(batch: ReadingBatch, seconds: int, reducers: Sequence[str]):
+    """Vectorized equivalent of `_reduce_streaming`, using `ufunc.reduceat` over
+    the runs of samples falling in the same bucket.
+    """
+    typecode = batch.values.typecode
+    if len(batch) == 0:
+        return array("q"), {
+            reducer: array(reducer_typecode(reducer, typecode)) for reducer in reducers
+        }
+    timestamps, values = batch.as_numpy()
+    if numpy.any(timestamps[1:] < timestamps[:-1]):
+        order = numpy.argsort(timestamps, kind="stable")
+        timestamps, values = timestamps[order], values[order]
+
+    buckets = timestamps // seconds
+    starts = numpy.concatenate(([0], numpy.flatnonzero(numpy.diff(buckets)) + 1))
+    counts = numpy.diff(numpy.append(starts, len(buckets)))
+    totals = numpy.add.reduceat(values, starts)
+    results = {
+        "mean": lambda: totals / counts,
+        "min": lambda: numpy.minimum.reduceat(values, starts),
+        "max": lambda: numpy.maximum.reduceat(values, starts),
+        "count": lambda: counts,
+        "sum": lambda: totals,
+    }
+    reduced = {
+        reducer: _from_numpy(reducer_typecode(reducer, typecode), results[reducer]())
+        for reducer in reducers
+    }
+    return _from_numpy("q", buckets[starts] * seconds), reduced
+
+
+def _from_numpy(typecode: str, values) -> array:
+    dtype = numpy.int64 if typecode == "q" else numpy.float64
+    result = array(typecode)
+    result.frombytes(numpy.ascontiguousarray(values, dtype=dtype).tobytes())
+    return result
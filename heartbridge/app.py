@@ -4,49 +4,426 @@ the HTTP server and processes JSON data from Shortcuts when
 ```cli()``` is run.
 """
 
-import socket, logging, json
+import asyncio, functools, socket, logging, json, os, sys, time, uuid
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Iterator, List, Tuple, Union
 import uvicorn
 import click
 from starlette.applications import Starlette
-from starlette.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response, StreamingResponse
 from starlette.routing import Route
-from heartbridge.health import Health
-from heartbridge.exception_handlers import EXCEPTION_HANDLER_MAPPING
+from heartbridge import codec, metrics, sessions, spool
+from heartbridge.admission import AdmissionControl
+from heartbridge.applehealth import HEALTHKIT_TYPES, import_export
+from heartbridge.compression import BodyDecompressor
+from heartbridge.constants import READING_MAPPING
+from heartbridge.data import ReadingBatch
+from heartbridge.dedup import UploadCache
+from heartbridge.exceptions import BodyTooLargeError, LoadingError
+from heartbridge.health import Health, batch_records, check_sample_count, count_samples
+from heartbridge.ingest import IngestReport, ingest_paths
+from heartbridge.query import RangeQuery, parse_time_bound
+from heartbridge.responses import JSONResponse
+from heartbridge.sessions import (
+    UploadSessions,
+    session_reading_type,
+    session_status,
+)
+from heartbridge.metrics import (
+    MetricsRegistry,
+    UploadMetrics,
+    enable_json_log,
+    stage_timer,
+)
+from heartbridge.stream import ParsedPayload, ShortcutsStreamParser, parse_file
+from heartbridge.wide import (
+    FILL_POLICIES,
+    WIDE_READING_TYPES,
+    WideExport,
+    bucket_seconds,
+)
+from heartbridge.exception_handlers import (
+    EXCEPTION_HANDLER_MAPPING,
+    ERROR_RESPONSES,
+    error_details,
+    error_response,
+)
 
 logging.basicConfig(
     format="%(asctime)s - %(levelname)s - %(message)s", level=logging.ERROR
 )
 
 
+def check_body_size(size: int) -> None:
+    """Raises `BodyTooLargeError` if `size` bytes is more than a request body may
+    be (`app.state.MAX_BODY_SIZE`).
+    """
+    max_size = app.state.MAX_BODY_SIZE
+    if max_size is not None and size > max_size:
+        raise BodyTooLargeError(
+            "The request body is larger than {} bytes".format(max_size)
+        )
+
+
+async def raw_chunks(request, upload: UploadMetrics = metrics.DISABLED):
+    """Yields the request body as it was sent, chunk by chunk as it arrives. A
+    body larger than `app.state.MAX_BODY_SIZE` is rejected by its Content-Length
+    before any of it is read, or as soon as the limit is passed if it was sent
+    without one. The bytes received are counted in `upload`.
+    """
+    try:
+        check_body_size(int(request.headers.get("content-length", 0)))
+    except ValueError:
+        pass  # the server rejects invalid Content-Length headers itself
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        check_body_size(received)
+        upload.bytes += len(chunk)
+        yield chunk
+
+
+async def body_chunks(request, upload: UploadMetrics = metrics.DISABLED):
+    """Yields the request body chunk by chunk as it arrives. Bodies sent with a
+    gzip or deflate Content-Encoding are decompressed on the fly, up to
+    `app.state.MAX_DECOMPRESSED_SIZE` bytes. The bytes received are counted in
+    `upload`.
+    """
+    decompressor = BodyDecompressor(
+        request.headers.get("content-encoding"), app.state.MAX_DECOMPRESSED_SIZE
+    )
+    async for chunk in raw_chunks(request, upload):
+        for piece in decompressor.decompress(chunk):
+            yield piece
+    for piece in decompressor.flush():
+        yield piece
+
+
+async def read_body(
+    request, upload: UploadMetrics = metrics.DISABLED
+) -> Union[bytes, bytearray]:
+    """Reads the whole (decompressed) request body."""
+    if request.headers.get("content-encoding", "identity") == "identity":
+        return b"".join([chunk async for chunk in raw_chunks(request, upload)])
+    body = bytearray()
+    async for piece in body_chunks(request, upload):
+        body += piece
+    return body
+
+
+async def read_streaming_body(
+    request, upload: UploadMetrics = metrics.DISABLED
+) -> dict:
+    """Tokenizes the request body chunk by chunk as it arrives, returning the
+    payload with dates and values already converted to columns.
+
+    Converting dates is CPU-bound, so like `load_health` it happens off the
+    event loop: in `app.state.EXECUTOR` if that's a thread pool, or the event
+    loop's default one otherwise (the parser's state can't be shared with a
+    process pool).
+    """
+    executor = app.state.EXECUTOR
+    if not isinstance(executor, ThreadPoolExecutor):
+        executor = None
+    loop = asyncio.get_running_loop()
+    parser = ShortcutsStreamParser()
+    async for chunk in body_chunks(request, upload):
+        await loop.run_in_executor(executor, parser.feed, chunk)
+    return await loop.run_in_executor(executor, parser.close)
+
+
+def health_options() -> dict:
+    """Keyword arguments for `Health` instances, taken from the app's settings."""
+    return {
+        "output_dir": app.state.OUTPUT_DIRECTORY,
+        "output_format": app.state.OUTPUT_FORMAT,
+        "rollup": app.state.ROLLUP,
+        "instrument": instrumented(),
+        "drop_invalid": app.state.DROP_INVALID,
+        "partition": app.state.PARTITION,
+        "summarize": app.state.SUMMARY,
+        "gap_threshold": app.state.GAP_THRESHOLD,
+        "max_samples": app.state.MAX_SAMPLES,
+    }
+
+
+def instrumented() -> bool:
+    """Whether uploads are measured, for `GET /metrics` or JSON log lines."""
+    return app.state.METRICS is not None or app.state.LOG_METRICS
+
+
+def upload_metrics() -> UploadMetrics:
+    """Measurements for a new upload; these do nothing if instrumentation is off."""
+    return UploadMetrics() if instrumented() else metrics.DISABLED
+
+
+def finish_upload(upload: UploadMetrics, status_code: int) -> None:
+    """Records the outcome of an upload in the registry and the JSON log."""
+    if not upload.enabled or upload.status_code is not None:
+        return
+    upload.finish(status_code)
+    if app.state.METRICS is not None:
+        app.state.METRICS.observe(upload)
+    metrics.log_upload(upload)
+
+
+def measure_health(upload: UploadMetrics, health: Health, samples: int = None) -> None:
+    """Copies what was measured while loading `health` into `upload`, with the
+    number of `samples` loaded (unless they're all in `health.readings`).
+    """
+    upload.record_type = (
+        health.reading_type_slug
+        if health.reading_type_slug in READING_MAPPING
+        else metrics.OTHER_RECORD_TYPE
+    )
+    upload.samples = len(health.readings) if samples is None else samples
+    upload.add_timings(health.timings)
+
+
+async def export_health(health: Health, upload: UploadMetrics) -> dict:
+    """Exports the readings loaded into `health`, returning the exported `file`.
+
+    With the upload cache on (`--dedup`, see `heartbridge.dedup`), an upload
+    that was already exported isn't exported again, and of an upload overlapping
+    earlier ones, only the samples that aren't stored with the same value yet
+    are exported. `duplicate` is set in the result when there was nothing new
+    to export, and `skipped_samples` counts the samples that were skipped.
+    """
+    cache = app.state.UPLOAD_CACHE
+    with upload.time("export"):
+        if cache is None:
+            return {"file": str(await run_in_executor(health.export))}
+        key = await run_in_threadpool(cache.digest, health)
+        previous = await run_in_threadpool(cache.lookup, key)
+        if previous is not None:
+            return {"file": previous, "duplicate": True}
+        received = health.readings
+        new = await run_in_threadpool(cache.new_samples, health)
+        result = {}
+        if len(new) < len(received):
+            result["skipped_samples"] = len(received) - len(new)
+        if len(new) == 0:
+            return {"duplicate": True, **result}
+        health.readings = new
+        try:
+            export_filename = await run_in_executor(health.export)
+        finally:
+            health.readings = received
+        await run_in_threadpool(cache.add, key, health, new, export_filename)
+        return {"file": str(export_filename), **result}
+
+
+BATCH = "batch"
+
+
+def load_health(
+    data: Union[bytes, bytearray, dict, list], options: dict
+) -> Tuple[str, Union[Health, List[dict]]]:
+    """Decodes and loads a payload from Shortcuts. `data` is either the raw JSON
+    body, a decoded payload, or a payload already tokenized by
+    `read_streaming_body`, and `options` are passed on to `Health` (see
+    `health_options`). Returns the record type sent by Shortcuts along with the
+    loaded `Health` instance.
+
+    Batches carrying several record types aren't loaded here: `BATCH` is returned
+    along with the list of records, to be loaded separately by `ingest_records`.
+
+    This is CPU-bound, so it runs in `app.state.EXECUTOR` rather than on the
+    event loop. It must stay a module-level function so it can be sent to a
+    process pool.
+    """
+    health = Health(**options)
+    if isinstance(data, (bytes, bytearray)):
+        with stage_timer(health.timings, "decode"):
+            data = codec.loads(data)
+        records = batch_records(data)
+        if records is not None:
+            check_sample_count(count_samples(records), options.get("max_samples"))
+            return BATCH, records
+    elif isinstance(data, list):
+        records = batch_records(data)
+        check_sample_count(count_samples(records), options.get("max_samples"))
+        return BATCH, records
+    if isinstance(data, ParsedPayload):
+        health.load_from_columns(data)
+    else:
+        health.load_from_shortcuts(data)
+    return data.get("type", "health"), health
+
+
+def load_spooled_body(path: Path, streaming: bool, options: dict) -> Tuple[str, Health]:
+    """Like `load_health`, for a request body saved in the spool. In streaming
+    mode the file is tokenized in chunks rather than read into memory.
+    """
+    data = parse_file(path) if streaming else path.read_bytes()
+    return load_health(data, options)
+
+
+async def run_in_executor(func, *args):
+    """Runs a blocking function in the configured executor (the event loop's
+    default thread pool if none was configured) and waits for the result.
+    Exceptions are re-raised here, so they reach the app's exception handlers.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(app.state.EXECUTOR, func, *args)
+
+
+def make_executor(kind: str, max_workers: int = None) -> Executor:
+    """Creates the executor used for parsing and exporting: either a thread
+    pool or a process pool.
+    """
+    if kind == "process":
+        return ProcessPoolExecutor(max_workers=max_workers)
+    return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="heartbridge")
+
+
+async def ingest_record(record: dict, options: dict) -> dict:
+    """Loads and exports one record of a batch upload, returning a summary of the
+    result. Errors are reported in the summary rather than raised, so one bad
+    record doesn't stop the others from being exported.
+    """
+    result = {"type": record.get("type"), "samples": 0}
+    upload = upload_metrics()
+    try:
+        record_type, health = await run_in_executor(load_health, record, options)
+        measure_health(upload, health)
+        result["samples"] = len(health.readings)
+        if health.dropped:
+            result["dropped_samples"] = health.dropped
+        if health.summary is not None:
+            result["summary"] = health.summary
+        if len(health.readings) > 0:
+            exported = await export_health(health, upload)
+            result.update(exported)
+            if exported.get("duplicate"):
+                status_code, message = 200, "Data was already exported"
+            else:
+                status_code, message = 200, "Data exported successfully"
+                click.echo(
+                    "\033[92m\U00002705"
+                    + f" Successfully exported {record_type} data to {exported['file']}"
+                    + "\033[0m"
+                )
+        else:
+            status_code, message = 400, "No data was passed for this record type"
+    except Exception as e:
+        logging.error(f"Could not ingest {result['type']} data: {e}")
+        status_code, message = error_response(e)
+        result.update(error_details(e))
+    finish_upload(upload, status_code)
+    result.update(status_code=status_code, message=message)
+    return result
+
+
+async def ingest_records(records: List[dict], options: dict) -> List[dict]:
+    """Loads and exports the records of a batch upload concurrently, returning a
+    summary for each record (see `ingest_record`) in the order they were sent.
+    Records of the same type are exported one after the other, since they may
+    write to the same file.
+    """
+    groups = {}
+    for position, record in enumerate(records):
+        key = str(record.get("type", "")).lower().replace(" ", "-")
+        groups.setdefault(key, []).append(position)
+
+    results = [None] * len(records)
+
+    async def ingest_group(positions: List[int]) -> None:
+        for position in positions:
+            results[position] = await ingest_record(records[position], options)
+
+    await asyncio.gather(*(ingest_group(positions) for positions in groups.values()))
+    return results
+
+
+def admitted(endpoint):
+    """Decorates an endpoint receiving uploads. With admission control on,
+    requests wait for a turn first (see `heartbridge.admission`), so only a
+    bounded number of request bodies are read and processed at once.
+    """
+
+    @functools.wraps(endpoint)
+    async def admit(request):
+        if app.state.ADMISSION is None:
+            return await endpoint(request)
+        async with app.state.ADMISSION.admit():
+            return await endpoint(request)
+
+    return admit
+
+
+@admitted
 async def capture_health_data(request):
+    if app.state.SPOOL is not None:
+        return await spool_health_data(request)
+    upload = upload_metrics()
+    try:
+        response = await ingest_request(request, upload)
+    except Exception as e:
+        finish_upload(upload, error_response(e)[0])
+        raise
+    finish_upload(upload, response.status_code)
+    return response
+
+
+async def ingest_request(request, upload: UploadMetrics):
+    """Loads and exports the upload in `request`, measuring it in `upload`."""
     try:
-        health_data = await request.json()
+        if app.state.STREAMING_INGEST:
+            # Includes the time spent waiting for the body to arrive:
+            with upload.time("decode"):
+                body = await read_streaming_body(request, upload)
+        else:
+            body = await read_body(request, upload)
+        record_type, health = await run_in_executor(load_health, body, health_options())
     except json.decoder.JSONDecodeError:
         logging.error(
             "Error parsing JSON data; ensure valid JSON was sent to the endpoint"
         )
+        status_code, message = ERROR_RESPONSES[json.decoder.JSONDecodeError]
+        return JSONResponse({"message": message}, status_code=status_code)
+
+    if record_type == BATCH:
+        # Samples are counted under each record type, by `ingest_record`:
+        upload.record_type = BATCH
+        results = await ingest_records(health, health_options())
+        exported = sum(result["status_code"] == 200 for result in results)
         return JSONResponse(
-            {"message": "Could not read JSON data from Shortcuts"}, status_code=400
+            {
+                "message": f"Exported {exported} of {len(results)} record types",
+                "results": results,
+            },
+            # Multi-Status when only some of the record types could be exported:
+            status_code=200 if exported == len(results) else 207,
         )
 
-    record_type = health_data.get("type", "health")
-    health = Health(app.state.OUTPUT_DIRECTORY, app.state.OUTPUT_FORMAT)
-
-    health.load_from_shortcuts(health_data)
-
+    measure_health(upload, health)
     click.echo(
         "\u001b[33m\U0001F49B"
         + f" Detected {record_type} data with {len(health.readings)} samples."
         + "\033[0m"
     )
     if len(health.readings) > 0:
-        export_filename = health.export()
-        click.echo(
-            "\033[92m\U00002705"
-            + f" Successfully exported data to {export_filename}"
-            + "\033[0m"
-        )
-        return JSONResponse({"message": "Data exported successfully"}, status_code=200)
+        exported = await export_health(health, upload)
+        if exported.get("duplicate"):
+            click.echo("This data was already exported. Export will not continue.")
+            content = {"message": "Data was already exported", **exported}
+        else:
+            click.echo(
+                "\033[92m\U00002705"
+                + f" Successfully exported data to {exported['file']}"
+                + "\033[0m"
+            )
+            content = {"message": "Data exported successfully", **exported}
+        if health.dropped:
+            content["dropped_samples"] = health.dropped
+            content["errors"] = health.dropped_samples
+        if health.summary is not None:
+            content["summary"] = health.summary
+        return JSONResponse(content, status_code=200)
     else:
         click.echo(
             "No data was found in body from Shortcuts. Export will not continue."
@@ -59,14 +436,495 @@ async def capture_health_data(request):
         )
 
 
-routes = [Route("/", endpoint=capture_health_data, methods=["POST"])]
+async def spool_health_data(request):
+    """Accept-then-process mode: saves the body to the spool and responds with
+    202 straight away. The body is exported later by `process_spool`.
+    """
+    body = await read_body(request)
+    job_id = await run_in_threadpool(app.state.SPOOL.submit, bytes(body))
+    await app.state.SPOOL_QUEUE.put(job_id)
+    return JSONResponse(
+        {
+            "message": "Data accepted for processing",
+            "job_id": job_id,
+            "status_url": f"/jobs/{job_id}",
+        },
+        status_code=202,
+    )
+
+
+def upload_sessions() -> UploadSessions:
+    """The resumable upload sessions, kept in the output directory (see
+    `heartbridge.sessions`).
+    """
+    return UploadSessions(
+        Path(app.state.OUTPUT_DIRECTORY or ".") / sessions.SESSION_DIRECTORY
+    )
+
+
+async def read_json(request):
+    """Reads and decodes a (possibly compressed) JSON request body; an empty
+    body is decoded as an empty object.
+    """
+    body = await read_body(request)
+    if not body.strip():
+        return {}
+    try:
+        return codec.loads(body)
+    except json.decoder.JSONDecodeError:
+        raise LoadingError("Could not read JSON data from the request body")
+
+
+def session_not_found() -> JSONResponse:
+    return JSONResponse({"message": "Upload session not found"}, status_code=404)
+
+
+def load_chunk(body: bytes, reading_type: str, options: dict) -> Health:
+    """Like `load_health`, for one chunk of an upload session: `body` carries
+    the dates and values of readings of `reading_type` (as sent by Shortcuts).
+    """
+    health = Health(**options)
+    with stage_timer(health.timings, "decode"):
+        try:
+            data = codec.loads(body)
+        except json.decoder.JSONDecodeError:
+            raise LoadingError("Could not read JSON data from the chunk")
+    if not isinstance(data, dict):
+        raise LoadingError("Chunks must be sent as a JSON object")
+    data["type"] = reading_type
+    health.load_from_shortcuts(data)
+    return health
+
+
+def export_session(
+    upload_sessions: UploadSessions, session_id: str, options: dict
+) -> Tuple[Health, str, int]:
+    """Exports the readings of every chunk of an upload session, merged in
+    timestamp order a batch at a time (see `UploadSessions.batches`). Returns
+    the `Health` instance that exported them (holding their `summary`), the
+    file exported and the number of readings exported.
+    """
+    health = Health(**options)
+    health.reading_type_slug = session_reading_type(upload_sessions.state(session_id))
+    samples = 0
+
+    def counted() -> Iterator[ReadingBatch]:
+        nonlocal samples
+        for batch in upload_sessions.batches(session_id):
+            samples += len(batch)
+            yield batch
+
+    start, end = upload_sessions.time_range(session_id)
+    export_filename = health.export_batches(counted(), start, end)
+    return health, str(export_filename), samples
+
+
+async def open_upload_session(request):
+    """Opens a resumable upload session, for `type` readings sent in chunks."""
+    data = await read_json(request)
+    if not isinstance(data, dict):
+        raise LoadingError("Upload sessions must be opened with a JSON object")
+    state = await run_in_threadpool(
+        upload_sessions().open, data.get("type"), data.get("chunks")
+    )
+    session_url = "/uploads/{}".format(state["id"])
+    return JSONResponse(
+        {
+            "message": "Upload session opened",
+            "session_id": state["id"],
+            "session_url": session_url,
+            "chunk_url": session_url + "/chunks/{number}",
+            "commit_url": session_url + "/commit",
+        },
+        status_code=201,
+    )
+
+
+async def upload_session_status(request):
+    state = await run_in_threadpool(
+        upload_sessions().state, request.path_params["session_id"]
+    )
+    if state is None:
+        return session_not_found()
+    return JSONResponse(session_status(state), status_code=200)
+
+
+async def remove_upload_session(request):
+    removed = await run_in_threadpool(
+        upload_sessions().remove, request.path_params["session_id"]
+    )
+    if not removed:
+        return session_not_found()
+    return JSONResponse({"message": "Upload session removed"}, status_code=200)
+
+
+@admitted
+async def upload_session_chunk(request):
+    """Validates, parses and saves one numbered chunk of an upload session.
+    Chunks that were already received are skipped without being parsed again.
+    """
+    store = upload_sessions()
+    session_id = request.path_params["session_id"]
+    number = request.path_params["number"]
+    state = await run_in_threadpool(store.state, session_id)
+    if state is None:
+        return session_not_found()
+    upload = upload_metrics()
+    try:
+        body = bytes(await read_body(request, upload))
+        duplicate = await run_in_threadpool(store.has_chunk, session_id, number, body)
+        content = {"message": "Chunk received", "chunk": number}
+        if not duplicate:
+            # The summary is computed over the whole upload, on commit:
+            options = {**health_options(), "summarize": False}
+            health = await run_in_executor(load_chunk, body, state["type"], options)
+            measure_health(upload, health)
+            check_sample_count(
+                state["samples"] + len(health.readings), options["max_samples"]
+            )
+            state, duplicate = await run_in_threadpool(
+                store.add_chunk,
+                session_id,
+                number,
+                body,
+                health.readings,
+            )
+            content["samples"] = len(health.readings)
+            if health.dropped:
+                content["dropped_samples"] = health.dropped
+                content["errors"] = health.dropped_samples
+        if duplicate:
+            content["message"] = "Chunk was already received"
+            content["duplicate"] = True
+    except Exception as e:
+        finish_upload(upload, error_response(e)[0])
+        raise
+    finish_upload(upload, 200)
+    content["session_samples"] = state["samples"]
+    content["received_chunks"] = len(state["chunks"])
+    return JSONResponse(content, status_code=200)
+
+
+@admitted
+async def commit_upload_session(request):
+    """Exports the readings of every chunk of an upload session. Committing a
+    session that was already committed returns the result of that commit.
+    """
+    store = upload_sessions()
+    session_id = request.path_params["session_id"]
+    state = await run_in_threadpool(store.state, session_id)
+    if state is None:
+        return session_not_found()
+    if state["status"] == sessions.COMMITTED:
+        return JSONResponse(state["result"], status_code=200)
+    data = await read_json(request)
+    chunks = data.get("chunks") if isinstance(data, dict) else None
+    await run_in_threadpool(store.begin_commit, session_id, chunks)
+    upload = upload_metrics()
+    try:
+        with upload.time("export"):
+            health, export_filename, samples = await run_in_executor(
+                export_session, store, session_id, health_options()
+            )
+        measure_health(upload, health, samples)
+    except Exception as e:
+        finish_upload(upload, error_response(e)[0])
+        # The session is open again, so the commit can be retried:
+        await run_in_threadpool(store.finish, session_id)
+        raise
+    click.echo(
+        "\033[92m\U00002705"
+        + f" Successfully exported {state['type']} data to {export_filename}"
+        + "\033[0m"
+    )
+    content = {
+        "message": "Data exported successfully",
+        "samples": samples,
+        "file": export_filename,
+    }
+    if health.summary is not None:
+        content["summary"] = health.summary
+    await run_in_threadpool(
+        store.finish, session_id, status=sessions.COMMITTED, result=content
+    )
+    finish_upload(upload, 200)
+    return JSONResponse(content, status_code=200)
+
+
+async def metrics_endpoint(request):
+    """Upload metrics in the Prometheus text format (see `MetricsRegistry`)."""
+    if app.state.METRICS is None:
+        return JSONResponse(
+            {"message": "Metrics are not enabled; start heartbridge with --metrics"},
+            status_code=404,
+        )
+    return Response(
+        app.state.METRICS.render(),
+        media_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+
+async def job_status(request):
+    job_id = request.path_params["job_id"]
+    status = None
+    if app.state.SPOOL is not None:
+        status = await run_in_threadpool(app.state.SPOOL.status, job_id)
+    if status is None:
+        return JSONResponse({"message": "Job not found"}, status_code=404)
+    return JSONResponse(status, status_code=200)
+
+
+async def query_readings(request):
+    """Streams the stored readings of one record type in a `[start, end)` window,
+    as a JSON array. Responses carry an ETag, and a matching If-None-Match
+    header gets an empty 304 response.
+    """
+    try:
+        start = parse_time_bound(request.query_params.get("start"))
+        end = parse_time_bound(request.query_params.get("end"))
+    except ValueError:
+        return JSONResponse(
+            {
+                "message": "start and end must be dates or timestamps, e.g. 2021-04-01 or 2021-04-01 08:00:00"
+            },
+            status_code=400,
+        )
+    try:
+        query = RangeQuery(
+            app.state.OUTPUT_DIRECTORY,
+            app.state.OUTPUT_FORMAT,
+            request.path_params["reading_type"],
+            start,
+            end,
+        )
+    except ValueError as e:
+        return JSONResponse({"message": str(e)}, status_code=400)
+    etag = await run_in_threadpool(query.etag)
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in (tag.strip().replace("W/", "", 1) for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers={"ETag": etag})
+    return StreamingResponse(
+        query.json_chunks(), media_type="application/json", headers={"ETag": etag}
+    )
+
+
+async def process_spooled_job(job_id: str) -> None:
+    """Loads and exports one spooled body, recording its progress in the spool."""
+    job_spool = app.state.SPOOL
+    upload = upload_metrics()
+    try:
+        await run_in_threadpool(job_spool.update, job_id, status=spool.PARSING)
+        record_type, health = await run_in_executor(
+            load_spooled_body,
+            job_spool.body_path(job_id),
+            app.state.STREAMING_INGEST,
+            health_options(),
+        )
+        if record_type == BATCH:
+            await run_in_threadpool(
+                job_spool.update, job_id, status=spool.EXPORTING, record_type=BATCH
+            )
+            results = await ingest_records(health, health_options())
+            succeeded = all(result["status_code"] == 200 for result in results)
+            await run_in_threadpool(
+                job_spool.update,
+                job_id,
+                status=spool.DONE if succeeded else spool.FAILED,
+                samples=sum(result["samples"] for result in results),
+                results=results,
+            )
+            return
+        measure_health(upload, health)
+        samples = len(health.readings)
+        if samples == 0:
+            finish_upload(upload, 400)
+            await run_in_threadpool(
+                job_spool.update,
+                job_id,
+                status=spool.FAILED,
+                record_type=record_type,
+                samples=0,
+                error={"status_code": 400, "message": "No data was passed"},
+            )
+            return
+        await run_in_threadpool(
+            job_spool.update,
+            job_id,
+            status=spool.EXPORTING,
+            record_type=record_type,
+            samples=samples,
+        )
+        exported = await export_health(health, upload)
+        if health.summary is not None:
+            exported["summary"] = health.summary
+        finish_upload(upload, 200)
+        await run_in_threadpool(job_spool.update, job_id, status=spool.DONE, **exported)
+        if not exported.get("duplicate"):
+            click.echo(
+                "\033[92m\U00002705"
+                + f" Successfully exported {record_type} data to {exported['file']}"
+                + "\033[0m"
+            )
+    except Exception as e:
+        logging.error(f"Spooled job {job_id} failed: {e}")
+        status_code, message = error_response(e)
+        finish_upload(upload, status_code)
+        await run_in_threadpool(
+            job_spool.update,
+            job_id,
+            status=spool.FAILED,
+            error={"status_code": status_code, "message": message, **error_details(e)},
+        )
+
+
+async def process_spool() -> None:
+    """Background worker draining the spool queue, one job at a time."""
+    while True:
+        job_id = await app.state.SPOOL_QUEUE.get()
+        try:
+            await process_spooled_job(job_id)
+        finally:
+            app.state.SPOOL_QUEUE.task_done()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """Starts the spool worker when accept-then-process mode is on, replaying
+    any jobs that were left unfinished by a previous run (and not claimed by
+    another server process).
+    """
+    worker = None
+    if app.state.SPOOL_DIRECTORY:
+        app.state.SPOOL = spool.Spool(app.state.SPOOL_DIRECTORY, app.state.RUN_ID)
+        app.state.SPOOL_QUEUE = asyncio.Queue()
+        for job_id in await run_in_threadpool(app.state.SPOOL.pending):
+            # With several server processes, each job is replayed by one of them:
+            if await run_in_threadpool(app.state.SPOOL.claim, job_id):
+                app.state.SPOOL_QUEUE.put_nowait(job_id)
+        worker = asyncio.create_task(process_spool())
+    try:
+        yield
+    finally:
+        if worker is not None:
+            worker.cancel()
+            app.state.SPOOL = None
+
+
+routes = [
+    Route("/", endpoint=capture_health_data, methods=["POST"]),
+    Route("/jobs/{job_id}", endpoint=job_status, methods=["GET"]),
+    Route("/uploads", endpoint=open_upload_session, methods=["POST"]),
+    Route(
+        "/uploads/{session_id}",
+        endpoint=upload_session_status,
+        methods=["GET"],
+    ),
+    Route(
+        "/uploads/{session_id}",
+        endpoint=remove_upload_session,
+        methods=["DELETE"],
+    ),
+    Route(
+        "/uploads/{session_id}/chunks/{number:int}",
+        endpoint=upload_session_chunk,
+        methods=["POST"],
+    ),
+    Route(
+        "/uploads/{session_id}/commit",
+        endpoint=commit_upload_session,
+        methods=["POST"],
+    ),
+    Route("/readings/{reading_type}", endpoint=query_readings, methods=["GET"]),
+    Route("/metrics", endpoint=metrics_endpoint, methods=["GET"]),
+]
 
 app = Starlette(
-    debug=False, routes=routes, exception_handlers=EXCEPTION_HANDLER_MAPPING
+    debug=False,
+    routes=routes,
+    exception_handlers=EXCEPTION_HANDLER_MAPPING,
+    lifespan=lifespan,
 )
+app.state.OUTPUT_DIRECTORY = None
+app.state.OUTPUT_FORMAT = "csv"
+app.state.ROLLUP = None
+app.state.STREAMING_INGEST = False
+app.state.EXECUTOR = None
+app.state.SPOOL_DIRECTORY = None
+app.state.SPOOL = None
+app.state.MAX_DECOMPRESSED_SIZE = 512 * 1024 * 1024
+app.state.METRICS = None
+app.state.LOG_METRICS = False
+app.state.DROP_INVALID = False
+app.state.UPLOAD_CACHE = None
+app.state.PARTITION = False
+app.state.RUN_ID = None
+app.state.SUMMARY = False
+app.state.GAP_THRESHOLD = 3600
+app.state.MAX_BODY_SIZE = None
+app.state.MAX_SAMPLES = None
+app.state.ADMISSION = None
+
+# Environment variable passing the server settings to worker processes:
+SETTINGS_VARIABLE = "HEARTBRIDGE_SETTINGS"
 
 
-@click.command()
+def configure(settings: dict) -> None:
+    """Sets the app state variables used during export from the server settings
+    (the options of `cli`, by name). Worker processes don't share `app.state`,
+    so each of them calls this on startup (see `create_app`).
+    """
+    app.state.OUTPUT_DIRECTORY = settings["directory"]
+    app.state.OUTPUT_FORMAT = settings["type"]
+    app.state.ROLLUP = settings["rollup"]
+    app.state.STREAMING_INGEST = settings["stream"]
+    app.state.EXECUTOR = make_executor(settings["pool"], settings["pool_size"])
+    app.state.SPOOL_DIRECTORY = settings["spool_directory"]
+    app.state.MAX_DECOMPRESSED_SIZE = settings["max_decompressed_size"] * 1024 * 1024
+    app.state.METRICS = MetricsRegistry() if settings["metrics"] else None
+    app.state.LOG_METRICS = settings["log_metrics"]
+    app.state.DROP_INVALID = settings["drop_invalid"]
+    app.state.UPLOAD_CACHE = (
+        UploadCache(settings["dedup_size"], settings["dedup_file"])
+        if settings["dedup"]
+        else None
+    )
+    app.state.PARTITION = settings["partition"]
+    app.state.RUN_ID = settings["run_id"]
+    app.state.SUMMARY = settings["summary"]
+    app.state.GAP_THRESHOLD = settings["gap_threshold"] * 60
+    app.state.MAX_BODY_SIZE = settings["max_body_size"] * 1024 * 1024
+    app.state.MAX_SAMPLES = settings["max_samples"]
+    app.state.ADMISSION = (
+        AdmissionControl(
+            settings["max_concurrent_uploads"],
+            settings["max_queued_uploads"],
+            settings["queue_timeout"],
+        )
+        if settings["max_concurrent_uploads"]
+        else None
+    )
+    if settings["log_metrics"]:
+        enable_json_log()
+
+
+def create_app() -> Starlette:
+    """Configures the app in a worker process of `heartbridge --workers`, from the
+    settings the main process passed in the HEARTBRIDGE_SETTINGS environment
+    variable.
+    """
+    configure(json.loads(os.environ[SETTINGS_VARIABLE]))
+    return app
+
+
+# Shared by the server and the commands exporting saved data:
+partition_option = click.option(
+    "--partition/--no-partition",
+    default=False,
+    help="Keep CSV and JSON exports in one file per record type and day (e.g. heart-rate/2021/04/01.csv), merging every upload into the days it covers without duplicating samples, instead of writing a file per upload.",
+)
+
+
+@click.group(invoke_without_command=True)
 @click.option(
     "--directory",
     default=None,
@@ -76,8 +934,8 @@ app = Starlette(
 @click.option(
     "--type",
     default="csv",
-    help="Set the output file type. Can be csv or json. Defaults to csv.",
-    type=click.Choice(["csv", "json"]),
+    help="Set the output file type. Can be csv, json or sqlite (one heartbridge.sqlite database with a table per record type). Defaults to csv.",
+    type=click.Choice(["csv", "json", "sqlite"]),
 )
 @click.option(
     "--port",
@@ -85,15 +943,472 @@ app = Starlette(
     help="Set the port to listen for HTTP requests on. Defaults to 8888.",
     type=click.IntRange(1024, 65535),
 )
-def cli(directory: str, type: str, port: int):
-    """Opens a temporary HTTP endpoint to send health data from Shortcuts to your computer."""
+@click.option(
+    "--stream/--no-stream",
+    default=False,
+    help="Parse request bodies incrementally as they arrive, instead of loading the whole body first. Keeps memory use low for large date ranges.",
+)
+@click.option(
+    "--pool",
+    default="thread",
+    help="Run parsing and file export in a pool of threads or processes, so the server keeps accepting requests while large uploads are processed. Defaults to thread.",
+    type=click.Choice(["thread", "process"]),
+)
+@click.option(
+    "--pool-size",
+    default=None,
+    help="Set the number of threads or processes in the pool. Defaults to a size based on the number of CPUs.",
+    type=click.IntRange(1),
+)
+@click.option(
+    "--spool",
+    "spool_directory",
+    default=None,
+    help="Respond to uploads straight away and export them in the background. Request bodies are saved to this directory until they have been exported, and unfinished uploads are resumed when heartbridge restarts.",
+    type=click.Path(exists=False, file_okay=False),
+)
+@click.option(
+    "--rollup",
+    default=None,
+    help="Export per-minute, per-hour or per-day summaries instead of every sample: mean/min/max/count for heart rate and other measurements, and totals for steps, flights climbed and cycling distance.",
+    type=click.Choice(["minute", "hour", "day"]),
+)
+@click.option(
+    "--max-decompressed-size",
+    default=512,
+    help="Set the most megabytes a gzip or deflate compressed upload may decompress to. Larger uploads are rejected with a 413 response. Defaults to 512.",
+    type=click.IntRange(1),
+)
+@click.option(
+    "--max-body-size",
+    default=512,
+    help="Set the most megabytes a request body may be, as sent. Larger uploads are rejected with a 413 response before they're read. Defaults to 512.",
+    type=click.IntRange(1),
+)
+@click.option(
+    "--max-samples",
+    default=None,
+    help="Set the most samples an upload may carry, across every record type of a batch. Larger uploads are rejected with a 413 response. Defaults to no limit.",
+    type=click.IntRange(1),
+)
+@click.option(
+    "--max-concurrent-uploads",
+    default=None,
+    help="Set the most uploads received and processed at once (per server process). Further uploads wait in a queue for a turn. Defaults to no limit.",
+    type=click.IntRange(1),
+)
+@click.option(
+    "--max-queued-uploads",
+    default=16,
+    help="Set the most uploads waiting for a turn with --max-concurrent-uploads. Uploads arriving when the queue is full are rejected with a 429 response and a Retry-After header. Defaults to 16.",
+    type=click.IntRange(0),
+)
+@click.option(
+    "--queue-timeout",
+    default=30,
+    help="Set the most seconds an upload waits in the queue for a turn. Uploads that wait longer are rejected with a 503 response and a Retry-After header. Defaults to 30.",
+    type=click.FloatRange(0, min_open=True),
+)
+@click.option(
+    "--metrics/--no-metrics",
+    default=False,
+    help="Time each stage of processing uploads, and count samples and bytes received per record type. Metrics are served in the Prometheus format at /metrics.",
+)
+@click.option(
+    "--log-metrics/--no-log-metrics",
+    default=False,
+    help="Log the timings, sample count and size of every upload as a JSON line on stderr.",
+)
+@click.option(
+    "--drop-invalid/--reject-invalid",
+    default=False,
+    help="Drop samples with an invalid date or value and export the rest, instead of rejecting the whole upload with a 422 response. Defaults to rejecting.",
+)
+@click.option(
+    "--dedup/--no-dedup",
+    default=False,
+    help="Remember the uploads that were exported, so re-sending the same data doesn't export it again, and re-sending an overlapping date range only exports the samples that weren't exported before.",
+)
+@click.option(
+    "--dedup-size",
+    default=1024,
+    help="Set the number of uploads remembered with --dedup. Defaults to 1024.",
+    type=click.IntRange(1),
+)
+@click.option(
+    "--dedup-file",
+    default=None,
+    help="Save the uploads remembered with --dedup to this file, so they're remembered after heartbridge restarts.",
+    type=click.Path(dir_okay=False),
+)
+@partition_option
+@click.option(
+    "--summary/--no-summary",
+    default=False,
+    help="Compute summary statistics of every upload while it's parsed (min, max, mean, standard deviation, p50/p95/p99 and gaps between samples), return them in the response and save them next to the export in a .stats.json file.",
+)
+@click.option(
+    "--gap-threshold",
+    default=60,
+    help="Set the minutes without a sample that --summary reports as a gap. Defaults to 60.",
+    type=click.IntRange(1),
+)
+@click.option(
+    "--workers",
+    default=1,
+    help="Set the number of server processes, so uploads are received, parsed and exported on several cores at once. Defaults to 1.",
+    type=click.IntRange(1),
+)
+@click.pass_context
+def cli(
+    ctx: click.Context,
+    directory: str,
+    type: str,
+    port: int,
+    stream: bool,
+    pool: str,
+    pool_size: int,
+    spool_directory: str,
+    rollup: str,
+    max_decompressed_size: int,
+    max_body_size: int,
+    max_samples: int,
+    max_concurrent_uploads: int,
+    max_queued_uploads: int,
+    queue_timeout: float,
+    metrics: bool,
+    log_metrics: bool,
+    drop_invalid: bool,
+    dedup: bool,
+    dedup_size: int,
+    dedup_file: str,
+    partition: bool,
+    summary: bool,
+    gap_threshold: int,
+    workers: int,
+):
+    """Opens a temporary HTTP endpoint to send health data from Shortcuts to your computer.
+
+    Run `heartbridge ingest --help` for exporting saved Shortcuts data instead.
+    """
+    if ctx.invoked_subcommand is not None:
+        return
     hostname = socket.gethostname()
-    # Set app state variables, which get used during export:
-    app.state.OUTPUT_DIRECTORY = directory
-    app.state.OUTPUT_FORMAT = type
+    settings = {
+        "directory": directory,
+        "type": type,
+        "rollup": rollup,
+        "stream": stream,
+        "pool": pool,
+        "pool_size": pool_size,
+        "spool_directory": spool_directory,
+        "max_decompressed_size": max_decompressed_size,
+        "max_body_size": max_body_size,
+        "max_samples": max_samples,
+        "max_concurrent_uploads": max_concurrent_uploads,
+        "max_queued_uploads": max_queued_uploads,
+        "queue_timeout": queue_timeout,
+        "metrics": metrics,
+        "log_metrics": log_metrics,
+        "drop_invalid": drop_invalid,
+        "dedup": dedup,
+        "dedup_size": dedup_size,
+        "dedup_file": dedup_file,
+        "partition": partition,
+        "summary": summary,
+        "gap_threshold": gap_threshold,
+        # Shared by every worker process, e.g. to replay spooled jobs once:
+        "run_id": uuid.uuid4().hex,
+    }
     click.echo(
         "\U000026A1 Waiting to receive health data at http://{}:{}... (Press Ctrl+C to stop)".format(
             hostname, port
         )
     )
-    uvicorn.run(app, host="0.0.0.0", log_level="error", access_log=False, port=port)
+    server_options = {
+        "host": "0.0.0.0",
+        "log_level": "error",
+        "access_log": False,
+        "port": port,
+    }
+    if workers > 1:
+        # Every worker process imports the app and configures it on startup:
+        os.environ[SETTINGS_VARIABLE] = json.dumps(settings)
+        uvicorn.run(
+            "heartbridge.app:create_app",
+            factory=True,
+            workers=workers,
+            **server_options,
+        )
+        return
+    # Set app state variables, which get used during export:
+    configure(settings)
+    try:
+        uvicorn.run(app, **server_options)
+    finally:
+        app.state.EXECUTOR.shutdown()
+
+
+@cli.command()
+@click.argument("paths", nargs=-1, required=True, type=click.Path(exists=True))
+@click.option(
+    "--directory",
+    default=None,
+    help="Set the output directory for exported files. Defaults to current directory. Will create directory if it does not already exist.",
+    type=click.Path(exists=False, file_okay=False),
+)
+@click.option(
+    "--type",
+    default="csv",
+    help="Set the output file type. Can be csv, json or sqlite. Defaults to csv.",
+    type=click.Choice(["csv", "json", "sqlite"]),
+)
+@click.option(
+    "--rollup",
+    default=None,
+    help="Export per-minute, per-hour or per-day summaries instead of every sample.",
+    type=click.Choice(["minute", "hour", "day"]),
+)
+@partition_option
+@click.option(
+    "--workers",
+    default=None,
+    help="Set the number of processes to ingest files with. Defaults to the number of CPUs.",
+    type=click.IntRange(1),
+)
+def ingest(
+    paths, directory: str, type: str, rollup: str, partition: bool, workers: int
+):
+    """Exports saved Shortcuts data (JSON files, optionally gzip compressed, or
+    directories of them) without running the HTTP server. Files are processed
+    in parallel across a pool of processes.
+    """
+    options = {
+        "output_dir": directory,
+        "output_format": type,
+        "rollup": rollup,
+        "partition": partition,
+    }
+    report = IngestReport()
+    for result in ingest_paths(paths, options, workers):
+        report.add(result)
+        if "error" in result:
+            click.echo(
+                "\033[91m\U0000274C"
+                + f" Could not ingest {result['file']}: {result['error']}"
+                + "\033[0m",
+                err=True,
+            )
+    if report.files == 0:
+        raise click.ClickException("No Shortcuts data files were found")
+    click.echo("\033[92m\U00002705 " + report.summary() + "\033[0m")
+    if report.failed:
+        sys.exit(1)
+
+
+def time_bound_option(ctx, param, value):
+    """Click callback converting a --start/--end option with `parse_time_bound`."""
+    try:
+        return parse_time_bound(value)
+    except ValueError:
+        raise click.BadParameter(
+            "must be a date or timestamp, e.g. 2021-04-01 or 2021-04-01 08:00:00"
+        )
+
+
+@cli.command("import")
+@click.argument("export_path", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--directory",
+    default=None,
+    help="Set the output directory for exported files. Defaults to current directory. Will create directory if it does not already exist.",
+    type=click.Path(exists=False, file_okay=False),
+)
+@click.option(
+    "--type",
+    default="csv",
+    help="Set the output file type. Can be csv, json or sqlite. Defaults to csv.",
+    type=click.Choice(["csv", "json", "sqlite"]),
+)
+@click.option(
+    "--rollup",
+    default=None,
+    help="Export per-minute, per-hour or per-day summaries instead of every sample.",
+    type=click.Choice(["minute", "hour", "day"]),
+)
+@partition_option
+@click.option(
+    "--record-type",
+    "record_types",
+    multiple=True,
+    help="Only import this record type. Can be given several times. Defaults to every supported type.",
+    type=click.Choice(sorted(set(HEALTHKIT_TYPES.values()))),
+)
+@click.option(
+    "--start",
+    default=None,
+    callback=time_bound_option,
+    help="Only import samples from this date or time onwards.",
+)
+@click.option(
+    "--end",
+    default=None,
+    callback=time_bound_option,
+    help="Only import samples from before this date or time.",
+)
+def import_health_export(
+    export_path: str,
+    directory: str,
+    type: str,
+    rollup: str,
+    partition: bool,
+    record_types: tuple,
+    start: int,
+    end: int,
+):
+    """Imports the export.xml from "Export All Health Data" in the Health app
+    (or the export.zip containing it). The file is read incrementally, so
+    exports of any size can be imported.
+    """
+    started = time.perf_counter()
+    summary = import_export(
+        export_path,
+        output_dir=directory,
+        output_format=type,
+        types=record_types or None,
+        start=start,
+        end=end,
+        rollup=rollup,
+        partition=partition,
+    )
+    if not summary:
+        click.echo("No supported samples were found in the export.")
+        return
+    for record_type, result in summary.items():
+        click.echo(
+            "\033[92m\U00002705"
+            + f" Imported {result['samples']:,} {record_type} samples into"
+            + f" {len(result['files'])} file(s)"
+            + "\033[0m"
+        )
+    samples = sum(result["samples"] for result in summary.values())
+    elapsed = max(time.perf_counter() - started, 1e-9)
+    click.echo(
+        f"Imported {samples:,} samples in {elapsed:.2f}s ({samples / elapsed:,.0f} samples/s)"
+    )
+
+
+def bucket_option(ctx, param, value):
+    """Click callback converting a --bucket option to a bucket name or seconds."""
+    bucket = int(value) if value.isdigit() else value
+    try:
+        bucket_seconds(bucket)
+    except ValueError:
+        raise click.BadParameter("must be minute, hour, day or a number of seconds")
+    return bucket
+
+
+@cli.command("wide")
+@click.option(
+    "--directory",
+    default=None,
+    help="Set the directory readings were exported to. The wide export is written there too, unless --output is given. Defaults to current directory.",
+    type=click.Path(exists=False, file_okay=False),
+)
+@click.option(
+    "--type",
+    default="csv",
+    help="Set the file type readings were exported as. Can be csv, json or sqlite. Defaults to csv.",
+    type=click.Choice(["csv", "json", "sqlite"]),
+)
+@click.option(
+    "--record-type",
+    "record_types",
+    multiple=True,
+    help="Add a column for this record type (e.g. heart-rate). Can be given several times. Defaults to heart rate, resting heart rate, heart rate variability, steps, flights climbed and cycling distance.",
+)
+@click.option(
+    "--bucket",
+    default="minute",
+    callback=bucket_option,
+    help="Set the time buckets readings are aligned on: minute, hour, day or a number of seconds. Defaults to minute.",
+)
+@click.option(
+    "--offset",
+    default=0,
+    help="Shift bucket boundaries by this many seconds, e.g. 1800 for hourly buckets starting at half past. Defaults to 0.",
+    type=int,
+)
+@click.option(
+    "--fill",
+    default="empty",
+    help="Set how buckets without samples of a record type are filled: left empty, with the previous value, or with zero. Defaults to empty.",
+    type=click.Choice(FILL_POLICIES),
+)
+@click.option(
+    "--fill-limit",
+    default=None,
+    help="Set the most seconds a previous value is carried forward for with --fill previous. Defaults to no limit.",
+    type=click.IntRange(0),
+)
+@click.option(
+    "--start",
+    default=None,
+    callback=time_bound_option,
+    help="Only include samples from this date or time onwards.",
+)
+@click.option(
+    "--end",
+    default=None,
+    callback=time_bound_option,
+    help="Only include samples from before this date or time.",
+)
+@click.option(
+    "--format",
+    "export_format",
+    default="csv",
+    help="Set the file type of the wide export. Can be csv, json or sqlite (a table in heartbridge.sqlite). Defaults to csv.",
+    type=click.Choice(["csv", "json", "sqlite"]),
+)
+@click.option(
+    "--output",
+    default=None,
+    help="Write the wide export to this file. Defaults to wide-per-<bucket>.<format> in --directory.",
+    type=click.Path(dir_okay=False),
+)
+def export_wide(
+    directory: str,
+    type: str,
+    record_types: tuple,
+    bucket: Union[str, int],
+    offset: int,
+    fill: str,
+    fill_limit: int,
+    start: int,
+    end: int,
+    export_format: str,
+    output: str,
+):
+    """Exports the stored readings of several record types as one table, with
+    a row per time bucket and a column per record type. Steps, flights climbed
+    and cycling distance are summed in each bucket; other record types are
+    averaged. Readings are merged as they're read, so exports of any size can
+    be joined.
+    """
+    started = time.perf_counter()
+    wide = WideExport(
+        directory,
+        type,
+        record_types or WIDE_READING_TYPES,
+        bucket=bucket,
+        offset=offset,
+        fill=fill,
+        fill_limit=fill_limit,
+        start=start,
+        end=end,
+    )
+    path = wide.export(export_format, output)
+    elapsed = time.perf_counter() - started
+    click.echo(
+        f"Exported {', '.join(wide.reading_types)} per {bucket} to {path} in {elapsed:.2f}s"
+    )
@@ -0,0 +1,165 @@
+"""Importer for the archive made by "Export All Health Data" in the Health
+app. Its export.xml holds every sample ever recorded and is often several
+gigabytes, so it's parsed incrementally with `iterparse`, each element is
+discarded once read, and readings are exported in bounded chunks.
+"""
+
+import zipfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Collection, Dict, Iterator, Tuple, Union
+from xml.etree.ElementTree import iterparse
+from .constants import READING_MAPPING
+from .data import ReadingBatch
+from .exceptions import LoadingError
+from .health import Health
+from .timestamps import SECONDS_PER_DAY, parse_timestamp
+
+# HealthKit quantity types, and the record type each is imported as:
+HEALTHKIT_TYPES = {
+    "HKQuantityTypeIdentifierHeartRate": "heart-rate",
+    "HKQuantityTypeIdentifierRestingHeartRate": "resting-heart-rate",
+    "HKQuantityTypeIdentifierHeartRateVariabilitySDNN": "heart-rate-variability",
+    "HKQuantityTypeIdentifierDistanceCycling": "cycling-distance",
+    "HKQuantityTypeIdentifierStepCount": "steps",
+    "HKQuantityTypeIdentifierFlightsClimbed": "flights-climbed",
+}
+
+EXPORT_XML_NAME = "export.xml"
+
+# Readings of one type buffered before they're exported:
+DEFAULT_CHUNK_SIZE = 100_000
+
+
+@contextmanager
+def open_export(path: Union[str, Path]):
+    """Opens export.xml, either directly or inside the export.zip archive."""
+    path = Path(path)
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            names = [
+                name
+                for name in archive.namelist()
+                if name == EXPORT_XML_NAME or name.endswith("/" + EXPORT_XML_NAME)
+            ]
+            if not names:
+                raise LoadingError(f"{path} does not contain an {EXPORT_XML_NAME}")
+            with archive.open(names[0]) as export_file:
+                yield export_file
+    else:
+        with open(path, "rb") as export_file:
+            yield export_file
+
+
+def iter_records(
+    path: Union[str, Path],
+    types: Collection[str] = None,
+    start: int = None,
+    end: int = None,
+) -> Iterator[Tuple[str, int, float]]:
+    """Yields `(reading_type, timestamp, value)` for every supported record in an
+    export, in document order. Elements are cleared as soon as they're read.
+
+    Args:
+        path: export.xml, or the export.zip containing it
+        types: Record types to import (e.g. heart-rate); all supported types if None
+        start, end: Epoch seconds bounding the `[start, end)` window to import;
+            None for an open end
+
+    The timestamp is the sample's start date in the local time it was recorded
+    in (the time zone offset is dropped), as Shortcuts sends it.
+    """
+    wanted = {
+        identifier: reading_type
+        for identifier, reading_type in HEALTHKIT_TYPES.items()
+        if types is None or reading_type in types
+    }
+    with open_export(path) as export_file:
+        events = iterparse(export_file, events=("start", "end"))
+        try:
+            _, root = next(events)
+            depth = 1
+            for event, element in events:
+                if event == "start":
+                    depth += 1
+                    continue
+                depth -= 1
+                if depth > 1:
+                    continue  # e.g. metadata inside a record, or records in a correlation
+                if element.tag == "Record":
+                    reading_type = wanted.get(element.get("type"))
+                    if reading_type is not None:
+                        timestamp = parse_timestamp(element.get("startDate", "")[:19])
+                        if (start is None or timestamp >= start) and (
+                            end is None or timestamp < end
+                        ):
+                            yield reading_type, timestamp, float(element.get("value"))
+                # Drop everything read so far, so memory use stays flat:
+                root.clear()
+        except SyntaxError as e:  # xml.etree.ElementTree.ParseError
+            raise LoadingError(f"Could not read {path}: {e}")
+        except (TypeError, ValueError) as e:
+            raise LoadingError(f"Invalid record in {path}: {e}")
+
+
+def iter_batches(
+    path: Union[str, Path],
+    types: Collection[str] = None,
+    start: int = None,
+    end: int = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> Iterator[ReadingBatch]:
+    """Groups the records of an export (see `iter_records`) into a `ReadingBatch`
+    per record type, yielding each batch once it holds `chunk_size` readings.
+
+    Batches are in document order, which isn't timestamp order when the
+    export holds records from several sources (e.g. a watch and a phone);
+    `Health.load_from_batch` sorts them. A full batch is only yielded when a
+    record from a later day than any before arrives, so each batch of a type
+    ends on a later day than the one before (and they don't share an export
+    filename).
+    """
+    batches: Dict[str, ReadingBatch] = {}
+    last_days: Dict[str, int] = {}
+    for reading_type, timestamp, value in iter_records(path, types, start, end):
+        batch = batches.get(reading_type)
+        day = timestamp // SECONDS_PER_DAY
+        if batch is None:
+            batch = batches[reading_type] = _new_batch(reading_type)
+        elif len(batch) >= chunk_size and day > last_days[reading_type]:
+            yield batch
+            batch = batches[reading_type] = _new_batch(reading_type)
+        batch.append(timestamp, value)
+        last_days[reading_type] = max(day, last_days.get(reading_type, day))
+    yield from batches.values()
+
+
+def _new_batch(reading_type: str) -> ReadingBatch:
+    return ReadingBatch(READING_MAPPING[reading_type], reading_type=reading_type)
+
+
+def import_export(
+    path: Union[str, Path],
+    output_dir: str = None,
+    output_format: str = "csv",
+    types: Collection[str] = None,
+    start: int = None,
+    end: int = None,
+    rollup: str = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    partition: bool = False,
+) -> Dict[str, dict]:
+    """Imports an Apple Health export, exporting each chunk of readings (see
+    `iter_batches`) the same way uploads from Shortcuts are exported. Returns
+    the number of samples and the files written for each record type.
+    """
+    summary = {}
+    for batch in iter_batches(path, types, start, end, chunk_size):
+        health = Health(output_dir, output_format, rollup, partition=partition)
+        health.load_from_batch(batch)
+        result = summary.setdefault(batch.reading_type, {"samples": 0, "files": []})
+        result["samples"] += len(batch)
+        exported = str(health.export())
+        if exported not in result["files"]:
+            result["files"].append(exported)
+    return summary
@@ -0,0 +1,144 @@
+"""JSON encoding and decoding for request bodies, exports and responses. The
+fastest JSON library installed is used: orjson, then ujson, falling back to
+the standard library's `json` module. Every codec behaves the same way:
+
+* `loads` accepts `bytes`, `bytearray` or `str` (bodies are decoded straight
+  from the bytes received), and raises `json.JSONDecodeError` for invalid JSON
+* `dumps` returns compact UTF-8 encoded `bytes`, and encodes NaN and
+  infinities (which aren't valid JSON) as null
+"""
+
+import json, math
+from typing import Dict, List, Union
+
+try:
+    import orjson
+except ImportError:  # orjson is optional
+    orjson = None
+
+try:
+    import ujson
+except ImportError:  # ujson is optional
+    ujson = None
+
+_BOM = b"\xef\xbb\xbf"
+
+
+class JSONCodec:
+    """Codec backed by the standard library's `json` module."""
+
+    name = "json"
+
+    @classmethod
+    def available(cls) -> bool:
+        return True
+
+    def loads(self, data: Union[bytes, bytearray, str]):
+        return json.loads(data)
+
+    def dumps(self, obj) -> bytes:
+        try:
+            return _compact(obj, allow_nan=False).encode()
+        except ValueError:
+            return _compact(_finite(obj)).encode()
+
+
+class OrjsonCodec(JSONCodec):
+    name = "orjson"
+
+    @classmethod
+    def available(cls) -> bool:
+        return orjson is not None
+
+    def loads(self, data: Union[bytes, bytearray, str]):
+        if data[:3] == _BOM:  # accepted by json.loads, but not by orjson
+            data = data[3:]
+        return orjson.loads(data)
+
+    def dumps(self, obj) -> bytes:
+        return orjson.dumps(obj)
+
+
+class UjsonCodec(JSONCodec):
+    name = "ujson"
+
+    @classmethod
+    def available(cls) -> bool:
+        return ujson is not None
+
+    def loads(self, data: Union[bytes, bytearray, str]):
+        if isinstance(data, (bytes, bytearray)) and data[:3] == _BOM:
+            data = data[3:]
+        try:
+            return ujson.loads(data)
+        except ValueError as e:
+            raise json.JSONDecodeError(str(e), "", 0)
+
+    def dumps(self, obj) -> bytes:
+        options = {"ensure_ascii": False, "escape_forward_slashes": False}
+        try:
+            return ujson.dumps(obj, **options).encode()
+        except OverflowError:
+            return ujson.dumps(_finite(obj), **options).encode()
+
+
+# In order of preference:
+CODECS: Dict[str, type] = {
+    codec_cls.name: codec_cls for codec_cls in (OrjsonCodec, UjsonCodec, JSONCodec)
+}
+
+
+def available_codecs() -> List[str]:
+    """Names of the codecs that can be used, fastest first."""
+    return [name for name, codec_cls in CODECS.items() if codec_cls.available()]
+
+
+def get_codec(name: str = None) -> JSONCodec:
+    """Returns the codec called `name`, or the fastest one available if None.
+    Raises ValueError if that codec's library isn't installed.
+    """
+    name = name or available_codecs()[0]
+    if name not in CODECS or not CODECS[name].available():
+        raise ValueError(
+            "The {} JSON codec isn't available; choose one of {}".format(
+                name, ", ".join(available_codecs())
+            )
+        )
+    return CODECS[name]()
+
+
+codec = get_codec()
+
+
+def use_codec(name: str = None) -> JSONCodec:
+    """Switches the codec used by `loads` and `dumps`, returning it."""
+    global codec
+    codec = get_codec(name)
+    return codec
+
+
+def loads(data: Union[bytes, bytearray, str]):
+    """Decodes JSON with the current codec."""
+    return codec.loads(data)
+
+
+def dumps(obj) -> bytes:
+    """Encodes JSON with the current codec."""
+    return codec.dumps(obj)
+
+
+def _compact(obj, allow_nan: bool = True) -> str:
+    return json.dumps(
+        obj, ensure_ascii=False, separators=(",", ":"), allow_nan=allow_nan
+    )
+
+
+def _finite(obj):
+    """A copy of `obj` with NaN and infinities replaced by None."""
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, dict):
+        return {key: _finite(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_finite(value) for value in obj]
+    return obj
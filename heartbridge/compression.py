@@ -0,0 +1,103 @@
+"""Decompression of request bodies sent with a `Content-Encoding` of gzip or
+deflate. Bodies are decompressed chunk by chunk as they arrive, and each chunk
+is inflated in bounded pieces, so a small compressed body can't expand into
+an unbounded amount of memory (a "zip bomb").
+"""
+
+import zlib
+from typing import Iterator
+from .exceptions import BodyTooLargeError, LoadingError
+
+# Window bits for zlib.decompressobj: gzip framing, zlib framing, raw deflate
+_GZIP_WBITS = 16 + zlib.MAX_WBITS
+_ZLIB_WBITS = zlib.MAX_WBITS
+_RAW_WBITS = -zlib.MAX_WBITS
+
+SUPPORTED_ENCODINGS = ("identity", "gzip", "x-gzip", "deflate")
+
+# Largest piece of decompressed data produced at once:
+PIECE_SIZE = 256 * 1024
+
+
+class BodyDecompressor:
+    """Incrementally decodes a request body sent with `content_encoding`.
+
+    Args:
+        content_encoding: The request's Content-Encoding header (None or identity
+            for an uncompressed body)
+        max_size: The most bytes the body may decompress to, or None for no limit.
+            Raises `BodyTooLargeError` as soon as it is exceeded.
+    """
+
+    def __init__(self, content_encoding: str = None, max_size: int = None):
+        encoding = (content_encoding or "identity").strip().lower()
+        if encoding not in SUPPORTED_ENCODINGS:
+            raise LoadingError(
+                "Unsupported Content-Encoding: {}".format(content_encoding)
+            )
+        self.encoding = encoding
+        self.max_size = max_size
+        self.size = 0
+        self._decompressor = None
+        self._header = None  # start of a deflate body, until the format is known
+        if encoding in ("gzip", "x-gzip"):
+            self._decompressor = zlib.decompressobj(_GZIP_WBITS)
+        elif encoding == "deflate":
+            self._decompressor = zlib.decompressobj(_ZLIB_WBITS)
+            self._header = b""
+
+    @property
+    def compressed(self) -> bool:
+        return self._decompressor is not None
+
+    def decompress(self, chunk: bytes) -> Iterator[bytes]:
+        """Yields the decompressed contents of `chunk`, in pieces of at most
+        `PIECE_SIZE` bytes.
+        """
+        if not self.compressed:
+            yield chunk
+            return
+        if self._header is not None:
+            # Some clients send raw deflate data rather than the zlib format HTTP
+            # specifies. zlib data starts with a two byte header naming the
+            # deflate method, with a checksum making it a multiple of 31, so
+            # wait for that before inflating:
+            chunk = self._header + chunk
+            if len(chunk) < 2:
+                self._header = chunk
+                return
+            self._header = None
+            if chunk[0] & 0x0F != 8 or (chunk[0] << 8 | chunk[1]) % 31 != 0:
+                self._decompressor = zlib.decompressobj(_RAW_WBITS)
+        data = chunk
+        while data:
+            try:
+                piece = self._decompressor.decompress(data, PIECE_SIZE)
+            except zlib.error as e:
+                raise LoadingError("Could not decompress request body: {}".format(e))
+            if self._decompressor.unused_data:
+                raise LoadingError(
+                    "Unexpected data after the end of the compressed body"
+                )
+            yield self._count(piece)
+            data = self._decompressor.unconsumed_tail
+
+    def flush(self) -> Iterator[bytes]:
+        """Yields any remaining decompressed data once the whole body was read."""
+        if not self.compressed:
+            return
+        piece = self._decompressor.flush()
+        if piece:
+            yield self._count(piece)
+        if not self._decompressor.eof:
+            raise LoadingError("The compressed request body is incomplete")
+
+    def _count(self, piece: bytes) -> bytes:
+        self.size += len(piece)
+        if self.max_size is not None and self.size > self.max_size:
+            raise BodyTooLargeError(
+                "The request body decompresses to more than {} bytes".format(
+                    self.max_size
+                )
+            )
+        return piece
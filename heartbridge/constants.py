@@ -9,10 +9,11 @@ from .data import (
     StepsReading,
     FlightsClimbedReading,
 )
-from .export import CSVExporter, JSONExporter
+from .export import CSVExporter, JSONExporter, SQLiteExporter
+from .timestamps import DATE_PARSE_STRING
 
 
-EXPORT_CLS_MAP = {"csv": CSVExporter, "json": JSONExporter}
+EXPORT_CLS_MAP = {"csv": CSVExporter, "json": JSONExporter, "sqlite": SQLiteExporter}
 
 READING_MAPPING = {
     "heart-rate": HeartRateReading,
@@ -26,4 +27,3 @@ READING_MAPPING = {
 
 REQUIRED_FIELDS = ["dates", "values"]
 LEGACY_RECORD_TYPE = "heart-rate-legacy"
-DATE_PARSE_STRING = "%Y-%m-%d %H:%M:%S"
@@ -2,42 +2,91 @@
 class is a different record type from the Health app.
 """
 
+from abc import ABC, abstractmethod
+from array import array
+from collections.abc import Sequence
 from dataclasses import dataclass, fields, InitVar
-from typing import ClassVar
+from typing import ClassVar, Iterable, Iterator, List, Tuple, Union
 from datetime import datetime
+from functools import lru_cache
+import sys
+from .timestamps import (
+    DATE_PARSE_STRING,
+    datetime_to_epoch,
+    epoch_to_datetime,
+    format_many,
+)
+
+try:
+    import numpy
+except ImportError:  # NumPy is optional; columnar data is stored in array.array
+    numpy = None
+
+
+@lru_cache(maxsize=None)
+def _field_names(reading_cls: type) -> Tuple[str, ...]:
+    return tuple(x.name for x in fields(reading_cls))
+
+
+@lru_cache(maxsize=None)
+def _value_attribute(reading_cls: type) -> Union[str, None]:
+    if reading_cls.__annotations__.get("value_attribute"):
+        return getattr(reading_cls, "value_attribute")
+    return None
 
 
 @dataclass(order=True)
 class BaseHealthReading:
     timestamp: datetime
     value: InitVar[str] = None
+    value_typecode: ClassVar[str] = "d"
+    # Inclusive bounds of plausible values, checked when data is loaded:
+    value_range: ClassVar[Tuple[float, float]] = (
+        -sys.float_info.max,
+        sys.float_info.max,
+    )
+
+    @staticmethod
+    def parse_value(value) -> float:
+        """Converts a raw value from Shortcuts into the type stored for this reading."""
+        return float(value)
+
+    @classmethod
+    def value_attribute_name(cls) -> Union[str, None]:
+        """The name of the field holding the reading's value (see
+        `value_attribute`), or None for the base class. Cached per class.
+        """
+        return _value_attribute(cls)
 
     @property
     def field_names(self):
-        return [x.name for x in fields(self)]
+        return list(_field_names(type(self)))
 
     @property
     def timestamp_string(self) -> str:
-        return datetime.strftime(self.timestamp, "%Y-%m-%d %H:%M:%S")
+        if self.timestamp.tzinfo is None:
+            # Much faster than strftime and identical for naive datetimes:
+            return self.timestamp.isoformat(" ", "seconds")
+        return datetime.strftime(self.timestamp, DATE_PARSE_STRING)
 
     def get_value(self):
         """Gets the value of a health reading, determined by the `value_attribute`
         class variable.
         """
-        if self.__annotations__.get("value_attribute"):
-            value_key = getattr(self, "value_attribute")
-            return self.__getattribute__(value_key)
+        value_key = _value_attribute(type(self))
+        if value_key:
+            return getattr(self, value_key)
         return None
 
     def to_dict(self):
         """Converts the data object to a dictionary. Call only
         on a subclass of BaseHealthReading.
         """
-        if self.__annotations__.get("value_attribute"):
-            value_key = getattr(self, "value_attribute")
+        value_key = _value_attribute(type(self))
+        if value_key:
             return {
                 "timestamp": self.timestamp_string,
-                value_key: self.__getattribute__(value_key),
+                value_key: getattr(self, value_key),
             }
 
 
@@ -54,51 +103,269 @@ class GenericHealthReading(BaseHealthReading):
 class HeartRateReading(BaseHealthReading):
     heart_rate: float = None
     value_attribute: ClassVar[str] = "heart_rate"
+    value_typecode: ClassVar[str] = "q"
+    value_range: ClassVar[Tuple[float, float]] = (1, 300)
+
+    @staticmethod
+    def parse_value(value):
+        return int(value)
 
     def __post_init__(self, value):
-        self.heart_rate = int(value)
+        self.heart_rate = self.parse_value(value)
 
 
 @dataclass(order=True)
 class RestingHeartRateReading(BaseHealthReading):
     resting_heart_rate: int = None
     value_attribute: ClassVar[str] = "resting_heart_rate"
+    value_typecode: ClassVar[str] = "q"
+    value_range: ClassVar[Tuple[float, float]] = (1, 300)
+
+    @staticmethod
+    def parse_value(value):
+        return int(value)
 
     def __post_init__(self, value):
-        self.resting_heart_rate = int(value)
+        self.resting_heart_rate = self.parse_value(value)
 
 
 @dataclass(order=True)
 class HeartRateVariabilityReading(BaseHealthReading):
     heart_rate_variability: float = None
     value_attribute: ClassVar[str] = "heart_rate_variability"
+    value_typecode: ClassVar[str] = "d"
+    value_range: ClassVar[Tuple[float, float]] = (0, 1000)
+
+    @staticmethod
+    def parse_value(value):
+        return round(float(value), 2)
 
     def __post_init__(self, value):
-        self.heart_rate_variability = round(float(value), 2)
+        self.heart_rate_variability = self.parse_value(value)
 
 
 @dataclass(order=True)
 class StepsReading(BaseHealthReading):
     step_count: int = None
     value_attribute: ClassVar[str] = "step_count"
+    value_typecode: ClassVar[str] = "q"
+    value_range: ClassVar[Tuple[float, float]] = (0, 1_000_000)
+
+    @staticmethod
+    def parse_value(value):
+        return int(value)
 
     def __post_init__(self, value):
-        self.step_count = int(value)
+        self.step_count = self.parse_value(value)
 
 
 @dataclass(order=True)
 class FlightsClimbedReading(BaseHealthReading):
     climbed: int = None
     value_attribute: ClassVar[str] = "climbed"
+    value_typecode: ClassVar[str] = "q"
+    value_range: ClassVar[Tuple[float, float]] = (0, 10_000)
+
+    @staticmethod
+    def parse_value(value):
+        return int(value)
 
     def __post_init__(self, value):
-        self.climbed = int(value)
+        self.climbed = self.parse_value(value)
 
 
 @dataclass(order=True)
 class CyclingDistanceReading(BaseHealthReading):
     distance_cycled: float = None
     value_attribute: ClassVar[str] = "distance_cycled"
+    value_typecode: ClassVar[str] = "d"
+    value_range: ClassVar[Tuple[float, float]] = (0, 10_000)
+
+    @staticmethod
+    def parse_value(value):
+        return float(value)
 
     def __post_init__(self, value):
-        self.distance_cycled = float(value)
+        self.distance_cycled = self.parse_value(value)
+
+
+class ColumnarBatch(ABC):
+    """Abstract base class for rows stored column by column: a `timestamps`
+    array of epoch seconds, plus one typed array per remaining field. Exporters
+    only rely on the interface defined here.
+    """
+
+    reading_type: str = None
+
+    @property
+    @abstractmethod
+    def field_names(self) -> List[str]:
+        pass
+
+    @abstractmethod
+    def columns(self) -> List[array]:
+        """Arrays holding each field after `timestamp`, in `field_names` order."""
+        pass
+
+    @property
+    def start(self) -> datetime:
+        return epoch_to_datetime(self.timestamps[0])
+
+    @property
+    def end(self) -> datetime:
+        return epoch_to_datetime(self.timestamps[-1])
+
+    def rows(self) -> Iterator[tuple]:
+        """Yields one tuple per row in `field_names` order, with the timestamp
+        formatted as a string.
+        """
+        return zip(format_many(self.timestamps), *self.columns())
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+
+class ReadingBatch(ColumnarBatch, Sequence):
+    """Columnar collection of readings of a single record type. Timestamps are
+    stored as epoch seconds and values as a typed array, so a batch of
+    hundreds of thousands of samples is two contiguous buffers rather than one
+    object per sample.
+
+    Indexing a batch returns an instance of `reading_cls` built on demand, so
+    code written against a list of `BaseHealthReading` objects keeps working.
+    """
+
+    def __init__(
+        self,
+        reading_cls: type = GenericHealthReading,
+        timestamps: Iterable[int] = None,
+        values: Iterable = None,
+        reading_type: str = None,
+    ):
+        self.reading_cls = reading_cls
+        self.reading_type = reading_type
+        self.timestamps = _as_array("q", timestamps)
+        self.values = _as_array(reading_cls.value_typecode, values)
+        if len(self.timestamps) != len(self.values):
+            raise ValueError("timestamps and values must have the same length")
+
+    @classmethod
+    def from_readings(
+        cls, readings: Iterable[BaseHealthReading], reading_type: str = None
+    ) -> "ReadingBatch":
+        """Builds a batch from per-row reading objects. Batches (including other
+        `ColumnarBatch` types) are returned as-is.
+        """
+        if isinstance(readings, ColumnarBatch):
+            return readings
+        readings = list(readings)
+        reading_cls = type(readings[0]) if readings else GenericHealthReading
+        return cls(
+            reading_cls,
+            (datetime_to_epoch(r.timestamp) for r in readings),
+            (r.get_value() for r in readings),
+            reading_type=reading_type,
+        )
+
+    @property
+    def value_attribute(self) -> str:
+        return getattr(self.reading_cls, "value_attribute", "reading")
+
+    @property
+    def field_names(self) -> list:
+        return ["timestamp", self.value_attribute]
+
+    def columns(self) -> List[array]:
+        return [self.values]
+
+    def append(self, timestamp: int, value) -> None:
+        """Adds one sample, converting `value` with the reading class' parser."""
+        self.timestamps.append(timestamp)
+        self.values.append(self.reading_cls.parse_value(value))
+
+    def as_numpy(self):
+        """Returns `(timestamps, values)` as NumPy arrays sharing this batch's
+        memory. Requires NumPy to be installed.
+        """
+        if numpy is None:
+            raise ImportError("NumPy is required for ReadingBatch.as_numpy()")
+        return (
+            numpy.frombuffer(self.timestamps, dtype=numpy.int64),
+            numpy.frombuffer(
+                self.values,
+                dtype=numpy.int64 if self.values.typecode == "q" else numpy.float64,
+            ),
+        )
+
+    def sorted(self, unique: bool = False) -> "ReadingBatch":
+        """The readings in timestamp order: this batch if they already are, or a
+        sorted copy in which readings with the same timestamp keep their order.
+        With `unique`, only the last reading of each timestamp is kept.
+        """
+        if numpy is not None:
+            return self._sorted_numpy(unique)
+        timestamps = self.timestamps
+        ordered = all(map(int.__le__, timestamps, timestamps[1:]))
+        if ordered and (not unique or all(map(int.__lt__, timestamps, timestamps[1:]))):
+            return self
+        order = list(range(len(timestamps)))
+        if not ordered:
+            order.sort(key=timestamps.__getitem__)
+        if unique:
+            order = [
+                i for i, j in zip(order, order[1:]) if timestamps[i] != timestamps[j]
+            ] + order[-1:]
+        return ReadingBatch(
+            self.reading_cls,
+            (timestamps[i] for i in order),
+            (self.values[i] for i in order),
+            reading_type=self.reading_type,
+        )
+
+    def _sorted_numpy(self, unique: bool) -> "ReadingBatch":
+        timestamps, values = self.as_numpy()
+        ordered = bool((timestamps[1:] >= timestamps[:-1]).all())
+        if ordered and (not unique or (timestamps[1:] > timestamps[:-1]).all()):
+            return self
+        if not ordered:
+            order = numpy.argsort(timestamps, kind="stable")
+            timestamps, values = timestamps[order], values[order]
+        if unique:
+            last = numpy.append(timestamps[1:] != timestamps[:-1], True)
+            timestamps, values = timestamps[last], values[last]
+        return ReadingBatch(
+            self.reading_cls,
+            _from_numpy("q", timestamps),
+            _from_numpy(self.values.typecode, values),
+            reading_type=self.reading_type,
+        )
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ReadingBatch(
+                self.reading_cls,
+                self.timestamps[index],
+                self.values[index],
+                reading_type=self.reading_type,
+            )
+        return self.reading_cls(
+            timestamp=epoch_to_datetime(self.timestamps[index]),
+            value=self.values[index],
+        )
+
+    def __repr__(self) -> str:
+        return "{}({}, {} samples)".format(
+            type(self).__name__, self.reading_cls.__name__, len(self)
+        )
+
+
+def _from_numpy(typecode: str, data) -> array:
+    column = array(typecode)
+    column.frombytes(numpy.ascontiguousarray(data).tobytes())
+    return column
+
+
+def _as_array(typecode: str, data) -> array:
+    if isinstance(data, array) and data.typecode == typecode:
+        return data
+    return array(typecode, data if data is not None else ())
@@ -0,0 +1,262 @@
+"""Cache of uploads that have already been exported. Shortcuts automations often
+re-send the same date range, or a window overlapping the previous one (e.g.
+"the last 7 days", every day). Each export is remembered by a digest of its
+record type and samples, so an identical upload is answered with the file it
+was exported to. For an upload overlapping the time range of earlier ones,
+the samples already stored in that range are read back (see
+`heartbridge.query.RangeQuery`), and only samples that aren't stored with the
+same value are exported: new timestamps, including ones that arrive late
+inside an exported range, and corrected values.
+"""
+
+import hashlib, json, os, threading
+from collections import OrderedDict
+from pathlib import Path
+from array import array
+from typing import Iterable, List, Optional, Tuple, Union
+from .constants import EXPORT_CLS_MAP
+from .data import ReadingBatch, numpy
+from .export import atomic_file
+from .index import file_lock
+from .query import RangeQuery
+
+
+class UploadCache:
+    """Least recently used cache of exported uploads.
+
+    Entries are keyed by `digest` and look like:
+        {"scope": ["heart-rate", "csv", null, "/home/me/health", false],
+         "start": 1576484676, "end": 1576540585, "file": "/home/me/health/...",
+         "size": 172, "mtime_ns": 1618041841000000000}
+
+    `scope` is what the samples were exported as (record type, output format,
+    rollup, output directory and whether it's partitioned), `start` and `end`
+    the range of timestamps exported to `file` (both inclusive). Ranges only
+    tell which uploads may overlap stored samples; whether a sample is stored
+    is checked against the exported data. An entry is
+    ignored once its file has been removed or, unless uploads are merged into
+    existing files (SQLite or partitioned exports), changed.
+
+    Args:
+        max_entries: The number of uploads remembered; the least recently used
+            is forgotten first
+        path: A JSON file the cache is loaded from and saved to, so it survives
+            restarts. Kept in memory only if None. Several processes (e.g.
+            server workers) may share the file: entries saved by the others
+            are merged in whenever it's saved.
+    """
+
+    def __init__(self, max_entries: int = 1024, path: Union[str, Path] = None):
+        self.max_entries = max_entries
+        self.path = Path(path) if path else None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if self.path is not None:
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def digest(self, health) -> str:
+        """Key of the upload loaded into a `Health` instance: a hash of its scope
+        and of the timestamp and value columns.
+        """
+        readings = health.readings
+        content = hashlib.sha256(json.dumps(scope(health)).encode())
+        content.update(memoryview(readings.timestamps).cast("B"))
+        content.update(memoryview(readings.values).cast("B"))
+        return content.hexdigest()
+
+    def lookup(self, key: str) -> Optional[str]:
+        """The file an identical upload was exported to, if it's still there."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not self._is_current(entry):
+                return None
+            self._entries.move_to_end(key)
+            return entry["file"]
+
+    def new_samples(self, health) -> ReadingBatch:
+        """The readings loaded into `health` that aren't stored with the same
+        value yet, when they overlap the range of an upload exported in the same
+        scope. Returns `health.readings` itself when they don't.
+
+        Rollups are always exported whole, since a bucket at the edge of a range
+        would be replaced by one summarizing only the new samples.
+        """
+        readings = health.readings
+        if health.rollup or len(readings) == 0:
+            return readings
+        first, last = min(readings.timestamps), max(readings.timestamps)
+        overlapping = self._ranges(scope(health), first, last)
+        if not overlapping:
+            return readings
+        stored = RangeQuery(
+            health.output_dir,
+            health.output_format,
+            health.reading_type_slug,
+            first,
+            last + 1,
+        ).rows()
+        new = _unstored(readings, stored)
+        if len(new) == 0 or _merges_on_write(scope(health)):
+            return new
+        # Files are named by date range, so the new samples may go to the file
+        # holding the samples they overlap, which would lose those:
+        target = os.path.realpath(_export_path(health, new))
+        if any(file == target for _, _, file in overlapping):
+            return readings
+        return new
+
+    def add(self, key: str, health, readings: ReadingBatch, file: str) -> None:
+        """Records that `readings`, loaded into `health` from the upload with this
+        key, were exported to `file`.
+        """
+        entry = {
+            "scope": scope(health),
+            "start": min(readings.timestamps),
+            "end": max(readings.timestamps),
+            "file": str(file),
+        }
+        entry.update(_file_stat(file))
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            if self.path is not None:
+                self._save()
+
+    def _ranges(self, entry_scope: list, first: int, last: int) -> List[tuple]:
+        with self._lock:
+            return [
+                (entry["start"], entry["end"], entry["file"])
+                for entry in self._entries.values()
+                if entry["scope"] == entry_scope
+                and entry["start"] <= last
+                and entry["end"] >= first
+                and self._is_current(entry)
+            ]
+
+    def _is_current(self, entry: dict) -> bool:
+        stat = _file_stat(entry["file"])
+        if not stat:
+            return False
+        return _merges_on_write(entry["scope"]) or stat == {
+            "size": entry.get("size"),
+            "mtime_ns": entry.get("mtime_ns"),
+        }
+
+    def _load(self) -> None:
+        self._entries = OrderedDict(self._read()[-self.max_entries :])
+
+    def _read(self) -> list:
+        try:
+            with open(self.path, "r") as cache_file:
+                return json.load(cache_file)
+        except FileNotFoundError:
+            return []
+        except ValueError:
+            return []  # A corrupt cache only costs re-exporting
+
+    def _save(self) -> None:
+        with file_lock(self.path.with_name(self.path.name + ".lock")):
+            # Keep what other processes saved, with this process's entries as
+            # the most recently used:
+            entries = OrderedDict(self._read())
+            for key, entry in self._entries.items():
+                entries.pop(key, None)
+                entries[key] = entry
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+            self._entries = entries
+            with atomic_file(self.path) as cache_file:
+                json.dump(list(entries.items()), cache_file)
+
+
+def scope(health) -> list:
+    """What the readings in `health` are exported as: their record type, the
+    output format, rollup, output directory and whether they're partitioned.
+    """
+    return [
+        health.reading_type_slug,
+        health.output_format,
+        health.rollup,
+        os.path.realpath(health.output_dir or "."),
+        health.partitioned,
+    ]
+
+
+def _merges_on_write(entry_scope: list) -> bool:
+    """Whether exports in this scope are merged into the files already there, so
+    exporting only some samples never loses the others.
+    """
+    output_format, partitioned = entry_scope[1], entry_scope[4]
+    return partitioned or EXPORT_CLS_MAP[output_format].shared_filename is not None
+
+
+def _export_path(health, readings: ReadingBatch) -> Path:
+    """The path `health` would export `readings` to instead of its own readings."""
+    loaded = health.readings
+    health.readings = readings
+    try:
+        return health.export_path()
+    finally:
+        health.readings = loaded
+
+
+def _file_stat(file: str) -> dict:
+    try:
+        stat = os.stat(file)
+    except OSError:
+        return {}
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _unstored(
+    readings: ReadingBatch, stored: Iterable[Tuple[int, Union[int, float]]]
+) -> ReadingBatch:
+    """The readings that aren't in `stored` (time-ordered `(timestamp, value)`
+    rows) with the same value. Where a timestamp is stored more than once, its
+    last value counts.
+    """
+    if numpy is not None:
+        stored_timestamps, stored_values = array("q"), array("d")
+        for timestamp, value in stored:
+            stored_timestamps.append(timestamp)
+            stored_values.append(value)
+        stored_timestamps = numpy.frombuffer(stored_timestamps, dtype=numpy.int64)
+        stored_values = numpy.frombuffer(stored_values, dtype=numpy.float64)
+        timestamps, values = readings.as_numpy()
+        # The last stored row at or before each timestamp:
+        position = numpy.searchsorted(stored_timestamps, timestamps, side="right") - 1
+        if len(stored_timestamps):
+            position = numpy.maximum(position, 0)
+            known = (stored_timestamps[position] == timestamps) & (
+                stored_values[position] == values
+            )
+        else:
+            known = numpy.zeros(len(timestamps), dtype=bool)
+        keep = ~known
+        return ReadingBatch(
+            readings.reading_cls,
+            timestamps[keep].tolist(),
+            values[keep].tolist(),
+            reading_type=readings.reading_type,
+        )
+    readings = readings.sorted()
+    new = ReadingBatch(readings.reading_cls, reading_type=readings.reading_type)
+    stored = iter(stored)
+    pending = next(stored, None)
+    current, stored_value = None, None
+    for timestamp, value in zip(readings.timestamps, readings.values):
+        if timestamp != current:
+            current, stored_value = timestamp, None
+            while pending is not None and pending[0] <= timestamp:
+                if pending[0] == timestamp:
+                    stored_value = pending[1]
+                pending = next(stored, None)
+        if stored_value is None or value != stored_value:
+            new.timestamps.append(timestamp)
+            new.values.append(value)
+    return new
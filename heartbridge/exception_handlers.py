@@ -2,31 +2,109 @@
 """
 
 import logging
-from starlette.responses import JSONResponse
-from heartbridge.exceptions import ValidationError, LoadingError, ExportError
+from json import JSONDecodeError
+from typing import Tuple
+from heartbridge.responses import JSONResponse
+from heartbridge.exceptions import (
+    ValidationError,
+    LoadingError,
+    ExportError,
+    BodyTooLargeError,
+    QueueFullError,
+    SampleValidationError,
+    ServerBusyError,
+    TooManySamplesError,
+    UploadSessionError,
+)
+
+# Status code and message returned to Shortcuts for each type of error (more
+# specific exceptions first, since they're matched in order):
+ERROR_RESPONSES = {
+    QueueFullError: (429, "Too many uploads are in progress; try again later"),
+    ServerBusyError: (503, "The server is busy; try again later"),
+    TooManySamplesError: (413, "Too many samples were sent"),
+    UploadSessionError: (409, "The upload session can't accept this request"),
+    BodyTooLargeError: (413, "The data sent is too large"),
+    JSONDecodeError: (400, "Could not read JSON data from Shortcuts"),
+    ValidationError: (422, "Invalid data passed"),
+    LoadingError: (400, "Issues occured while processing data"),
+    ExportError: (500, "An issue occured during data export"),
+}
+
+
+def error_response(exc: Exception) -> Tuple[int, str]:
+    """Returns the status code and message the app responds with for `exc`, for
+    places that report errors outside of a request (e.g. background jobs).
+    """
+    for exc_cls, response in ERROR_RESPONSES.items():
+        if isinstance(exc, exc_cls):
+            return response
+    return (500, "Internal Server Error")
+
+
+def error_details(exc: Exception) -> dict:
+    """Details added to the error response for `exc`: the invalid samples found
+    in the payload, or why an upload session couldn't accept a request.
+    """
+    if isinstance(exc, SampleValidationError):
+        return {"invalid_samples": exc.invalid, "errors": exc.errors}
+    if isinstance(exc, UploadSessionError):
+        details = {"reason": str(exc)}
+        if exc.missing is not None:
+            details["missing_chunks"] = exc.missing
+        return details
+    return {}
 
 
 async def loading_error(request, exc):
     logging.error(f"An issue occured while loading data: {exc}")
-    return JSONResponse(
-        {"message": "Issues occured while processing data"}, status_code=400
-    )
+    status_code, message = ERROR_RESPONSES[LoadingError]
+    return JSONResponse({"message": message}, status_code=status_code)
 
 
 async def validation_error(request, exc):
     logging.error(f"Validation error occured while loading data: {exc}")
-    return JSONResponse({"message": "Invalid data passed"}, status_code=422)
+    status_code, message = ERROR_RESPONSES[ValidationError]
+    return JSONResponse(
+        {"message": message, **error_details(exc)}, status_code=status_code
+    )
 
 
-async def export_error(request, exc):
-    logging.error(f"Error exporting data to file: {exc}")
+async def body_too_large_error(request, exc):
+    logging.error(f"Request body rejected: {exc}")
+    status_code, message = error_response(exc)
+    return JSONResponse({"message": message}, status_code=status_code)
+
+
+async def server_busy_error(request, exc):
+    logging.error(f"Upload rejected: {exc}")
+    status_code, message = error_response(exc)
     return JSONResponse(
-        {"message": "An issue occured during data export"}, status_code=500
+        {"message": message},
+        status_code=status_code,
+        headers={"Retry-After": str(exc.retry_after)},
     )
 
 
+async def upload_session_error(request, exc):
+    logging.error(f"Upload session request rejected: {exc}")
+    status_code, message = ERROR_RESPONSES[UploadSessionError]
+    return JSONResponse(
+        {"message": message, **error_details(exc)}, status_code=status_code
+    )
+
+
+async def export_error(request, exc):
+    logging.error(f"Error exporting data to file: {exc}")
+    status_code, message = ERROR_RESPONSES[ExportError]
+    return JSONResponse({"message": message}, status_code=status_code)
+
+
 EXCEPTION_HANDLER_MAPPING = {
     ValidationError: validation_error,
     LoadingError: loading_error,
     ExportError: export_error,
+    BodyTooLargeError: body_too_large_error,
+    ServerBusyError: server_busy_error,
+    UploadSessionError: upload_session_error,
 }
@@ -18,3 +18,69 @@ class LoadingError(Exception):
     """Raised during data loading, but not related to validation."""
 
     pass
+
+
+class BodyTooLargeError(LoadingError):
+    """Raised when a request body is larger than the configured limit."""
+
+    pass
+
+
+class SampleValidationError(ValidationError):
+    """Raised when individual samples have an invalid date or value.
+
+    Attributes:
+        errors: The first few invalid samples, as dictionaries with the `index`
+            of the sample, the `field` and `value` that's invalid and a `reason`
+        invalid: The total number of invalid samples
+    """
+
+    def __init__(self, message: str, errors: list, invalid: int):
+        super().__init__(message)
+        self.errors = errors
+        self.invalid = invalid
+
+    def __reduce__(self):
+        # So it can be raised in a worker process and re-raised in the server:
+        return (type(self), (str(self), self.errors, self.invalid))
+
+
+class TooManySamplesError(BodyTooLargeError):
+    """Raised when a request carries more samples than the configured limit."""
+
+    pass
+
+
+class ServerBusyError(Exception):
+    """Raised when an upload isn't admitted because the server is processing as
+    many uploads as it's allowed to, and the upload waited too long for a turn.
+
+    Attributes:
+        retry_after: Seconds the client should wait before sending it again
+    """
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class QueueFullError(ServerBusyError):
+    """Raised when an upload isn't admitted because too many uploads are
+    already waiting for a turn.
+    """
+
+    pass
+
+
+class UploadSessionError(LoadingError):
+    """Raised when a request doesn't fit the state of its upload session, e.g. a
+    chunk is sent after the session was committed.
+
+    Attributes:
+        missing: Numbers of the chunks that haven't been received, when the
+            session was committed too early
+    """
+
+    def __init__(self, message: str, missing: list = None):
+        super().__init__(message)
+        self.missing = missing
@@ -2,83 +2,329 @@
 (e.g JSON or CSV)
 """
 
-import json, csv, os
+import json, csv, math, os, re, sqlite3, uuid
 from abc import ABC, abstractmethod
-from typing import List, Union
-from .data import BaseHealthReading
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import chain, islice
+from typing import (
+    IO,
+    Callable,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
+from . import codec
+from .data import BaseHealthReading, ColumnarBatch, GenericHealthReading
 from .exceptions import ExportError
+from .timestamps import datetime_to_epoch
 from pathlib import Path
 
 
+class RowSchema(NamedTuple):
+    """The fields of the rows written by an exporter: `timestamp`, then one or
+    more value fields. `typecodes` holds the array typecode ("q" or "d") of
+    each value field, or None where values may be anything JSON can encode
+    (e.g. the raw values of `GenericHealthReading` objects, or floats that
+    aren't finite).
+    """
+
+    field_names: Tuple[str, ...]
+    typecodes: Tuple[Optional[str], ...]
+    reading_type: Optional[str] = None
+
+
+@lru_cache(maxsize=None)
+def reading_schema(reading_cls: type) -> RowSchema:
+    """Schema of rows built from `reading_cls` objects, cached per class."""
+    value_attribute = reading_cls.value_attribute_name()
+    typecode = (
+        None if reading_cls is GenericHealthReading else reading_cls.value_typecode
+    )
+    return RowSchema(("timestamp", value_attribute or "value"), (typecode,))
+
+
+def table_rows(
+    data: Union[ColumnarBatch, Iterable[BaseHealthReading]],
+    format_timestamps: bool = True,
+) -> Tuple[RowSchema, Iterator[tuple]]:
+    """The schema and rows (tuples in `field_names` order) of a batch or an
+    iterable of reading objects. Rows are produced lazily, so exporting a
+    generator of readings never holds all of them in memory. Timestamps are
+    formatted as strings, or left as epoch seconds if `format_timestamps` is
+    False.
+    """
+    if isinstance(data, ColumnarBatch):
+        columns = data.columns()
+        typecodes = tuple(
+            (
+                column.typecode
+                if column.typecode == "q" or all(map(math.isfinite, column))
+                else None
+            )
+            for column in columns
+        )
+        schema = RowSchema(tuple(data.field_names), typecodes, data.reading_type)
+        if format_timestamps:
+            return schema, data.rows()
+        return schema, zip(data.timestamps, *columns)
+
+    readings = iter(data)
+    first = next(readings, None)
+    if first is None:
+        return reading_schema(GenericHealthReading), iter(())
+    schema = reading_schema(type(first))
+    if format_timestamps:
+        rows = ((r.timestamp_string, r.get_value()) for r in chain((first,), readings))
+    else:
+        rows = (
+            (datetime_to_epoch(r.timestamp), r.get_value())
+            for r in chain((first,), readings)
+        )
+    return schema, rows
+
+
+@contextmanager
+def atomic_file(filename: Union[str, Path], mode: str = "w", **kwargs) -> Iterator[IO]:
+    """Opens a temporary file next to `filename` for writing, and moves it into
+    place when the block exits, so readers never see a partly written file and
+    two processes writing the same file leave one complete copy rather than a
+    mix of both. The temporary file is removed if writing fails.
+    """
+    path = Path(filename)
+    # Unique per write, since other processes may be writing the same file:
+    temp_path = path.with_name(".{}.{}.tmp".format(path.name, uuid.uuid4().hex))
+    try:
+        with open(temp_path, mode, **kwargs) as temp_file:
+            yield temp_file
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
 class ExporterBase(ABC):
-    """Abstract base class for all health reading exporters."""
+    """Abstract base class for all health reading exporters. Exporters write rows
+    (see `table_rows`) a chunk at a time, so memory use doesn't grow with the
+    number of readings exported.
+    """
+
+    # Exporters that collect every upload into one file (rather than one file per
+    # upload, named by record type and date range) set this to that file's name:
+    shared_filename: Optional[str] = None
+    # Number of rows written at a time, and the size of the file write buffer:
+    chunk_size: int = 10000
+    buffer_size: int = 1024 * 1024
+    # Whether rows are written with epoch seconds rather than formatted timestamps:
+    epoch_timestamps: bool = False
+
+    def readings_to_file(
+        self, data: Union[ColumnarBatch, Iterable[BaseHealthReading]], filename: str
+    ) -> str:
+        """Exports a collection of health readings to a file, and returns the file
+        path. `data` may be a `ColumnarBatch` (e.g. a `ReadingBatch`) or any
+        iterable of reading objects.
+        """
+        schema, rows = table_rows(data, format_timestamps=not self.epoch_timestamps)
+        return self.rows_to_file(schema, rows, filename)
 
     @abstractmethod
-    def readings_to_file(self, data: List[BaseHealthReading], filename: str) -> str:
-        """Exports a collection of health readings to a file. All classes implementing
-        this method should return the file path.
+    def rows_to_file(
+        self, schema: RowSchema, rows: Iterable[tuple], filename: str
+    ) -> str:
+        """Exports rows (tuples in `schema.field_names` order) to a file. All
+        classes implementing this method should consume `rows` in chunks (see
+        `chunks`) and return the file path.
         """
         pass
 
+    def chunks(self, rows: Iterable[tuple]) -> Iterator[List[tuple]]:
+        """Splits rows into lists of at most `chunk_size` rows."""
+        rows = iter(rows)
+        while True:
+            chunk = list(islice(rows, self.chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
 
 class CSVExporter(ExporterBase):
-    def readings_to_file(self, data: List[BaseHealthReading], filename: str) -> str:
-        """Exports a collection of readings to a CSV file, and returns the file path."""
+    def rows_to_file(
+        self, schema: RowSchema, rows: Iterable[tuple], filename: str
+    ) -> str:
+        """Exports rows to a CSV file, and returns the file path. The file is
+        replaced atomically (see `atomic_file`).
+        """
         try:
-            all_readings = [reading.to_dict() for reading in data]
-            with open(filename, "w", newline="") as export_file:
-                writer = csv.DictWriter(export_file, fieldnames=data[0].field_names)
-                writer.writeheader()
-                writer.writerows(all_readings)
-                return os.path.realpath(export_file.name)
+            with atomic_file(
+                filename, newline="", buffering=self.buffer_size
+            ) as export_file:
+                writer = csv.writer(export_file)
+                writer.writerow(schema.field_names)
+                template = self._row_template(schema)
+                for chunk in self.chunks(rows):
+                    if template is None:
+                        writer.writerows(chunk)
+                    else:
+                        export_file.write("".join([template % row for row in chunk]))
+            return os.path.realpath(filename)
         except Exception as e:
             raise ExportError(
                 "An error occured while writing the CSV file: {}".format(e)
             )
 
+    def _row_template(self, schema: RowSchema) -> Optional[str]:
+        """A template formatting a row of numbers like `csv.writer` would, or None
+        if values may need quoting.
+        """
+        if any(typecode is None for typecode in schema.typecodes):
+            return None
+        return "%s" + ",%r" * len(schema.typecodes) + "\r\n"
+
 
 class JSONExporter(ExporterBase):
-    def readings_to_file(self, data: List[BaseHealthReading], filename: str) -> str:
-        """Exports a collection of readings to a JSON file, and returns the file path."""
+    def rows_to_file(
+        self, schema: RowSchema, rows: Iterable[tuple], filename: str
+    ) -> str:
+        """Exports rows to a JSON file (an array with an object per row), and
+        returns the file path. The file is replaced atomically (see
+        `atomic_file`).
+        """
         try:
-            all_readings = [reading.to_dict() for reading in data]
-            with open(filename, "w") as export_file:
-                json.dump(all_readings, export_file)
-                return os.path.realpath(export_file.name)
+            encode_chunk = json_chunk_encoder(schema)
+            with atomic_file(
+                filename, encoding="utf-8", buffering=self.buffer_size
+            ) as export_file:
+                separator = "["
+                for chunk in self.chunks(rows):
+                    export_file.write(separator + encode_chunk(chunk))
+                    separator = ", "
+                export_file.write("[]" if separator == "[" else "]")
+            return os.path.realpath(filename)
         except Exception as e:
             raise ExportError(
                 "An error occured while writing the JSON file: {}".format(e)
             )
 
 
+def json_chunk_encoder(schema: RowSchema) -> Callable[[List[tuple]], str]:
+    """A function encoding a chunk of rows as comma-separated JSON objects, e.g.
+    `{"timestamp": "2019-12-16 08:24:36", "heart_rate": 74}`. Objects are
+    formatted straight from the row tuples with a template, rather than building
+    a dictionary per row. Values that aren't finite numbers are encoded with
+    the JSON codec (see `heartbridge.codec`).
+    """
+    numeric = all(typecode is not None for typecode in schema.typecodes)
+    template = (
+        '{"timestamp": "%s"'
+        + "".join(
+            ", {}: {}".format(json.dumps(name), "%r" if numeric else "%s")
+            for name in schema.field_names[1:]
+        )
+        + "}"
+    )
+    if numeric:
+        return lambda chunk: ", ".join([template % row for row in chunk])
+
+    def encode_value(value) -> str:
+        return codec.dumps(value).decode()
+
+    return lambda chunk: ", ".join(
+        [template % (row[0], *map(encode_value, row[1:])) for row in chunk]
+    )
+
+
+class SQLiteExporter(ExporterBase):
+    """Exports readings into a SQLite database with one table per record type.
+    Timestamps are stored as epoch seconds in the table's primary key, so
+    re-sending an overlapping date range updates the existing rows instead of
+    duplicating them, and time range queries use the primary key index.
+    """
+
+    shared_filename = "heartbridge"
+    chunk_size = 50000
+    epoch_timestamps = True
+
+    def rows_to_file(
+        self, schema: RowSchema, rows: Iterable[tuple], filename: str
+    ) -> str:
+        """Upserts rows into the database at `filename`, and returns the database
+        path.
+        """
+        try:
+            table = sqlite_table_name(schema.reading_type or schema.field_names[1])
+            columns = schema.field_names[1:]
+            column_list = ", ".join(f'"{column}"' for column in columns)
+            column_definitions = ", ".join(
+                '"{}" {}'.format(column, "INTEGER" if typecode == "q" else "REAL")
+                for column, typecode in zip(columns, schema.typecodes)
+            )
+            updates = ", ".join(
+                f'"{column}" = excluded."{column}"' for column in columns
+            )
+            connection = sqlite3.connect(filename, timeout=30)
+            try:
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.execute("PRAGMA synchronous=NORMAL")
+                with connection:
+                    connection.execute(
+                        f'CREATE TABLE IF NOT EXISTS "{table}" '
+                        f"(timestamp INTEGER PRIMARY KEY, {column_definitions})"
+                    )
+                    placeholders = ", ".join("?" * (len(columns) + 1))
+                    for chunk in self.chunks(rows):
+                        connection.executemany(
+                            f'INSERT INTO "{table}" (timestamp, {column_list}) '
+                            f"VALUES ({placeholders}) ON CONFLICT(timestamp) "
+                            f"DO UPDATE SET {updates}",
+                            chunk,
+                        )
+            finally:
+                connection.close()
+            return os.path.realpath(filename)
+        except Exception as e:
+            raise ExportError(
+                "An error occured while writing to the SQLite database: {}".format(e)
+            )
+
+
+def sqlite_table_name(reading_type: str) -> str:
+    """Table used by `SQLiteExporter` for a record type, e.g. heart-rate -> heart_rate"""
+    return re.sub(r"[^a-z0-9]+", "_", reading_type.lower()).strip("_")
+
+
 def export_filepath(filename: str, output_dir: str, filetype: str) -> Union[Path, None]:
     """
     Constructs the file path to be exported, based on user preferences.
-    Will return None if the file path could not be constructed. Will check if
-    the target directory exists beforehand and create if necessary.
+    Will return None if the file path could not be constructed. Will create the
+    target directory if necessary (it's fine if another process creates it at
+    the same time).
 
     Arguments:
         * filename (str): The name of the file to be exported (no extension)
         * output_dir (str): The directory to export the file to
-        * filetype (str): Either csv or json
+        * filetype (str): One of the keys of `EXPORT_CLS_MAP` (e.g. csv or json)
     """
 
     if filename and filetype:
         if output_dir:
             # File will reside in the directory passed in by the user
             fp = Path(output_dir)
-            if fp.is_dir():
-                # If the user passed in a directory that already exists, great! Construct a full path based on it.
-                fp = fp / f"{filename}.{filetype}"
-            else:
-                # The directory must not exist yet -- create it and then construct the path.
-                try:
-                    os.mkdir(fp)
-                    fp = fp / f"{filename}.{filetype}"
-                except Exception as e:
-                    raise ExportError(
-                        "Exception occured while creating directory: {}".format(e)
-                    )
+            try:
+                # Creates the directory unless it already exists:
+                fp.mkdir(parents=True, exist_ok=True)
+            except Exception as e:
+                raise ExportError(
+                    "Exception occured while creating directory: {}".format(e)
+                )
+            fp = fp / f"{filename}.{filetype}"
         else:
             # File will reside in the current working directory and will return filename.filetype
             fp = Path(str(filename) + "." + str(filetype))
@@ -2,35 +2,130 @@
 and coordinating exports of that data.
 """
 
-from .data import BaseHealthReading, GenericHealthReading
-from .exceptions import ValidationError, LoadingError
-from .export import export_filepath
+from . import codec, stats
+from .data import GenericHealthReading, ReadingBatch
+from .exceptions import (
+    ValidationError,
+    LoadingError,
+    ExportError,
+    TooManySamplesError,
+)
+from .export import atomic_file, export_filepath, table_rows
+from .index import ExportIndex, file_lock
+from .aggregate import BUCKET_SECONDS, resample
+from .metrics import stage_timer
+from .partition import export_partitioned
+from .reader import ExportReader
+from .timestamps import epoch_to_datetime
+from .validation import check_samples, parse_samples
 from .constants import (
     EXPORT_CLS_MAP,
     READING_MAPPING,
     REQUIRED_FIELDS,
     LEGACY_RECORD_TYPE,
-    DATE_PARSE_STRING,
 )
-from typing import List
+from array import array
+from bisect import bisect_left
 from datetime import datetime
+from itertools import chain
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional
 import warnings
 
 
+def batch_records(data) -> Optional[List[dict]]:
+    """Splits a batch upload carrying several record types into one Shortcuts
+    payload per record type. A batch is either a list of payloads (each with its
+    own `type`), or an object keyed by record type:
+
+        {"Heart Rate": {"dates": [...], "values": [...]},
+         "Steps": {"dates": [...], "values": [...]}}
+
+    Returns None if `data` is a regular single-type payload.
+    """
+    if isinstance(data, list):
+        if not data:
+            raise LoadingError("A batch must contain at least one record")
+        if not all(isinstance(record, dict) for record in data):
+            raise LoadingError("Batches must be sent as a list of JSON objects")
+        return data
+    if not isinstance(data, dict):
+        raise LoadingError("Shortcuts data must be sent as a JSON object")
+    if data and "type" not in data and all(isinstance(v, dict) for v in data.values()):
+        return [{"type": key, **record} for key, record in data.items()]
+    return None
+
+
+def check_sample_count(samples: int, max_samples: Optional[int]) -> None:
+    """Raises `TooManySamplesError` if more than `max_samples` samples were sent."""
+    if max_samples is not None and samples > max_samples:
+        raise TooManySamplesError(
+            "{} samples were sent, but at most {} are accepted per upload".format(
+                samples, max_samples
+            )
+        )
+
+
+def count_samples(records: List[dict]) -> int:
+    """The number of samples sent in the records of a batch upload (records
+    without a list of dates are left to fail validation later).
+    """
+    total = 0
+    for record in records:
+        dates = record.get("dates", record.get("hrDates"))
+        if isinstance(dates, str):
+            total += 1  # a single sample
+        elif hasattr(dates, "__len__"):
+            total += len(dates)
+    return total
+
+
 class Health:
     """Coordinates parsing health data from Shortcuts, and stores a collection
     of parsed data to be exported.
     """
 
-    def __init__(self, output_dir: str = None, output_format: str = None):
+    def __init__(
+        self,
+        output_dir: str = None,
+        output_format: str = None,
+        rollup: str = None,
+        instrument: bool = False,
+        drop_invalid: bool = False,
+        partition: bool = False,
+        summarize: bool = False,
+        gap_threshold: int = stats.DEFAULT_GAP_THRESHOLD,
+        max_samples: int = None,
+    ):
         self.output_dir = output_dir
         self.output_format = output_format
+        # When set (e.g. "hour"), readings are resampled into buckets on export:
+        self.rollup = rollup
+        # Whether CSV/JSON readings are merged into daily partitions rather than
+        # exported to a file per upload (see `heartbridge.partition`):
+        self.partition = partition
         self.readings = None
         self.reading_type_slug = None
+        # Seconds spent in each stage of loading (validate, parse), when instrumented:
+        self.timings = {} if instrument else None
+        # Whether samples with an invalid date or value are dropped rather than
+        # rejecting the whole payload, and how many were dropped:
+        self.drop_invalid = drop_invalid
+        self.dropped = 0
+        self.dropped_samples = []
+        # Whether summary statistics of the readings are computed as they're
+        # loaded (see `heartbridge.stats`), and written next to the export:
+        self.summarize = summarize
+        self.gap_threshold = gap_threshold
+        self.summary = None
+        # Date range of the readings summarized, which names the summary file:
+        self._summary_range = None
+        # The most samples a payload may carry (None for no limit):
+        self.max_samples = max_samples
 
     def load_from_shortcuts(self, data: dict) -> None:
-        """Validates and loads data from the iOS Shortcuts app into a list of HealthReading
-        instances.
+        """Validates and loads data from the iOS Shortcuts app into a `ReadingBatch`
+        of readings.
 
         Args:
             data: The dictionary containing readings after data deserialization
@@ -40,39 +135,238 @@ class Health:
         reading_type = self._extract_record_type(data)
 
         # In cases where there's only one record, Shortcuts will send a string instead of a list.
-        # We'll check if this happened and coerce everything into a list, before parsing.
+        # We'll check if this happened and coerce it into a list, before parsing
+        # (the streaming parser does the same, see `heartbridge.stream`).
+        fields = REQUIRED_FIELDS
         if reading_type == LEGACY_RECORD_TYPE:
-            if (type(data["hrDates"]) == str) and (type(data["hrValues"]) == str):
-                data["hrDates"] = [data["hrDates"]]
-                data["hrValues"] = [data["hrValues"]]
+            fields = ["hrDates", "hrValues"]
+        for field in fields:
+            if type(data.get(field)) == str:
+                data[field] = [data[field]]
+
+        with stage_timer(self.timings, "validate"):
+            valid = self._validate_input_fields(data, reading_type)
+        if valid:
+            self.reading_type_slug = reading_type
+            with stage_timer(self.timings, "parse"):
+                self.readings = self._parse_shortcuts_data(data=data)
+                self._summarize()
         else:
-            if (type(data["dates"]) == str) and (type(data["values"]) == str):
-                data["dates"] = [data["dates"]]
-                data["values"] = [data["values"]]
+            raise ValidationError("Could not validate input data from Shortcuts")
 
-        if self._validate_input_fields(data, reading_type):
+    def load_from_columns(self, data: dict) -> None:
+        """Validates and loads Shortcuts data whose dates and values have already been
+        converted to columns of epoch seconds and floats, e.g. by
+        `heartbridge.stream.ShortcutsStreamParser`.
+
+        Args:
+            data: The parsed payload, keyed like the original Shortcuts JSON
+        """
+
+        reading_type = self._extract_record_type(data)
+
+        with stage_timer(self.timings, "validate"):
+            valid = self._validate_input_fields(data, reading_type)
+        if valid:
             self.reading_type_slug = reading_type
-            self.readings = self._parse_shortcuts_data(data=data)
+            reading_cls = READING_MAPPING.get(reading_type, GenericHealthReading)
+            date_key, value_key = self._field_keys()
+            with stage_timer(self.timings, "parse"):
+                timestamps, values, dropped = check_samples(
+                    reading_cls,
+                    data[date_key],
+                    data[value_key],
+                    invalid=getattr(data, "invalid", None),
+                    fields=(date_key, value_key),
+                    drop_invalid=self.drop_invalid,
+                )
+                self._record_dropped(len(data[date_key]), timestamps, dropped)
+                self.readings = ReadingBatch(
+                    reading_cls, timestamps, values, reading_type=reading_type
+                )
+                self._summarize()
         else:
             raise ValidationError("Could not validate input data from Shortcuts")
 
+    def load_from_batch(self, readings: ReadingBatch) -> None:
+        """Loads readings that were already parsed into a `ReadingBatch`, e.g. by
+        `heartbridge.applehealth`. The batch's `reading_type` is used as the
+        record type. Readings are sorted by timestamp if they aren't already,
+        since exports are named and indexed by their first and last readings.
+        """
+        self.reading_type_slug = readings.reading_type
+        self.readings = readings.sorted()
+        self._summarize()
+
+    def load_from_export(self, path, start: int = None, end: int = None) -> None:
+        """Loads readings from a CSV or JSON file exported by Heartbridge, without
+        parsing the whole file (see `heartbridge.reader`). Only readings with
+        timestamps in `[start, end)` (epoch seconds; either may be None for an
+        open end) are loaded, in timestamp order.
+        """
+        with ExportReader(path, self.reading_type_slug) as reader:
+            if reader.reducers:
+                raise LoadingError(
+                    "{} holds a rollup; use heartbridge.reader.ExportReader to "
+                    "read it".format(path)
+                )
+            self.load_from_batch(reader.window(start, end))
+
     def export(self) -> str:
         """Depending on the `output_format`, calls the correct export functions
-        and returns a path to the file created.
+        and returns a path to the file created. If `rollup` is set, readings are
+        resampled into buckets of that size first (see `heartbridge.aggregate`).
+        With `partition`, CSV/JSON readings are merged into daily partitions and
+        the path of the record type's directory is returned instead.
+
+        With `summarize`, the upload's summary statistics are written to a
+        sidecar file as well (see `summary_path`).
         """
+        export_filename = self._export([self.readings])
+        self._export_summary()
+        return export_filename
+
+    def export_batches(
+        self, batches: Iterable[ReadingBatch], start: int, end: int
+    ) -> str:
+        """Like `export`, for readings of `reading_type_slug` that aren't loaded,
+        but given as `batches` (e.g. the merged chunks of an upload session, see
+        `heartbridge.sessions`), so they're never all in memory. Batches must be
+        sorted and follow each other in time, from `start` to `end` (epoch
+        seconds, naming the exported file), and are exported one at a time.
+        With `summarize`, `summary` is computed as they go past.
+        """
+        self._summary_range = self._format_date_range(
+            epoch_to_datetime(start), epoch_to_datetime(end)
+        )
+        summarizer = stats.Summarizer(self.gap_threshold) if self.summarize else None
+
+        def summarized() -> Iterator[ReadingBatch]:
+            for batch in batches:
+                if summarizer is not None:
+                    summarizer.add(batch)
+                yield batch
+
+        export_filename = self._export(summarized(), self._summary_range)
+        if summarizer is not None:
+            self.summary = summarizer.summary()
+        self._export_summary()
+        return export_filename
+
+    def _export(self, batches: Iterable[ReadingBatch], date_range: str = None) -> str:
+        batches = iter(batches)
+        reading_type = self.reading_type_slug
+        if self.rollup:
+            batches = _resampled(batches, self.rollup)
+        try:
+            first = next(batches)
+        except StopIteration:
+            raise LoadingError("There are no readings to export")
+        if self.rollup:
+            reading_type = first.reading_type
+        batches = chain((first,), batches)
 
-        # Generate filename based on record type and date range:
-        filename = "{}-{}".format(self.reading_type_slug, self._string_date_range())
-        filepath = export_filepath(filename, self.output_dir, self.output_format)
         # Use the correct export class to export data, based on output format:
         exporter = EXPORT_CLS_MAP[self.output_format]
-        # Return the full path of the file exported:
-        export_filename = exporter().readings_to_file(self.readings, filepath)
+        if self.partitioned:
+            for data in batches:
+                export_filename = export_partitioned(
+                    data, reading_type, self.output_dir, self.output_format
+                )
+            return export_filename
+        filepath = self.export_path(reading_type, date_range)
+        if exporter.shared_filename is not None:
+            # The database coordinates concurrent writers itself:
+            for data in batches:
+                export_filename = exporter().readings_to_file(data, filepath)
+            return export_filename
+        # Uploads of the same record type and date range (possibly in other
+        # server processes) write the same file, one at a time, so the index
+        # entry always describes the file that ends up on disk. One lock file
+        # per record type, rather than per exported file:
+        written = []
+
+        def rows() -> Iterator[tuple]:
+            for data in batches:
+                written.append((data.timestamps[0], data.timestamps[-1], len(data)))
+                yield from table_rows(data, not exporter.epoch_timestamps)[1]
+
+        schema = table_rows(first, not exporter.epoch_timestamps)[0]
+        with file_lock(filepath.with_name("." + reading_type + ".lock")):
+            # Return the full path of the file exported:
+            export_filename = exporter().rows_to_file(schema, rows(), filepath)
+            # Record the file's time range, so range queries only open relevant files:
+            try:
+                ExportIndex(self.output_dir).add(
+                    export_filename,
+                    reading_type,
+                    self.output_format,
+                    written[0][0],
+                    written[-1][1],
+                    sum(samples for _, _, samples in written),
+                )
+            except OSError as e:
+                raise ExportError("Could not update the export index: {}".format(e))
         return export_filename
 
-    def _parse_shortcuts_data(self, data: dict) -> List[BaseHealthReading]:
-        """Parses input data from Shortcuts, and returns a list of health reading instances
-        based on the type of input data. The list is ordered by timestamp (ascending).
+    @property
+    def partitioned(self) -> bool:
+        """Whether readings are exported into daily partitions (only CSV/JSON
+        exports are partitioned; the SQLite database already merges uploads).
+        """
+        return self.partition and not EXPORT_CLS_MAP[self.output_format].shared_filename
+
+    def export_path(self, reading_type: str = None, date_range: str = None):
+        """The path `export` writes the loaded readings to. Files are named by
+        record type and date range (of the loaded readings, unless `date_range`
+        is given), unless the exporter writes every upload to the same file, or
+        readings are partitioned (in which case this is the record type's
+        directory).
+        """
+        exporter = EXPORT_CLS_MAP[self.output_format]
+        if self.partitioned:
+            return Path(self.output_dir or ".") / (
+                reading_type or self.reading_type_slug
+            )
+        filename = exporter.shared_filename or "{}-{}".format(
+            reading_type or self.reading_type_slug,
+            date_range or self._string_date_range(),
+        )
+        return export_filepath(filename, self.output_dir, self.output_format)
+
+    def summary_path(self) -> Path:
+        """The sidecar file `export` writes the summary statistics to, named by
+        record type and date range like a per-upload export (whatever the
+        output format), e.g. heart-rate-Apr01-2021.stats.json. The date range is
+        the one of the readings summarized when they were loaded, even if only
+        some of them are exported (e.g. with `--dedup`).
+        """
+        return Path(self.output_dir or ".") / "{}-{}.stats.json".format(
+            self.reading_type_slug, self._summary_range or self._string_date_range()
+        )
+
+    def _summarize(self) -> None:
+        if self.summarize:
+            self.summary = stats.summarize(self.readings, self.gap_threshold)
+            if self.readings:
+                self._summary_range = self._string_date_range()
+
+    def _export_summary(self) -> None:
+        if self.summary is None:
+            return
+        try:
+            with atomic_file(self.summary_path(), "wb") as summary_file:
+                summary_file.write(codec.dumps(self.summary))
+        except OSError as e:
+            raise ExportError("Could not write the upload summary: {}".format(e))
+
+    def _parse_shortcuts_data(self, data: dict) -> ReadingBatch:
+        """Parses input data from Shortcuts, and returns a columnar batch of readings
+        based on the type of input data. The batch is ordered by timestamp (ascending).
+
+        Every date and value is validated as it's parsed (see `heartbridge.validation`).
+        Invalid samples raise a `SampleValidationError`, or are dropped if
+        `drop_invalid` is set.
 
         Args:
             data: Input data from shortcuts (as a dictionary)
@@ -80,19 +374,30 @@ class Health:
 
         reading_cls = READING_MAPPING.get(self.reading_type_slug, GenericHealthReading)
 
-        date_key, value_key = ("dates", "values")
-        if self.reading_type_slug == "heart-rate-legacy":
-            date_key, value_key = ("hrDates", "hrValues")
+        date_key, value_key = self._field_keys()
 
-        dates = (datetime.strptime(x, DATE_PARSE_STRING) for x in data[date_key])
-        values = (float(x) for x in data[value_key])
+        timestamps, values, dropped = parse_samples(
+            reading_cls,
+            data[date_key],
+            data[value_key],
+            fields=(date_key, value_key),
+            drop_invalid=self.drop_invalid,
+        )
+        self._record_dropped(len(data[date_key]), timestamps, dropped)
 
-        readings = []
+        return ReadingBatch(
+            reading_cls, timestamps, values, reading_type=self.reading_type_slug
+        )
 
-        for date, value in zip(dates, values):
-            readings.append(reading_cls(**{"timestamp": date, "value": value}))
+    def _record_dropped(self, received: int, timestamps, dropped: list) -> None:
+        self.dropped = received - len(timestamps)
+        self.dropped_samples = dropped
 
-        return readings
+    def _field_keys(self) -> tuple:
+        """Returns the (dates, values) keys used by Shortcuts for the loaded reading type."""
+        if self.reading_type_slug == LEGACY_RECORD_TYPE:
+            return ("hrDates", "hrValues")
+        return ("dates", "values")
 
     def _check_legacy(self, data: dict) -> bool:
         """Checks whether the data is coming from the original version of Heartbridge
@@ -122,6 +427,10 @@ class Health:
                 raise LoadingError(
                     "Shortcuts input data must include a type key indicating the type of health record"
                 )
+        elif not isinstance(reading_type, str):
+            raise LoadingError(
+                "The type of health record sent by Shortcuts must be a string"
+            )
         else:
             return reading_type.lower().replace(" ", "-")
 
@@ -129,6 +438,7 @@ class Health:
         """Validates that:
         * Input data contains the correct keys for the given reading type
         * Input data shape is correct
+        * Input data carries at most `max_samples` samples
         """
         fields = REQUIRED_FIELDS
         if reading_type == LEGACY_RECORD_TYPE:
@@ -137,10 +447,14 @@ class Health:
             raise ValidationError(
                 f"Data does not have all the required fields for this record type: {fields}"
             )
+        # Lists from Shortcuts, or columns from the streaming parser:
+        if not all(isinstance(data[field], (list, array)) for field in fields):
+            raise ValidationError(f"The fields in {fields} must be lists of strings.")
         if not self._validate_input_field_length(data=data, reading_type=reading_type):
             raise ValidationError(
                 f"The lengths of both fields in {fields} must be equal."
             )
+        check_sample_count(len(data[fields[0]]), self.max_samples)
 
         return True
 
@@ -169,10 +483,8 @@ class Health:
             )
 
         try:
-            begin_date = self.readings[
-                0
-            ].timestamp  # gets first element of the tuple (datetime) from first item in list
-            end_date = self.readings[-1].timestamp
+            begin_date = self.readings.start
+            end_date = self.readings.end
         except Exception as e:
             raise LoadingError(
                 "Failed to determine the date range for the data passed in: {}".format(
@@ -180,6 +492,10 @@ class Health:
                 )
             )
 
+        return self._format_date_range(begin_date, end_date)
+
+    @staticmethod
+    def _format_date_range(begin_date: datetime, end_date: datetime) -> str:
         begin_string = begin_date.strftime("%b%d-%Y")
         end_string = end_date.strftime("%b%d-%Y")
 
@@ -187,3 +503,36 @@ class Health:
             return begin_string
         else:
             return "{0}-{1}".format(begin_string, end_string)
+
+
+def _resampled(batches: Iterator[ReadingBatch], bucket: str) -> Iterator:
+    """Resamples readings given as time-ordered batches (see `export_batches`),
+    a batch at a time. When another batch follows, the samples of a batch's last
+    bucket are held back and resampled with it, so no bucket is split.
+    """
+    seconds = BUCKET_SECONDS.get(bucket, bucket)
+    pending = None
+    for batch in batches:
+        if pending is not None and len(pending):
+            timestamps = pending.timestamps
+            split = bisect_left(timestamps, timestamps[-1] // seconds * seconds)
+            if split:
+                yield resample(_slice(pending, 0, split), bucket)
+            batch = ReadingBatch(
+                batch.reading_cls,
+                timestamps[split:] + batch.timestamps,
+                pending.values[split:] + batch.values,
+                reading_type=batch.reading_type,
+            )
+        pending = batch
+    if pending is not None:
+        yield resample(pending, bucket)
+
+
+def _slice(batch: ReadingBatch, start: int, stop: int) -> ReadingBatch:
+    return ReadingBatch(
+        batch.reading_cls,
+        batch.timestamps[start:stop],
+        batch.values[start:stop],
+        reading_type=batch.reading_type,
+    )
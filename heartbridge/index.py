@@ -0,0 +1,104 @@
+"""Index of exported files. Every CSV/JSON export is recorded with its record
+type and time range, so range queries only need to open the files that
+overlap the requested window.
+"""
+
+import json, os, threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, List, Union
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; only threads are coordinated there
+    fcntl = None
+
+INDEX_FILENAME = ".heartbridge-index.json"
+
+# One lock per lock file, for the threads of this process:
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+@contextmanager
+def file_lock(path: Union[str, Path]) -> Iterator[None]:
+    """Holds an exclusive lock on `path` (created if needed), shared by the
+    threads of this process and, where `fcntl` is available, other processes.
+    """
+    with _locks_lock:
+        thread_lock = _locks.setdefault(os.path.realpath(path), threading.Lock())
+    with thread_lock, open(path, "w") as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+class ExportIndex:
+    """Reads and updates the index file kept in an output directory.
+
+    Entries look like:
+        {"file": "heart-rate-Dec16-2019.csv", "type": "heart-rate",
+         "format": "csv", "start": 1576484676, "end": 1576540585, "rows": 6}
+
+    `start` and `end` are the first and last timestamps in the file (epoch
+    seconds, both inclusive). `file` is relative to the output directory, e.g.
+    `heart-rate/2021/04/01.csv` for partitioned exports.
+    """
+
+    def __init__(self, directory: Union[str, Path, None]):
+        self.directory = Path(directory) if directory else Path(".")
+        self.path = self.directory / INDEX_FILENAME
+
+    def entries(self) -> List[dict]:
+        try:
+            with open(self.path, "r") as index_file:
+                return json.load(index_file)
+        except FileNotFoundError:
+            return []
+
+    def add(
+        self,
+        filepath: Union[str, Path],
+        reading_type: str,
+        output_format: str,
+        start: int,
+        end: int,
+        rows: int,
+    ) -> None:
+        """Records an exported file, replacing any previous entry for the same file."""
+        try:
+            name = Path(filepath).resolve().relative_to(self.directory.resolve())
+            name = name.as_posix()
+        except ValueError:
+            name = Path(filepath).name
+        entry = {
+            "file": name,
+            "type": reading_type,
+            "format": output_format,
+            "start": start,
+            "end": end,
+            "rows": rows,
+        }
+        with file_lock(self.directory / (INDEX_FILENAME + ".lock")):
+            entries = [e for e in self.entries() if e["file"] != name]
+            entries.append(entry)
+            entries.sort(key=lambda e: (e["type"], e["start"], e["file"]))
+            temp_path = self.path.with_name(self.path.name + ".tmp")
+            with open(temp_path, "w") as index_file:
+                json.dump(entries, index_file)
+            os.replace(temp_path, self.path)
+
+    def lookup(
+        self, reading_type: str, start: int = None, end: int = None
+    ) -> List[dict]:
+        """Entries for `reading_type` with data in the `[start, end)` window. Either
+        bound may be None for an open-ended window.
+        """
+        return [
+            e
+            for e in self.entries()
+            if e["type"] == reading_type
+            and (start is None or e["end"] >= start)
+            and (end is None or e["start"] < end)
+            and (self.directory / e["file"]).exists()
+        ]
@@ -0,0 +1,113 @@
+"""Offline ingest of saved Shortcuts payloads, for backfills. Payload files
+(plain JSON, or gzip compressed) are loaded and exported in a pool of
+processes, so every core is busy instead of replaying uploads one by one
+over HTTP.
+"""
+
+import gzip, os, time, warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Iterable, Iterator, List, Union
+from . import codec
+from .health import Health, batch_records
+
+PAYLOAD_SUFFIXES = (".json", ".json.gz")
+
+
+def find_payloads(paths: Iterable[Union[str, Path]]) -> List[Path]:
+    """Expands `paths` into a sorted list of payload files. Files are used as
+    given; directories are searched recursively for *.json and *.json.gz files.
+    """
+    found = set()
+    for path in map(Path, paths):
+        if path.is_dir():
+            found.update(
+                p
+                for p in path.rglob("*")
+                if p.is_file() and p.name.endswith(PAYLOAD_SUFFIXES)
+            )
+        else:
+            found.add(path)
+    return sorted(found)
+
+
+def read_payload(path: Path) -> bytes:
+    """Reads a payload file, decompressing it if it ends in .gz."""
+    if path.suffix == ".gz":
+        with gzip.open(path, "rb") as payload_file:
+            return payload_file.read()
+    return path.read_bytes()
+
+
+def ingest_file(path: Path, options: dict) -> dict:
+    """Loads and exports every record in a payload file. Returns a summary of
+    the file: its record types, sample count, exported files and any error.
+
+    Runs in a worker process, so it must stay a module-level function.
+    """
+    result = {"file": str(path), "types": [], "samples": 0, "exported": []}
+    try:
+        result["bytes"] = os.path.getsize(path)
+        data = codec.loads(read_payload(path))
+        records = batch_records(data) or [data]
+        with warnings.catch_warnings():
+            # Archives of the original shortcut's uploads would warn on every file:
+            warnings.simplefilter("ignore", FutureWarning)
+            for record in records:
+                health = Health(**options)
+                health.load_from_shortcuts(record)
+                result["types"].append(health.reading_type_slug)
+                result["samples"] += len(health.readings)
+                if len(health.readings) > 0:
+                    result["exported"].append(str(health.export()))
+    except Exception as e:
+        result["error"] = "{}: {}".format(type(e).__name__, e)
+    return result
+
+
+def ingest_paths(
+    paths: Iterable[Union[str, Path]], options: dict, workers: int = None
+) -> Iterator[dict]:
+    """Ingests every payload file found in `paths` across a pool of `workers`
+    processes, yielding the summary of each file (see `ingest_file`) as it
+    finishes. `options` are passed on to `Health`.
+    """
+    files = find_payloads(paths)
+    if not files:
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(ingest_file, path, options) for path in files]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+class IngestReport:
+    """Running totals of an ingest, for reporting throughput."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.files = 0
+        self.failed = 0
+        self.samples = 0
+        self.bytes = 0
+
+    def add(self, result: dict) -> None:
+        self.files += 1
+        self.failed += "error" in result
+        self.samples += result["samples"]
+        self.bytes += result.get("bytes", 0)
+
+    def summary(self) -> str:
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        return (
+            "Ingested {:,} files ({:,} failed): {:,} samples, {:.1f} MB in {:.2f}s "
+            "({:,.0f} samples/s, {:.1f} MB/s)".format(
+                self.files,
+                self.failed,
+                self.samples,
+                self.bytes / 1e6,
+                elapsed,
+                self.samples / elapsed,
+                self.bytes / 1e6 / elapsed,
+            )
+        )
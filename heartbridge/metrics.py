@@ -0,0 +1,276 @@
+"""Instrumentation of uploads: how long each stage of processing takes, and
+how many samples and bytes are received per record type. Measurements are
+kept in a `MetricsRegistry`, rendered in the Prometheus text format for
+`GET /metrics`, and can also be logged as one JSON line per upload.
+
+When instrumentation is off, uploads are measured with `DISABLED`, which
+does nothing, and `Health` doesn't time its stages.
+"""
+
+import json, logging, threading, time
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Iterator, Optional, Tuple
+
+# Label for record types Heartbridge doesn't know. Clients can send any type, so
+# labelling each one separately would create any number of time series:
+OTHER_RECORD_TYPE = "other"
+
+# Upper bounds (in seconds) of the latency histogram buckets:
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+logger = logging.getLogger("heartbridge.metrics")
+
+
+def stage_timer(timings: Optional[Dict[str, float]], stage: str):
+    """Context manager adding the time spent in its block to `timings[stage]`.
+    Does nothing if `timings` is None.
+    """
+    if timings is None:
+        return nullcontext()
+    return _timed(timings, stage)
+
+
+@contextmanager
+def _timed(timings: Dict[str, float], stage: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+
+class UploadMetrics:
+    """Measurements for one upload (or one record type of a batch upload)."""
+
+    enabled = True
+
+    def __init__(self, record_type: str = "unknown"):
+        self.record_type = record_type
+        self.status_code = None
+        self.samples = 0
+        self.bytes = 0
+        self.timings = {}
+        self.started = time.perf_counter()
+
+    def time(self, stage: str):
+        """Times a stage of processing the upload, e.g. `with upload.time("export"):`"""
+        return _timed(self.timings, stage)
+
+    def add_timings(self, timings: Optional[Dict[str, float]]) -> None:
+        """Adds stage timings measured elsewhere (e.g. by `Health`)."""
+        for stage, seconds in (timings or {}).items():
+            self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+
+    def finish(self, status_code: int) -> float:
+        """Records the response status, returning the upload's total duration."""
+        self.status_code = status_code
+        self.duration = time.perf_counter() - self.started
+        return self.duration
+
+    def log_record(self) -> dict:
+        return {
+            "type": self.record_type,
+            "status": self.status_code,
+            "samples": self.samples,
+            "bytes": self.bytes,
+            "seconds": round(self.duration, 6),
+            "stages": {stage: round(s, 6) for stage, s in self.timings.items()},
+        }
+
+
+class _DisabledUploadMetrics(UploadMetrics):
+    """Stands in for `UploadMetrics` when instrumentation is off."""
+
+    enabled = False
+    record_type = None
+    status_code = None
+    samples = 0
+    bytes = 0
+    timings = None
+    duration = 0.0
+
+    def __init__(self):
+        pass
+
+    def __setattr__(self, name, value):
+        pass
+
+    def time(self, stage: str):
+        return nullcontext()
+
+    def add_timings(self, timings) -> None:
+        pass
+
+    def finish(self, status_code: int) -> float:
+        return 0.0
+
+
+DISABLED = _DisabledUploadMetrics()
+
+
+class Histogram:
+    """A Prometheus histogram: counts of observations per bucket, plus their
+    sum and total count.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self) -> Iterator[Tuple[str, int]]:
+        total = 0
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            total += count
+            yield str(bound), total
+
+
+class MetricsRegistry:
+    """Aggregates `UploadMetrics` across uploads.
+
+    Exposed metrics:
+        heartbridge_uploads_total{type, status}: uploads processed
+        heartbridge_samples_total{type}: samples received
+        heartbridge_bytes_total{type}: request body bytes received
+        heartbridge_upload_seconds{type}: histogram of total processing time
+        heartbridge_stage_seconds{type, stage}: histogram of time per stage
+            (decode, validate, parse, export)
+
+    A batch upload is counted once in `heartbridge_uploads_total` (as type
+    batch) and `heartbridge_bytes_total`, and its samples under each record
+    type it holds. Record types Heartbridge doesn't know are counted as
+    `OTHER_RECORD_TYPE`.
+
+    Throughput follows from these, e.g. samples per second of parsing is
+    `rate(heartbridge_samples_total) / rate(heartbridge_stage_seconds_sum{stage="parse"})`.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._uploads = {}
+        self._samples = {}
+        self._bytes = {}
+        self._upload_seconds = {}
+        self._stage_seconds = {}
+
+    def observe(self, upload: UploadMetrics) -> None:
+        if not upload.enabled:
+            return
+        record_type = upload.record_type
+        with self._lock:
+            key = (record_type, str(upload.status_code))
+            self._uploads[key] = self._uploads.get(key, 0) + 1
+            self._samples[record_type] = (
+                self._samples.get(record_type, 0) + upload.samples
+            )
+            self._bytes[record_type] = self._bytes.get(record_type, 0) + upload.bytes
+            self._histogram(self._upload_seconds, record_type).observe(upload.duration)
+            for stage, seconds in upload.timings.items():
+                self._histogram(self._stage_seconds, (record_type, stage)).observe(
+                    seconds
+                )
+
+    def render(self) -> str:
+        """The metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            self._render_counter(
+                lines,
+                "heartbridge_uploads_total",
+                "Uploads processed, by record type and response status",
+                ("type", "status"),
+                self._uploads,
+            )
+            self._render_counter(
+                lines,
+                "heartbridge_samples_total",
+                "Samples received, by record type",
+                ("type",),
+                self._samples,
+            )
+            self._render_counter(
+                lines,
+                "heartbridge_bytes_total",
+                "Request body bytes received, by record type",
+                ("type",),
+                self._bytes,
+            )
+            self._render_histograms(
+                lines,
+                "heartbridge_upload_seconds",
+                "Time taken to process an upload",
+                ("type",),
+                self._upload_seconds,
+            )
+            self._render_histograms(
+                lines,
+                "heartbridge_stage_seconds",
+                "Time taken by each stage of processing an upload",
+                ("type", "stage"),
+                self._stage_seconds,
+            )
+        return "\n".join(lines) + "\n"
+
+    def _histogram(self, histograms: dict, key) -> Histogram:
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram(self.buckets)
+        return histogram
+
+    def _render_counter(self, lines, name, help, label_names, values) -> None:
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} counter")
+        for key, value in sorted(values.items()):
+            lines.append(f"{name}{_labels(label_names, key)} {value}")
+
+    def _render_histograms(self, lines, name, help, label_names, histograms) -> None:
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} histogram")
+        for key, histogram in sorted(histograms.items()):
+            for bound, count in histogram.cumulative_counts():
+                labels = _labels(label_names + ("le",), _as_tuple(key) + (bound,))
+                lines.append(f"{name}_bucket{labels} {count}")
+            labels = _labels(label_names, key)
+            lines.append(f"{name}_sum{labels} {histogram.sum!r}")
+            lines.append(f"{name}_count{labels} {histogram.count}")
+
+
+def log_upload(upload: UploadMetrics) -> None:
+    """Logs the measurements of an upload as a JSON line, if the metrics logger
+    is enabled (see `enable_json_log`).
+    """
+    if upload.enabled and logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps(upload.log_record()))
+
+
+def enable_json_log(stream=None) -> None:
+    """Writes one JSON line per upload to `stream` (stderr by default)."""
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+def _as_tuple(key) -> tuple:
+    return key if isinstance(key, tuple) else (key,)
+
+
+def _labels(names: tuple, values) -> str:
+    pairs = (
+        '{}="{}"'.format(name, _escape(str(value)))
+        for name, value in zip(names, _as_tuple(values))
+    )
+    return "{" + ",".join(pairs) + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
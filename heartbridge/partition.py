@@ -0,0 +1,200 @@
+"""Time-partitioned output layout for CSV/JSON exports. Rather than one file per
+upload named by its date range, readings are kept in one file per record type
+and day:
+
+    heart-rate/2021/04/01.csv
+    heart-rate/2021/04/02.csv
+
+An upload is merged into the partitions it covers, with a sorted merge that
+keeps one row per timestamp, so re-sending an overlapping date range doesn't
+duplicate any rows. Every partition is recorded in the `ExportIndex` (its
+manifest) along with its time range and row count.
+"""
+
+import csv, os
+from array import array
+from pathlib import Path
+from typing import Iterator, List, Tuple, Union
+from . import codec
+from .constants import EXPORT_CLS_MAP
+from .data import ColumnarBatch
+from .exceptions import ExportError
+from .index import ExportIndex, file_lock
+from .timestamps import SECONDS_PER_DAY, epoch_to_datetime, parse_many
+
+LOCK_FILENAME = ".lock"
+
+
+class Partition(ColumnarBatch):
+    """The rows of one partition: a `timestamps` array plus one array per field
+    after it, in `field_names` order.
+    """
+
+    def __init__(
+        self,
+        field_names: List[str],
+        timestamps: array,
+        columns: List[array],
+        reading_type: str = None,
+    ):
+        self._field_names = field_names
+        self.timestamps = timestamps
+        self._columns = columns
+        self.reading_type = reading_type
+
+    @property
+    def field_names(self) -> List[str]:
+        return self._field_names
+
+    def columns(self) -> List[array]:
+        return self._columns
+
+
+def partition_name(reading_type: str, day: int, output_format: str) -> str:
+    """Path of a partition relative to the output directory, for the day
+    starting at `day` (epoch seconds), e.g. heart-rate/2021/04/01.csv
+    """
+    return "{}/{}.{}".format(
+        reading_type, epoch_to_datetime(day).strftime("%Y/%m/%d"), output_format
+    )
+
+
+def export_partitioned(
+    data: ColumnarBatch,
+    reading_type: str,
+    output_dir: Union[str, Path, None],
+    output_format: str,
+) -> str:
+    """Merges a batch of readings (or a rollup) into the daily partitions of
+    `reading_type`, returning the path of the record type's directory.
+
+    Where a timestamp is both in the batch and in a partition, the batch's row
+    replaces the stored one (like `SQLiteExporter`), and where a timestamp
+    appears more than once in the batch, the last row is kept.
+    """
+    directory = Path(output_dir or ".") / reading_type
+    try:
+        directory.mkdir(parents=True, exist_ok=True)
+    except OSError as e:
+        raise ExportError("Exception occured while creating directory: {}".format(e))
+    index = ExportIndex(output_dir)
+    with file_lock(directory / LOCK_FILENAME):
+        for day, rows in _split_days(data):
+            name = partition_name(reading_type, day, output_format)
+            path = Path(output_dir or ".") / name
+            stored = read_partition(path, data) if path.exists() else None
+            merged = _merge(stored, rows) if stored is not None else rows
+            _write_atomic(merged, path, output_format)
+            try:
+                index.add(
+                    path,
+                    reading_type,
+                    output_format,
+                    merged.timestamps[0],
+                    merged.timestamps[-1],
+                    len(merged),
+                )
+            except OSError as e:
+                raise ExportError("Could not update the export index: {}".format(e))
+    return os.path.realpath(directory)
+
+
+def read_partition(path: Path, like: ColumnarBatch) -> Partition:
+    """Reads a partition written by `export_partitioned`, with the same fields
+    and column types as `like`.
+    """
+    field_names = like.field_names
+    typecodes = [column.typecode for column in like.columns()]
+    try:
+        if path.suffix == ".csv":
+            with open(path, "r", newline="") as partition_file:
+                reader = csv.reader(partition_file)
+                header = next(reader, None)
+                rows = list(reader)
+        else:
+            with open(path, "rb") as partition_file:
+                readings = codec.loads(partition_file.read())
+            header = list(readings[0]) if readings else field_names
+            rows = [[reading[field] for field in header] for reading in readings]
+    except (OSError, ValueError, KeyError, IndexError) as e:
+        raise ExportError("Could not read the partition {}: {}".format(path, e))
+    if header is not None and header != field_names:
+        raise ExportError(
+            "The partition {} has the fields {}, not {}".format(
+                path, ", ".join(header), ", ".join(field_names)
+            )
+        )
+    timestamps = parse_many(row[0] for row in rows)
+    columns = [
+        array(typecode, (_convert(typecode, row[i + 1]) for row in rows))
+        for i, typecode in enumerate(typecodes)
+    ]
+    return Partition(field_names, timestamps, columns, like.reading_type)
+
+
+def _convert(typecode: str, value) -> Union[int, float]:
+    if typecode == "q":
+        return value if isinstance(value, int) else int(float(value))
+    return float(value)
+
+
+def _split_days(data: ColumnarBatch) -> Iterator[Tuple[int, Partition]]:
+    """Splits a batch into one sorted `Partition` per day, with one row per
+    timestamp (the last one in the batch).
+    """
+    timestamps = data.timestamps
+    columns = data.columns()
+    # Sorting by timestamp and then by position puts the row to keep last:
+    order = sorted(range(len(timestamps)), key=timestamps.__getitem__)
+    unique = [
+        position
+        for i, position in enumerate(order)
+        if i + 1 == len(order) or timestamps[order[i + 1]] != timestamps[position]
+    ]
+    start = 0
+    while start < len(unique):
+        day = timestamps[unique[start]] // SECONDS_PER_DAY * SECONDS_PER_DAY
+        end = start
+        while end < len(unique) and timestamps[unique[end]] < day + SECONDS_PER_DAY:
+            end += 1
+        positions = unique[start:end]
+        yield day, Partition(
+            data.field_names,
+            array("q", (timestamps[p] for p in positions)),
+            [array(c.typecode, (c[p] for p in positions)) for c in columns],
+            data.reading_type,
+        )
+        start = end
+
+
+def _merge(stored: Partition, new: Partition) -> Partition:
+    """Sorted merge of two partitions with one row per timestamp. Rows of `new`
+    replace rows of `stored` with the same timestamp.
+    """
+    timestamps = array("q")
+    columns = [array(column.typecode) for column in new.columns()]
+    stored_columns, new_columns = stored.columns(), new.columns()
+    i, j = 0, 0
+    while i < len(stored) or j < len(new):
+        if j == len(new) or (
+            i < len(stored) and stored.timestamps[i] < new.timestamps[j]
+        ):
+            source, position, i = stored_columns, i, i + 1
+            timestamps.append(stored.timestamps[position])
+        else:
+            if i < len(stored) and stored.timestamps[i] == new.timestamps[j]:
+                i += 1  # replaced by the new row
+            source, position, j = new_columns, j, j + 1
+            timestamps.append(new.timestamps[position])
+        for column, source_column in zip(columns, source):
+            column.append(source_column[position])
+    return Partition(new.field_names, timestamps, columns, new.reading_type)
+
+
+def _write_atomic(partition: Partition, path: Path, output_format: str) -> None:
+    """Writes a partition, replacing the file atomically (see
+    `heartbridge.export.atomic_file`) so readers never see a partly written
+    partition.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    EXPORT_CLS_MAP[output_format]().readings_to_file(partition, path)
@@ -0,0 +1,189 @@
+"""Time range queries over previously exported readings, for the `GET /readings`
+routes. CSV/JSON exports are found through the `ExportIndex` and read with an
+`ExportReader`, and the SQLite database is queried through its timestamp
+primary key, so a query only reads data for the requested window.
+"""
+
+import hashlib, heapq, os, sqlite3
+from pathlib import Path
+from typing import Iterator, Tuple, Union
+from itertools import islice
+from .aggregate import ROLLUP_TYPE
+from .constants import EXPORT_CLS_MAP, READING_MAPPING
+from .data import GenericHealthReading
+from .export import RowSchema, json_chunk_encoder, sqlite_table_name
+from .index import ExportIndex
+from .reader import ExportReader
+from .timestamps import format_timestamp, parse_timestamp
+
+
+class RangeQuery:
+    """Readings of one record type with timestamps in `[start, end)`.
+
+    Args:
+        output_dir: The directory readings were exported to
+        output_format: The format readings were exported in (a key of `EXPORT_CLS_MAP`)
+        reading_type: The record type slug, e.g. heart-rate
+        start, end: Epoch seconds bounding the window; None for an open end
+
+    Rollups (e.g. heart-rate-per-hour) have several value columns, and can't be
+    queried: they raise ValueError.
+    """
+
+    def __init__(
+        self,
+        output_dir: Union[str, Path, None],
+        output_format: str,
+        reading_type: str,
+        start: int = None,
+        end: int = None,
+    ):
+        if ROLLUP_TYPE.search(reading_type):
+            raise ValueError(
+                "{} holds rollups, which can't be queried".format(reading_type)
+            )
+        self.output_dir = output_dir
+        self.output_format = output_format
+        self.reading_type = reading_type
+        self.start = start
+        self.end = end
+        self.reading_cls = READING_MAPPING.get(reading_type, GenericHealthReading)
+        self.value_column = self.reading_cls.value_attribute
+
+    @property
+    def database_path(self) -> Path:
+        exporter = EXPORT_CLS_MAP[self.output_format]
+        return Path(self.output_dir or ".") / "{}.{}".format(
+            exporter.shared_filename, self.output_format
+        )
+
+    def etag(self) -> str:
+        """A validator that changes whenever the data in the window changes."""
+        digest = hashlib.sha1(repr((self.reading_type, self.start, self.end)).encode())
+        if self.output_format == "sqlite":
+            digest.update(repr(self._sqlite_version()).encode())
+        else:
+            for entry in ExportIndex(self.output_dir).lookup(
+                self.reading_type, self.start, self.end
+            ):
+                stat = os.stat(Path(self.output_dir or ".") / entry["file"])
+                digest.update(
+                    repr((entry["file"], stat.st_size, stat.st_mtime_ns)).encode()
+                )
+        return '"{}"'.format(digest.hexdigest())
+
+    def rows(self) -> Iterator[Tuple[int, Union[int, float]]]:
+        """Yields `(timestamp, value)` tuples in timestamp order."""
+        if self.output_format == "sqlite":
+            return self._sqlite_rows()
+        return self._indexed_rows()
+
+    def json_chunks(self, rows_per_chunk: int = 1000) -> Iterator[str]:
+        """Yields the readings as a JSON array (in the same shape as `JSONExporter`
+        output), a chunk of rows at a time.
+        """
+        encode_chunk = json_chunk_encoder(
+            RowSchema(
+                ("timestamp", self.value_column), (self.reading_cls.value_typecode,)
+            )
+        )
+        rows = (
+            (format_timestamp(timestamp), value) for timestamp, value in self.rows()
+        )
+        separator = "["
+        while True:
+            chunk = list(islice(rows, rows_per_chunk))
+            if not chunk:
+                break
+            yield separator + encode_chunk(chunk)
+            separator = ", "
+        yield "]" if separator == ", " else "[]"
+
+    def _indexed_rows(self) -> Iterator[Tuple[int, Union[int, float]]]:
+        """Merges the rows of every indexed file overlapping the window. Overlapping
+        uploads produce files with the same samples, so each timestamp is only
+        read from one file: the most recently exported one that has it.
+        """
+        entries = ExportIndex(self.output_dir).lookup(
+            self.reading_type, self.start, self.end
+        )
+        sources = [
+            self._tagged_rows(entry, source) for source, entry in enumerate(entries)
+        ]
+        current_timestamp, owner = None, None
+        for timestamp, order, value in heapq.merge(*sources):
+            if timestamp != current_timestamp:
+                current_timestamp, owner = timestamp, order
+            if order == owner:
+                yield timestamp, value
+
+    def _tagged_rows(self, entry: dict, source: int) -> Iterator[tuple]:
+        # Index entries are in export order, so later exports sort first:
+        for timestamp, value in self._file_rows(entry):
+            yield timestamp, -source, value
+
+    def _file_rows(self, entry: dict) -> Iterator[Tuple[int, Union[int, float]]]:
+        path = Path(self.output_dir or ".") / entry["file"]
+        # Exports are small enough (one per upload or day) that indexing them on
+        # every query is cheap, so no index files are left in the output directory:
+        with ExportReader(path, self.reading_type, cache_index=False) as reader:
+            yield from reader.rows(self.start, self.end)
+
+    def _sqlite_where(self) -> Tuple[str, tuple]:
+        clauses, parameters = [], []
+        if self.start is not None:
+            clauses.append("timestamp >= ?")
+            parameters.append(self.start)
+        if self.end is not None:
+            clauses.append("timestamp < ?")
+            parameters.append(self.end)
+        where = " WHERE " + " AND ".join(clauses) if clauses else ""
+        return where, tuple(parameters)
+
+    def _sqlite_execute(self, sql: str, parameters: tuple) -> Iterator[tuple]:
+        if not self.database_path.exists():
+            return
+        connection = sqlite3.connect(self.database_path, timeout=30)
+        try:
+            yield from connection.execute(sql, parameters)
+        except sqlite3.OperationalError as e:
+            if "no such table" not in str(e):
+                raise
+        finally:
+            connection.close()
+
+    def _sqlite_rows(self) -> Iterator[Tuple[int, Union[int, float]]]:
+        where, parameters = self._sqlite_where()
+        table = sqlite_table_name(self.reading_type)
+        yield from self._sqlite_execute(
+            f'SELECT timestamp, "{self.value_column}" FROM "{table}"{where} '
+            "ORDER BY timestamp",
+            parameters,
+        )
+
+    def _sqlite_version(self) -> list:
+        """The size and modification time of the database and its write-ahead
+        log, which change with every write committed to the database.
+        """
+        version = []
+        for path in (self.database_path, Path(f"{self.database_path}-wal")):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            version.append((path.name, stat.st_size, stat.st_mtime_ns))
+        return version
+
+
+def parse_time_bound(value: str) -> Union[int, None]:
+    """Parses a `start`/`end` query parameter into epoch seconds. Accepts a date
+    (2021-04-01), a Shortcuts style timestamp (2021-04-01 08:00:00, or with a
+    T separator) or epoch seconds. Raises ValueError for anything else.
+    """
+    if value is None or value == "":
+        return None
+    if value.lstrip("-").isdigit():
+        return int(value)
+    if len(value) == 10:
+        value += " 00:00:00"
+    return parse_timestamp(value.replace("T", " ", 1))
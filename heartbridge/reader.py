@@ -0,0 +1,451 @@
+"""Reading of previously exported CSV/JSON files, for analysis. Rather than
+loading a whole export, the file is memory-mapped and indexed by timestamp:
+the offset of every row is recorded in timestamp order, so a time window is
+found with a binary search and only the rows inside it are parsed.
+
+Building the index takes one scan of the file (vectorized with NumPy when it's
+installed), without parsing any values. The index is saved next to the export
+as a hidden `.<name>.idx` file, so the next reader of an unchanged export
+doesn't scan it at all.
+"""
+
+import mmap, os
+from array import array
+from bisect import bisect_left
+from itertools import chain
+from pathlib import Path
+from typing import Callable, Iterator, List, NamedTuple, Optional, Tuple, Union
+from . import codec
+from .aggregate import REDUCERS, RollupBatch, reducer_typecode
+from .constants import LEGACY_RECORD_TYPE, READING_MAPPING
+from .data import (
+    BaseHealthReading,
+    ColumnarBatch,
+    GenericHealthReading,
+    ReadingBatch,
+    numpy,
+)
+from .exceptions import LoadingError
+from .export import atomic_file
+from .timestamps import parse_many
+
+READABLE_FORMATS = ("csv", "json")
+# Every object written by `JSONExporter` starts with this:
+JSON_RECORD_START = b'{"timestamp": "'
+TIMESTAMP_LENGTH = 19
+INDEX_VERSION = 1
+# Bytes searched, and timestamps parsed, at a time when building the index
+# with NumPy (bounding the memory used by temporary arrays):
+SCAN_BYTES = 64 * 1024 * 1024
+SCAN_ROWS = 256 * 1024
+# Rows parsed at a time when yielding rows lazily:
+CHUNK_SIZE = 10000
+
+
+class TimestampIndex(NamedTuple):
+    """The timestamp (epoch seconds) and byte offset of every row of an export,
+    sorted by timestamp. `ordered` is True when the rows are stored in that
+    order too, so a window is one contiguous range of bytes.
+    """
+
+    timestamps: array
+    offsets: array
+    ordered: bool
+
+
+class ExportReader:
+    """Reads a file written by `CSVExporter` or `JSONExporter`, or a partition
+    (see `heartbridge.partition`), including rollups.
+
+    Per-sample exports are read as `ReadingBatch` columns (or reading objects)
+    of the `READING_MAPPING` class with the file's value field, e.g. a
+    `heart_rate` column is read with `HeartRateReading`. Rollups are read as
+    `RollupBatch` columns.
+
+    Args:
+        path: The exported file
+        reading_type: The record type slug of the readings (e.g. heart-rate).
+            Defaults to the type of the file's reading class.
+        cache_index: Whether the timestamp index is loaded from, and saved to,
+            a `.<name>.idx` file next to the export
+
+    Readers hold the file open, so use them as context managers (or `close`
+    them).
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        reading_type: str = None,
+        cache_index: bool = True,
+    ):
+        self.path = Path(path)
+        self.format = self.path.suffix.lstrip(".").lower()
+        if self.format not in READABLE_FORMATS:
+            raise LoadingError(
+                "Only CSV and JSON exports can be read, not {}".format(self.path)
+            )
+        self._file = open(self.path, "rb")
+        try:
+            stat = os.fstat(self._file.fileno())
+            # Empty files can't be memory-mapped:
+            self._data = (
+                mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+                if stat.st_size
+                else b""
+            )
+            self.field_names = self._read_field_names()
+            self._set_reading_types(reading_type)
+            self.index = self._load_index(stat) if cache_index else None
+            if self.index is None:
+                self.index = self._build_index()
+                if cache_index:
+                    self._save_index(stat)
+        except BaseException:
+            self.close()
+            raise
+
+    def __enter__(self) -> "ExportReader":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.index.timestamps)
+
+    def close(self) -> None:
+        if isinstance(getattr(self, "_data", None), mmap.mmap):
+            try:
+                self._data.close()
+            except BufferError:
+                pass  # Still used by NumPy arrays; it's unmapped once they're freed
+        self._file.close()
+
+    @property
+    def index_path(self) -> Path:
+        return self.path.with_name("." + self.path.name + ".idx")
+
+    @property
+    def start(self) -> Optional[int]:
+        """The earliest timestamp in the file, or None if it's empty."""
+        return self.index.timestamps[0] if len(self) else None
+
+    @property
+    def end(self) -> Optional[int]:
+        """The latest timestamp in the file, or None if it's empty."""
+        return self.index.timestamps[-1] if len(self) else None
+
+    def window(self, start: int = None, end: int = None) -> ColumnarBatch:
+        """The rows with timestamps in `[start, end)` (epoch seconds; either may
+        be None for an open end) as columns, sorted by timestamp.
+        """
+        first, last = self._bounds(start, end)
+        return self._batch(first, last)
+
+    def batches(
+        self, start: int = None, end: int = None, chunk_size: int = CHUNK_SIZE
+    ) -> Iterator[ColumnarBatch]:
+        """Like `window`, a batch of at most `chunk_size` rows at a time."""
+        first, last = self._bounds(start, end)
+        for position in range(first, last, chunk_size):
+            yield self._batch(position, min(position + chunk_size, last))
+
+    def rows(self, start: int = None, end: int = None) -> Iterator[tuple]:
+        """Lazily yields the rows in `[start, end)` in timestamp order, as tuples
+        of the timestamp (epoch seconds) and the value(s).
+        """
+        for batch in self.batches(start, end):
+            yield from zip(batch.timestamps, *batch.columns())
+
+    def readings(
+        self, start: int = None, end: int = None
+    ) -> Iterator[BaseHealthReading]:
+        """Lazily yields the readings in `[start, end)` in timestamp order, as
+        instances of `reading_cls`. Rollups have no reading objects; use
+        `window`, `batches` or `rows` for those.
+        """
+        if self.reducers:
+            raise LoadingError(
+                "{} holds a rollup, which can't be read as readings".format(self.path)
+            )
+        for batch in self.batches(start, end):
+            yield from batch
+
+    def _bounds(self, start: Optional[int], end: Optional[int]) -> Tuple[int, int]:
+        timestamps = self.index.timestamps
+        first = 0 if start is None else bisect_left(timestamps, start)
+        last = len(timestamps) if end is None else bisect_left(timestamps, end)
+        return first, max(first, last)
+
+    def _set_reading_types(self, reading_type: Optional[str]) -> None:
+        """Works out the reading class, reducers (for rollups) and column typecodes
+        from the field names.
+        """
+        value_fields = self.field_names[1:]
+        value_attributes = {GenericHealthReading.value_attribute} | {
+            reading_cls.value_attribute for reading_cls in READING_MAPPING.values()
+        }
+        self.reducers = []
+        if len(value_fields) == 1 and value_fields[0] in value_attributes:
+            value_attribute = value_fields[0]
+        else:
+            # A rollup, with fields like heart_rate_mean:
+            split = [field.rsplit("_", 1) for field in value_fields]
+            attributes = {pair[0] for pair in split}
+            if (
+                self.field_names[0] != "timestamp"
+                or len(attributes) != 1
+                or not all(len(pair) == 2 and pair[1] in REDUCERS for pair in split)
+            ):
+                raise LoadingError(
+                    "{} doesn't look like a heartbridge export (fields: {})".format(
+                        self.path, ", ".join(self.field_names)
+                    )
+                )
+            value_attribute = attributes.pop()
+            self.reducers = [reducer for _, reducer in split]
+        self.reading_cls = next(
+            (
+                reading_cls
+                for reading_cls in READING_MAPPING.values()
+                if reading_cls.value_attribute == value_attribute
+            ),
+            GenericHealthReading,
+        )
+        self.value_attribute = value_attribute
+        self.reading_type = reading_type or next(
+            (
+                slug
+                for slug, reading_cls in READING_MAPPING.items()
+                if reading_cls is self.reading_cls and slug != LEGACY_RECORD_TYPE
+            ),
+            None,
+        )
+        value_typecode = self.reading_cls.value_typecode
+        self.typecodes = [
+            reducer_typecode(reducer, value_typecode) for reducer in self.reducers
+        ] or [value_typecode]
+
+    def _read_field_names(self) -> List[str]:
+        data = self._data
+        if self.format == "csv":
+            header_end = data.find(b"\n")
+            if header_end == -1:
+                header_end = len(data)
+            header = bytes(data[:header_end]).decode().rstrip("\r")
+            if not header:
+                raise LoadingError("{} is empty".format(self.path))
+            return header.split(",")
+        first = data.find(JSON_RECORD_START)
+        if first == -1:
+            if bytes(data).strip() != b"[]":
+                raise LoadingError("{} is not a JSON export".format(self.path))
+            return ["timestamp", GenericHealthReading.value_attribute]
+        try:
+            return list(codec.loads(data[first : data.find(b"}", first) + 1]))
+        except ValueError as e:
+            raise LoadingError("Could not read {}: {}".format(self.path, e))
+
+    def _build_index(self) -> TimestampIndex:
+        """Scans the file for the offset and timestamp of every row."""
+        if numpy is not None:
+            offsets, timestamps = self._scan_numpy()
+            ordered = bool((timestamps[1:] >= timestamps[:-1]).all())
+            if not ordered:
+                order = numpy.argsort(timestamps, kind="stable")
+                offsets, timestamps = offsets[order], timestamps[order]
+            return TimestampIndex(_to_array(timestamps), _to_array(offsets), ordered)
+        offsets, timestamps = self._scan()
+        ordered = all(map(int.__le__, timestamps, timestamps[1:]))
+        if not ordered:
+            order = sorted(range(len(timestamps)), key=timestamps.__getitem__)
+            timestamps = array("q", (timestamps[i] for i in order))
+            offsets = array("q", (offsets[i] for i in order))
+        return TimestampIndex(timestamps, offsets, ordered)
+
+    def _timestamp_offset(self) -> int:
+        """How far the timestamp is from the start of each row."""
+        return len(JSON_RECORD_START) if self.format == "json" else 0
+
+    def _scan(self) -> Tuple[array, array]:
+        data, offsets = self._data, array("q")
+        if self.format == "csv":
+            position = data.find(b"\n") + 1
+            while 0 < position < len(data):
+                offsets.append(position)
+                position = data.find(b"\n", position) + 1
+        else:
+            position = data.find(JSON_RECORD_START)
+            while position != -1:
+                offsets.append(position)
+                position = data.find(JSON_RECORD_START, position + 1)
+        skip = self._timestamp_offset()
+        try:
+            timestamps = parse_many(
+                data[offset + skip : offset + skip + TIMESTAMP_LENGTH].decode()
+                for offset in offsets
+            )
+        except ValueError as e:
+            raise LoadingError("Could not read {}: {}".format(self.path, e))
+        return offsets, timestamps
+
+    def _scan_numpy(self):
+        """Like `_scan`, returning NumPy arrays."""
+        data = numpy.frombuffer(self._data, dtype=numpy.uint8)
+        # JSON exports only contain braces around rows, since values are numbers:
+        marker = ord("\n") if self.format == "csv" else JSON_RECORD_START[0]
+        starts = [numpy.empty(0, dtype=numpy.int64)]
+        for block in range(0, len(data), SCAN_BYTES):
+            found = numpy.flatnonzero(data[block : block + SCAN_BYTES] == marker)
+            starts.append(found + block)
+        starts = numpy.concatenate(starts)
+        if self.format == "csv":
+            # Rows start after every line break, except the one ending the file:
+            starts = starts + 1
+            starts = starts[starts < len(data)]
+        timestamps = [numpy.empty(0, dtype=numpy.int64)] + [
+            self._parse_numpy(data, starts[block : block + SCAN_ROWS])
+            for block in range(0, len(starts), SCAN_ROWS)
+        ]
+        return starts, numpy.concatenate(timestamps)
+
+    def _parse_numpy(self, data, starts):
+        """Parses the timestamps of the rows starting at `starts` with NumPy's
+        datetime parser, which accepts the `YYYY-MM-DD HH:MM:SS` layout.
+        """
+        positions = starts[:, None] + (
+            self._timestamp_offset() + numpy.arange(TIMESTAMP_LENGTH)
+        )
+        if len(starts) and positions[-1, -1] >= len(data):
+            raise LoadingError("{} is truncated".format(self.path))
+        strings = data[positions].view("S{}".format(TIMESTAMP_LENGTH))[:, 0]
+        try:
+            return strings.astype("datetime64[s]").astype(numpy.int64)
+        except ValueError as e:
+            raise LoadingError("Could not read {}: {}".format(self.path, e))
+
+    def _load_index(self, stat: os.stat_result) -> Optional[TimestampIndex]:
+        """The saved index, if it was built for this version of the export."""
+        saved = array("q")
+        try:
+            saved.frombytes(self.index_path.read_bytes())
+        except (OSError, ValueError):
+            return None
+        header = [INDEX_VERSION, stat.st_size, stat.st_mtime_ns, stat.st_ino]
+        if len(saved) < 6 or list(saved[:4]) != header:
+            return None
+        count, ordered = saved[4], saved[5]
+        if len(saved) != 6 + 2 * count:
+            return None
+        return TimestampIndex(saved[6 : 6 + count], saved[6 + count :], bool(ordered))
+
+    def _save_index(self, stat: os.stat_result) -> None:
+        header = array(
+            "q",
+            [
+                INDEX_VERSION,
+                stat.st_size,
+                stat.st_mtime_ns,
+                stat.st_ino,
+                len(self.index.timestamps),
+                self.index.ordered,
+            ],
+        )
+        try:
+            with atomic_file(self.index_path, "wb") as index_file:
+                for part in (header, self.index.timestamps, self.index.offsets):
+                    index_file.write(part.tobytes())
+        except OSError:
+            pass  # e.g. a read-only directory: the index is rebuilt next time
+
+    def _batch(self, first: int, last: int) -> ColumnarBatch:
+        timestamps = self.index.timestamps[first:last]
+        columns = self._columns(first, last)
+        if not self.reducers:
+            return ReadingBatch(
+                self.reading_cls, timestamps, columns[0], reading_type=self.reading_type
+            )
+        return RollupBatch(
+            self.reading_type,
+            self.value_attribute,
+            None,
+            timestamps,
+            dict(zip(self.reducers, columns)),
+        )
+
+    def _columns(self, first: int, last: int) -> List[array]:
+        """Parses the values of the rows between two positions of the index."""
+        if first == last:
+            return [array(typecode) for typecode in self.typecodes]
+        data, offsets = self._data, self.index.offsets
+        if self.index.ordered:
+            # The rows are stored back to back:
+            end = offsets[last] if last < len(offsets) else len(data)
+            records = [data[offsets[first] : end]]
+        else:
+            records = (
+                data[offset : self._record_end(offset)]
+                for offset in offsets[first:last]
+            )
+        if self.format == "csv":
+            # Values follow the timestamp and a comma:
+            lines = chain.from_iterable(
+                bytes(record).decode().splitlines() for record in records
+            )
+            values = [line[TIMESTAMP_LENGTH + 1 :].split(",") for line in lines]
+            converters = [_csv_converter(typecode) for typecode in self.typecodes]
+        else:
+            records = b", ".join(bytes(record).rstrip(b", ]\r\n") for record in records)
+            try:
+                objects = codec.loads(b"[" + records + b"]")
+            except ValueError as e:
+                raise LoadingError("Could not read {}: {}".format(self.path, e))
+            names = self.field_names[1:]
+            values = [[row[name] for name in names] for row in objects]
+            converters = [_json_converter(typecode) for typecode in self.typecodes]
+        if len(values) != last - first:
+            raise LoadingError("{} changed while it was read".format(self.path))
+        try:
+            return [
+                array(typecode, map(convert, column))
+                for typecode, convert, column in zip(
+                    self.typecodes, converters, zip(*values)
+                )
+            ]
+        except (TypeError, ValueError) as e:
+            raise LoadingError("Could not read {}: {}".format(self.path, e))
+
+    def _record_end(self, offset: int) -> int:
+        if self.format == "csv":
+            end = self._data.find(b"\n", offset)
+        else:
+            end = self._data.find(b"}", offset) + 1
+        return len(self._data) if end <= 0 else end
+
+
+def read_export(
+    path: Union[str, Path], start: int = None, end: int = None, **options
+) -> ColumnarBatch:
+    """Reads the rows of an export in `[start, end)` (see `ExportReader.window`).
+    `options` are passed on to `ExportReader`.
+    """
+    with ExportReader(path, **options) as reader:
+        return reader.window(start, end)
+
+
+def _csv_converter(typecode: str) -> Callable:
+    return int if typecode == "q" else float
+
+
+def _json_converter(typecode: str) -> Callable:
+    if typecode == "q":
+        return int
+    # NaN and infinities are exported as null:
+    return lambda value: float("nan") if value is None else float(value)
+
+
+def _to_array(values) -> array:
+    converted = array("q")
+    converted.frombytes(values.astype(numpy.int64).tobytes())
+    return converted
@@ -0,0 +1,391 @@
+"""Resumable upload sessions, for date ranges too large to send in one request.
+A client opens a session for a record type, sends the samples in numbered
+chunks, then commits the session to export them:
+
+    POST /uploads                       {"type": "Heart Rate", "chunks": 3}
+    POST /uploads/<id>/chunks/0         {"dates": [...], "values": [...]}
+    POST /uploads/<id>/chunks/1         ...
+    POST /uploads/<id>/commit
+
+Each chunk is validated, parsed and sorted as it arrives, and its columns are
+saved to the session's directory, so only one chunk is ever held as JSON. A
+chunk that was already received is skipped, so an interrupted transfer is
+resumed by sending the chunks that are missing (`GET /uploads/<id>` lists
+them). A commit only has to merge the saved chunks in timestamp order, which
+it does a batch at a time (see `UploadSessions.batches`), writing the export
+as they go past: memory use doesn't grow with the size of the session.
+
+The commit exports the session like a single upload, e.g. as one file named by
+the whole date range, with rollup buckets spanning chunks. Retransmitted
+chunks are skipped by their digest, rather than by `--dedup`.
+
+Sessions are kept in `SESSION_DIRECTORY` in the output directory, and may be
+shared by several server processes. Sessions that haven't been used for
+`SESSION_TTL` seconds are removed.
+"""
+
+import hashlib, heapq, json, os, re, shutil, time, uuid
+from array import array
+from datetime import datetime
+from itertools import groupby
+from operator import itemgetter
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple, Union
+from .constants import READING_MAPPING
+from .data import GenericHealthReading, ReadingBatch
+from .exceptions import LoadingError, UploadSessionError
+from .export import atomic_file
+from .index import file_lock
+
+SESSION_DIRECTORY = ".heartbridge-uploads"
+SESSION_TTL = 24 * 60 * 60
+# Chunk numbers must be below this:
+MAX_CHUNKS = 100000
+# Readings merged into each batch on commit, and read from the chunks being
+# merged at once (split between them):
+BATCH_SIZE = 65536
+MERGE_BUFFER = 1 << 20
+
+OPEN = "open"
+COMMITTING = "committing"
+COMMITTED = "committed"
+
+_SESSION_ID = re.compile(r"^[0-9a-f]{32}$")
+STATE_FILENAME = "session.json"
+LOCK_FILENAME = ".lock"
+
+
+class UploadSessions:
+    """Stores upload sessions in `directory`: one directory per session, with
+    a `session.json` state file and a `<number>.chunk` file per chunk (the
+    chunk's sorted timestamps followed by its values, as machine arrays).
+    """
+
+    def __init__(self, directory: Union[str, Path]):
+        self.directory = Path(directory)
+
+    def open(self, reading_type: str, chunks: int = None) -> dict:
+        """Opens a session for readings of `reading_type` (as sent by
+        Shortcuts, e.g. "Heart Rate"), optionally sent in `chunks` chunks.
+        Returns the new session's state.
+        """
+        if not isinstance(reading_type, str) or not reading_type:
+            raise LoadingError("An upload session needs the type of health record")
+        check_chunk_count(chunks)
+        self.expire()
+        session_id = uuid.uuid4().hex
+        self._path(session_id).mkdir(parents=True)
+        state = {
+            "id": session_id,
+            "type": reading_type,
+            "status": OPEN,
+            "opened": datetime.now().isoformat(timespec="seconds"),
+            "expected_chunks": chunks,
+            "samples": 0,
+            "chunks": {},
+        }
+        self._write_state(session_id, state)
+        return state
+
+    def state(self, session_id: str) -> Optional[dict]:
+        """The state of a session, or None if there is no such session."""
+        if not _SESSION_ID.match(session_id):
+            return None
+        try:
+            with open(self._path(session_id) / STATE_FILENAME, "r") as state_file:
+                return json.load(state_file)
+        except FileNotFoundError:
+            return None
+
+    def has_chunk(self, session_id: str, number: int, body: bytes) -> bool:
+        """Whether chunk `number` was already received with this `body`. A
+        different body for a chunk that was received raises
+        `UploadSessionError`, as does a session that isn't open anymore.
+        """
+        state = self._open_state(session_id)
+        received = state["chunks"].get(str(number))
+        if received is None:
+            return False
+        if received["digest"] != chunk_digest(body):
+            raise UploadSessionError(
+                "Chunk {} was already received with different data".format(number)
+            )
+        return True
+
+    def add_chunk(
+        self, session_id: str, number: int, body: bytes, readings: ReadingBatch
+    ) -> Tuple[dict, bool]:
+        """Saves the readings parsed from chunk `number` (sent as `body`),
+        returning the session's state and whether the chunk had already been
+        received (in which case it isn't saved again). Readings are saved in
+        timestamp order, keeping the last of any with the same timestamp.
+        """
+        if not 0 <= number < MAX_CHUNKS:
+            raise UploadSessionError(
+                "Chunk numbers must be from 0 to {}".format(MAX_CHUNKS - 1)
+            )
+        path = self._path(session_id) / "{}.chunk".format(number)
+        readings = readings.sorted(unique=True)
+        # Written before it's recorded, so a recorded chunk is always complete:
+        if not self.has_chunk(session_id, number, body):
+            with atomic_file(path, "wb") as chunk_file:
+                readings.timestamps.tofile(chunk_file)
+                readings.values.tofile(chunk_file)
+        with self._lock(session_id):
+            if self.has_chunk(session_id, number, body):
+                return self.state(session_id), True
+            state = self.state(session_id)
+            state["chunks"][str(number)] = {
+                "samples": len(readings),
+                "digest": chunk_digest(body),
+                "start": readings.timestamps[0] if len(readings) else None,
+                "end": readings.timestamps[-1] if len(readings) else None,
+            }
+            state["samples"] += len(readings)
+            self._write_state(session_id, state)
+        return state, False
+
+    def begin_commit(self, session_id: str, chunks: int = None) -> dict:
+        """Marks a session as being committed, once every chunk was received
+        (chunks 0 to `chunks` - 1, or to the number of chunks given when the
+        session was opened, or to the highest chunk number received). Chunks
+        can't be added afterwards. Raises `UploadSessionError` listing the
+        chunks that are missing, if any, or if `chunks` isn't the number given
+        when the session was opened.
+        """
+        check_chunk_count(chunks)
+        with self._lock(session_id):
+            state = self._open_state(session_id)
+            expected = state.get("expected_chunks")
+            if chunks is not None and expected is not None and chunks != expected:
+                raise UploadSessionError(
+                    "The session was opened for {} chunks, not {}".format(
+                        expected, chunks
+                    )
+                )
+            missing = missing_chunks(state, chunks)
+            if missing:
+                raise UploadSessionError(
+                    "{} of the chunks haven't been received yet".format(len(missing)),
+                    missing=missing[:100],
+                )
+            if not state["samples"]:
+                raise UploadSessionError("No samples have been received")
+            state["status"] = COMMITTING
+            self._write_state(session_id, state)
+        return state
+
+    def time_range(self, session_id: str) -> Tuple[int, int]:
+        """The first and last timestamps of the readings of a session. Raises
+        `LoadingError` if it has none.
+        """
+        chunks = [
+            chunk
+            for chunk in self.state(session_id)["chunks"].values()
+            if chunk["samples"]
+        ]
+        if not chunks:
+            raise LoadingError("There are no readings to export")
+        return (
+            min(chunk["start"] for chunk in chunks),
+            max(chunk["end"] for chunk in chunks),
+        )
+
+    def batches(
+        self, session_id: str, size: int = BATCH_SIZE
+    ) -> Iterator[ReadingBatch]:
+        """The readings of every chunk of a session in timestamp order (chunks
+        may cover their date ranges in any order), as batches of at most `size`
+        readings. Where several chunks have a sample at the same timestamp, the
+        one in the highest-numbered chunk is kept.
+
+        Chunks are saved sorted, so they're merged as they're read: a chunk
+        overlapping no other is read a batch at a time, and overlapping chunks
+        with a k-way merge reading `MERGE_BUFFER` readings from them at a time.
+        """
+        state = self.state(session_id)
+        reading_type = session_reading_type(state)
+        reading_cls = READING_MAPPING.get(reading_type, GenericHealthReading)
+        chunks = sorted(
+            (chunk["start"], chunk["end"], int(number), chunk["samples"])
+            for number, chunk in state["chunks"].items()
+            if chunk["samples"]
+        )
+        # Merge each run of chunks whose time ranges overlap:
+        group, group_end = [], None
+        for chunk in chunks + [None]:
+            if chunk is not None and group and chunk[0] <= group_end:
+                group.append(chunk)
+                group_end = max(group_end, chunk[1])
+                continue
+            if group:
+                rows = self._merged_rows(session_id, group, reading_cls, size)
+                for timestamps, values in rows:
+                    yield ReadingBatch(
+                        reading_cls, timestamps, values, reading_type=reading_type
+                    )
+            if chunk is not None:
+                group, group_end = [chunk], chunk[1]
+
+    def finish(self, session_id: str, **result) -> dict:
+        """Records the result of a session's export. Once the session is
+        committed its chunks are removed; otherwise (e.g. the export failed)
+        the session is open again, so the commit can be retried.
+        """
+        with self._lock(session_id):
+            state = self.state(session_id)
+            state.update(result)
+            if state["status"] == COMMITTED:
+                for path in self._path(session_id).glob("*.chunk"):
+                    os.remove(path)
+            else:
+                state["status"] = OPEN
+            self._write_state(session_id, state)
+        return state
+
+    def remove(self, session_id: str) -> bool:
+        """Removes a session and its chunks, returning whether it existed."""
+        if self.state(session_id) is None:
+            return False
+        shutil.rmtree(self._path(session_id), ignore_errors=True)
+        return True
+
+    def expire(self, now: float = None) -> List[str]:
+        """Removes the sessions that haven't been used for `SESSION_TTL`
+        seconds, returning their ids.
+        """
+        now = time.time() if now is None else now
+        expired = []
+        if not self.directory.is_dir():
+            return expired
+        for path in self.directory.iterdir():
+            try:
+                used = (path / STATE_FILENAME).stat().st_mtime
+            except OSError:
+                continue
+            if now - used > SESSION_TTL and self.remove(path.name):
+                expired.append(path.name)
+        return expired
+
+    def _open_state(self, session_id: str) -> dict:
+        state = self.state(session_id)
+        if state is None:
+            raise UploadSessionError("No such upload session")
+        if state["status"] != OPEN:
+            raise UploadSessionError(
+                "The upload session is {} already".format(state["status"])
+            )
+        return state
+
+    def _path(self, session_id: str) -> Path:
+        return self.directory / session_id
+
+    def _merged_rows(
+        self, session_id: str, group: List[tuple], reading_cls: type, size: int
+    ) -> Iterator[Tuple[array, array]]:
+        """Timestamp and value columns of at most `size` readings at a time,
+        merged from the `(start, end, number, samples)` chunks of `group`.
+        """
+        typecode = reading_cls.value_typecode
+        if len(group) == 1:
+            _, _, number, samples = group[0]
+            yield from self._read_chunk(session_id, number, samples, typecode, size)
+            return
+        block = max(256, MERGE_BUFFER // len(group))
+        # Sorted by timestamp, then from the highest-numbered chunk down:
+        merged = heapq.merge(
+            *(
+                self._tagged_rows(session_id, number, samples, typecode, block)
+                for _, _, number, samples in group
+            )
+        )
+        timestamps, values = array("q"), array(typecode)
+        for timestamp, rows in groupby(merged, key=itemgetter(0)):
+            timestamps.append(timestamp)
+            values.append(next(rows)[2])
+            if len(timestamps) == size:
+                yield timestamps, values
+                timestamps, values = array("q"), array(typecode)
+        if timestamps:
+            yield timestamps, values
+
+    def _tagged_rows(
+        self, session_id: str, number: int, samples: int, typecode: str, size: int
+    ) -> Iterator[tuple]:
+        """`(timestamp, -number, value)` rows of a chunk."""
+        for timestamps, values in self._read_chunk(
+            session_id, number, samples, typecode, size
+        ):
+            for timestamp, value in zip(timestamps, values):
+                yield timestamp, -number, value
+
+    def _read_chunk(
+        self, session_id: str, number: int, samples: int, typecode: str, size: int
+    ) -> Iterator[Tuple[array, array]]:
+        """The columns of a chunk, `size` readings at a time. The file is only
+        open while a block is read, so merging many chunks doesn't hold many
+        files open.
+        """
+        path = self._path(session_id) / "{}.chunk".format(number)
+        values_offset = samples * array("q").itemsize
+        itemsize = array(typecode).itemsize
+        for start in range(0, samples, size):
+            count = min(size, samples - start)
+            timestamps, values = array("q"), array(typecode)
+            with open(path, "rb") as chunk_file:
+                chunk_file.seek(start * timestamps.itemsize)
+                timestamps.fromfile(chunk_file, count)
+                chunk_file.seek(values_offset + start * itemsize)
+                values.fromfile(chunk_file, count)
+            yield timestamps, values
+
+    def _lock(self, session_id: str):
+        return file_lock(self._path(session_id) / LOCK_FILENAME)
+
+    def _write_state(self, session_id: str, state: dict) -> None:
+        with atomic_file(self._path(session_id) / STATE_FILENAME, "w") as f:
+            json.dump(state, f)
+
+
+def session_reading_type(state: dict) -> str:
+    """The record type of a session's readings, e.g. heart-rate."""
+    return state["type"].lower().replace(" ", "-")
+
+
+def check_chunk_count(chunks) -> None:
+    """Raises `LoadingError` unless `chunks` (a number of chunks sent by a
+    client) is None or a number from 1 to `MAX_CHUNKS`.
+    """
+    if chunks is not None and (
+        not isinstance(chunks, int)
+        or isinstance(chunks, bool)
+        or not 0 < chunks <= MAX_CHUNKS
+    ):
+        raise LoadingError("chunks must be a number from 1 to {}".format(MAX_CHUNKS))
+
+
+def chunk_digest(body: bytes) -> str:
+    return hashlib.sha256(body).hexdigest()
+
+
+def missing_chunks(state: dict, chunks: int = None) -> List[int]:
+    """Numbers of the chunks of a session that haven't been received, out of
+    `chunks` (or the number of chunks given when the session was opened, or
+    the highest chunk number received).
+    """
+    received = {int(number) for number in state["chunks"]}
+    if chunks is None:
+        chunks = state.get("expected_chunks")
+    if chunks is None:
+        chunks = max(received) + 1 if received else 0
+    return [number for number in range(chunks) if number not in received]
+
+
+def session_status(state: dict) -> dict:
+    """The state of a session as reported to clients: without chunk digests,
+    and with the chunks that are still missing.
+    """
+    status = {key: value for key, value in state.items() if key != "chunks"}
+    status["received_chunks"] = sorted(int(number) for number in state["chunks"])
+    status["missing_chunks"] = missing_chunks(state)[:100]
+    return status
@@ -0,0 +1,128 @@
+"""Durable on-disk spool for request bodies that are accepted straight away
+and processed in the background. Every job is a raw body file plus a small
+JSON status file, both written atomically and fsync'd, so jobs survive a
+restart and can be replayed on startup. Several server processes may share a
+spool: each unfinished job is replayed by whichever claims it first.
+"""
+
+import json, os, re, uuid
+from datetime import datetime
+from pathlib import Path
+from typing import List, Union
+from .index import file_lock
+
+QUEUED = "queued"
+PARSING = "parsing"
+EXPORTING = "exporting"
+DONE = "done"
+FAILED = "failed"
+
+# Jobs in any of these states haven't finished and are replayed on startup:
+PENDING_STATES = (QUEUED, PARSING, EXPORTING)
+
+_JOB_ID = re.compile(r"^[0-9a-f]{32}$")
+LOCK_FILENAME = ".lock"
+
+
+class Spool:
+    """Stores spooled request bodies and their job status in `directory`.
+
+    `run` identifies this run of heartbridge, and is shared by all of its
+    server processes: jobs are recorded with the run that submitted or
+    claimed them (see `claim`).
+    """
+
+    def __init__(self, directory: Union[str, Path], run: str = None):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.run = run or uuid.uuid4().hex
+
+    def submit(self, body: bytes) -> str:
+        """Durably stores a request body as a new queued job, returning its id."""
+        job_id = uuid.uuid4().hex
+        self._write_atomic(self.body_path(job_id), body)
+        self._write_status(
+            job_id,
+            {
+                "id": job_id,
+                "status": QUEUED,
+                "submitted": datetime.now().isoformat(timespec="seconds"),
+                "bytes": len(body),
+                "run": self.run,
+            },
+        )
+        return job_id
+
+    def body_path(self, job_id: str) -> Path:
+        return self.directory / f"{job_id}.body"
+
+    def status(self, job_id: str) -> Union[dict, None]:
+        """Returns the status of a job, or None if there is no such job."""
+        if not _JOB_ID.match(job_id):
+            return None
+        try:
+            with open(self._status_path(job_id), "r") as status_file:
+                return json.load(status_file)
+        except FileNotFoundError:
+            return None
+
+    def update(self, job_id: str, **fields) -> dict:
+        """Updates the status of a job. Once a job is done its body is removed,
+        since it has been exported. Bodies of failed jobs are kept.
+        """
+        status = self.status(job_id) or {"id": job_id}
+        status.update(fields)
+        self._write_status(job_id, status)
+        if status["status"] == DONE:
+            try:
+                os.remove(self.body_path(job_id))
+            except FileNotFoundError:
+                pass
+        return status
+
+    def pending(self) -> List[str]:
+        """Ids of jobs that haven't finished, oldest first."""
+        jobs = []
+        for path in self.directory.glob("*.json"):
+            status = self.status(path.stem)
+            body_path = self.body_path(path.stem)
+            if status and status["status"] in PENDING_STATES and body_path.exists():
+                jobs.append((body_path.stat().st_mtime_ns, path.stem))
+        return [job_id for _, job_id in sorted(jobs)]
+
+    def claim(self, job_id: str) -> bool:
+        """Claims an unfinished job from a previous run, returning whether this
+        process should replay it. Jobs submitted or already claimed in this run
+        belong to the process that did so.
+        """
+        with file_lock(self.directory / LOCK_FILENAME):
+            status = self.status(job_id)
+            if (
+                status is None
+                or status["status"] not in PENDING_STATES
+                or status.get("run") == self.run
+            ):
+                return False
+            self.update(job_id, run=self.run)
+            return True
+
+    def _status_path(self, job_id: str) -> Path:
+        return self.directory / f"{job_id}.json"
+
+    def _write_status(self, job_id: str, status: dict) -> None:
+        self._write_atomic(self._status_path(job_id), json.dumps(status).encode())
+
+    def _write_atomic(self, path: Path, content: bytes) -> None:
+        temp_path = path.with_name(path.name + ".tmp")
+        with open(temp_path, "wb") as spool_file:
+            spool_file.write(content)
+            spool_file.flush()
+            os.fsync(spool_file.fileno())
+        os.replace(temp_path, path)
+        # Make the rename itself durable:
+        if hasattr(os, "O_DIRECTORY"):
+            directory = os.open(self.directory, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(directory)
+            finally:
+                os.close(directory)
@@ -0,0 +1,313 @@
+"""Summary statistics of uploads, computed while they're loaded so analysis jobs
+don't need to read exports back. Every estimator is streaming and mergeable:
+values are added a chunk at a time, and the summaries of two chunks (or two
+uploads) can be combined without their values.
+
+* `RunningStats`: count, min, max, mean and variance (Welford's algorithm)
+* `QuantileSketch`: quantiles to within a relative error (a DDSketch)
+* `find_gaps`: periods longer than a threshold without any sample
+
+`Summarizer` combines them into the summary of an upload, which `summarize`
+returns for one batch of readings.
+"""
+
+import math
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+from .data import ReadingBatch, numpy
+from .timestamps import format_timestamp
+
+# Values added at a time when NumPy is used:
+CHUNK_SIZE = 65536
+QUANTILES = {"p50": 0.5, "p95": 0.95, "p99": 0.99}
+DEFAULT_GAP_THRESHOLD = 3600
+MAX_REPORTED_GAPS = 100
+
+
+class RunningStats:
+    """Count, min, max, mean and variance of a stream of values, updated with
+    Welford's algorithm (and merged with Chan et al.'s formula). Values that
+    aren't finite are ignored.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.min = None
+        self.max = None
+        self._m2 = 0.0  # sum of squared differences from the mean
+
+    def add(self, value: float) -> None:
+        if not math.isfinite(value):
+            return
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        value = float(value)
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def add_many(self, values: Iterable[float]) -> None:
+        """Adds values a chunk at a time, vectorized with NumPy if it's installed."""
+        if numpy is None:
+            for value in values:
+                self.add(value)
+            return
+        for chunk in _numpy_chunks(values):
+            if len(chunk):
+                self.merge(self._from_chunk(chunk))
+
+    def merge(self, other: "RunningStats") -> None:
+        """Adds the values summarized by `other`."""
+        if other.count == 0:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self._m2 += other._m2 + delta * delta * self.count * other.count / count
+        self.mean += delta * other.count / count
+        self.count = count
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+
+    @property
+    def variance(self) -> float:
+        """The sample variance, or 0 for fewer than two values."""
+        return self._m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def stddev(self) -> float:
+        return math.sqrt(self.variance)
+
+    @classmethod
+    def _from_chunk(cls, chunk) -> "RunningStats":
+        stats = cls()
+        stats.count = len(chunk)
+        stats.mean = float(chunk.mean())
+        stats._m2 = float(((chunk - stats.mean) ** 2).sum())
+        stats.min, stats.max = float(chunk.min()), float(chunk.max())
+        return stats
+
+
+class QuantileSketch:
+    """Mergeable quantile sketch (DDSketch): values are counted in buckets whose
+    bounds grow geometrically, so any quantile is estimated to within
+    `relative_accuracy` of the true value, using memory that grows with the
+    range of values rather than their number. Values that aren't finite are
+    ignored.
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01):
+        self.relative_accuracy = relative_accuracy
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        # Bucket counts for positive values and for the magnitude of negative ones:
+        self._positive: Dict[int, int] = {}
+        self._negative: Dict[int, int] = {}
+        self._zeros = 0
+        self.count = 0
+
+    def add(self, value: float) -> None:
+        if not math.isfinite(value):
+            return
+        self.count += 1
+        if value > 0:
+            key = self._key(value)
+            self._positive[key] = self._positive.get(key, 0) + 1
+        elif value < 0:
+            key = self._key(-value)
+            self._negative[key] = self._negative.get(key, 0) + 1
+        else:
+            self._zeros += 1
+
+    def add_many(self, values: Iterable[float]) -> None:
+        """Adds values a chunk at a time, vectorized with NumPy if it's installed."""
+        if numpy is None:
+            for value in values:
+                self.add(value)
+            return
+        for chunk in _numpy_chunks(values):
+            self.count += len(chunk)
+            self._zeros += int((chunk == 0).sum())
+            for buckets, magnitudes in (
+                (self._positive, chunk[chunk > 0]),
+                (self._negative, -chunk[chunk < 0]),
+            ):
+                if len(magnitudes) == 0:
+                    continue
+                keys = numpy.ceil(numpy.log(magnitudes) / self._log_gamma)
+                unique, counts = numpy.unique(
+                    keys.astype(numpy.int64), return_counts=True
+                )
+                for key, count in zip(unique.tolist(), counts.tolist()):
+                    buckets[key] = buckets.get(key, 0) + count
+
+    def merge(self, other: "QuantileSketch") -> None:
+        """Adds the values counted by `other`, which must have the same accuracy."""
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Only sketches with the same accuracy can be merged")
+        for buckets, other_buckets in (
+            (self._positive, other._positive),
+            (self._negative, other._negative),
+        ):
+            for key, count in other_buckets.items():
+                buckets[key] = buckets.get(key, 0) + count
+        self._zeros += other._zeros
+        self.count += other.count
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimates the `q` quantile (0 <= q <= 1), or None if the sketch is empty."""
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        # Negative values first, from the largest magnitude:
+        for key in sorted(self._negative, reverse=True):
+            seen += self._negative[key]
+            if seen > rank:
+                return -self._value(key)
+        seen += self._zeros
+        if seen > rank:
+            return 0.0
+        for key in sorted(self._positive):
+            seen += self._positive[key]
+            if seen > rank:
+                return self._value(key)
+        return self._value(max(self._positive))
+
+    def _key(self, magnitude: float) -> int:
+        return math.ceil(math.log(magnitude) / self._log_gamma)
+
+    def _value(self, key: int) -> float:
+        # The middle of the bucket (gamma^(key-1), gamma^key], relative to its bounds:
+        return 2 * self._gamma**key / (self._gamma + 1)
+
+
+def find_gaps(timestamps: Iterable[int], threshold: int) -> List[Tuple[int, int]]:
+    """The `(start, end)` pairs of consecutive sample timestamps (epoch seconds)
+    more than `threshold` seconds apart, in time order. Timestamps don't need to
+    be sorted; they're only sorted if they aren't in order already.
+    """
+    if numpy is not None:
+        timestamps = numpy.asarray(timestamps, dtype=numpy.int64)
+        if (timestamps[1:] < timestamps[:-1]).any():
+            timestamps = numpy.sort(timestamps)
+        positions = numpy.flatnonzero(numpy.diff(timestamps) > threshold)
+        return list(
+            zip(timestamps[positions].tolist(), timestamps[positions + 1].tolist())
+        )
+    timestamps = array("q", timestamps)
+    if any(map(int.__gt__, timestamps, timestamps[1:])):
+        timestamps = array("q", sorted(timestamps))
+    return [
+        (previous, current)
+        for previous, current in zip(timestamps, timestamps[1:])
+        if current - previous > threshold
+    ]
+
+
+class Summarizer:
+    """Summary statistics of readings added a batch at a time: the time range,
+    count, min, max, mean, standard deviation and p50/p95/p99 of the values,
+    and the gaps longer than `gap_threshold` seconds between samples (only the
+    first `MAX_REPORTED_GAPS` are listed). Quantiles are estimated to within
+    `relative_accuracy`.
+
+    Batches must follow each other in time (e.g. the batches of an upload
+    session, see `Health.export_batches`), but each may be unsorted.
+    """
+
+    def __init__(
+        self,
+        gap_threshold: int = DEFAULT_GAP_THRESHOLD,
+        relative_accuracy: float = 0.01,
+    ):
+        self.gap_threshold = gap_threshold
+        self.relative_accuracy = relative_accuracy
+        self.stats = RunningStats()
+        self.sketch = QuantileSketch(relative_accuracy)
+        self.samples = 0
+        self.start = None
+        self.end = None
+        self.gap_count = 0
+        self.gaps = []  # the first MAX_REPORTED_GAPS
+        self.typecode = None
+
+    def add(self, readings: ReadingBatch) -> "Summarizer":
+        if self.typecode is None:
+            self.typecode = readings.values.typecode
+        if not len(readings):
+            return self
+        self.stats.add_many(readings.values)
+        self.sketch.add_many(readings.values)
+        gaps = find_gaps(readings.timestamps, self.gap_threshold)
+        start, end = min(readings.timestamps), max(readings.timestamps)
+        if self.end is not None and start - self.end > self.gap_threshold:
+            gaps.insert(0, (self.end, start))
+        self.gap_count += len(gaps)
+        self.gaps.extend(gaps[: MAX_REPORTED_GAPS - len(self.gaps)])
+        self.samples += len(readings)
+        self.start = start if self.start is None else self.start
+        self.end = end
+        return self
+
+    def summary(self) -> dict:
+        stats = self.stats
+        # Integer values (e.g. heart rate) keep their type:
+        convert = int if self.typecode == "q" else float
+        summary = {
+            "samples": self.samples,
+            "start": None if self.start is None else format_timestamp(self.start),
+            "end": None if self.end is None else format_timestamp(self.end),
+            "min": None if stats.min is None else convert(stats.min),
+            "max": None if stats.max is None else convert(stats.max),
+            "mean": stats.mean if stats.count else None,
+            "stddev": stats.stddev if stats.count else None,
+        }
+        for name, q in QUANTILES.items():
+            value = self.sketch.quantile(q)
+            # Clamped to the values seen, and rounded to the sketch's accuracy:
+            summary[name] = (
+                None
+                if value is None
+                else round(
+                    min(max(value, stats.min), stats.max),
+                    _digits(value, self.relative_accuracy),
+                )
+            )
+        summary["gap_threshold"] = self.gap_threshold
+        summary["gap_count"] = self.gap_count
+        summary["gaps"] = [
+            {
+                "start": format_timestamp(start),
+                "end": format_timestamp(end),
+                "seconds": end - start,
+            }
+            for start, end in self.gaps
+        ]
+        return summary
+
+
+def summarize(
+    readings: ReadingBatch,
+    gap_threshold: int = DEFAULT_GAP_THRESHOLD,
+    relative_accuracy: float = 0.01,
+) -> dict:
+    """Summary statistics of a batch of readings (see `Summarizer`)."""
+    return Summarizer(gap_threshold, relative_accuracy).add(readings).summary()
+
+
+def _numpy_chunks(values: Iterable[float]):
+    """Finite values as float64 NumPy arrays of at most `CHUNK_SIZE` values."""
+    values = numpy.asarray(values, dtype=numpy.float64)
+    for start in range(0, len(values), CHUNK_SIZE):
+        chunk = values[start : start + CHUNK_SIZE]
+        yield chunk[numpy.isfinite(chunk)]
+
+
+def _digits(value: float, relative_accuracy: float) -> int:
+    """Decimal places worth keeping for an estimate within `relative_accuracy`."""
+    if value == 0:
+        return 0
+    magnitude = math.floor(math.log10(abs(value) * relative_accuracy))
+    return max(0, -magnitude)
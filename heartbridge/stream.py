@@ -0,0 +1,365 @@
+"""Incremental parsing of request bodies from Shortcuts. Rather than buffering
+the whole body and building a dictionary with two huge lists of strings, the
+body is tokenized chunk by chunk and every date/value is converted as soon as
+it is complete, straight into the typed columns used by `ReadingBatch`.
+"""
+
+import codecs, json, re
+from array import array
+from typing import List, Union
+from .exceptions import LoadingError, ValidationError
+from .timestamps import parse_many, parse_timestamp
+from .validation import INVALID_DATE, INVALID_VALUE
+
+DATE_FIELDS = {"dates", "hrDates"}
+VALUE_FIELDS = {"values", "hrValues"}
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_STRING = re.compile(r'"([^"\\]*(?:\\.[^"\\]*)*)"', re.DOTALL)
+_NUMBER = re.compile(r"-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?")
+_LITERALS = {"true": True, "false": False, "null": None}
+# A run of plain (unescaped) string elements inside an array, each followed by
+# a comma. This is almost all of a Shortcuts body, so it's consumed in bulk:
+_STRING_RUN = re.compile(r'(?:[ \t\n\r]*"[^"\\]*"[ \t\n\r]*,)+')
+_PLAIN_STRING = re.compile(r'"([^"\\]*)"')
+# Numbers with any of these are floats, others ints (like `json.loads`):
+_FRACTION = re.compile(r"[.eE]")
+
+# Parser states (what the next token may be):
+_VALUE, _KEY, _KEY_OR_END, _COLON, _COMMA_OR_END, _VALUE_OR_END, _DONE = range(7)
+
+
+class ParsedPayload(dict):
+    """A Shortcuts payload produced by `ShortcutsStreamParser`, whose dates and
+    values have already been converted to columns (see
+    `Health.load_from_columns`).
+
+    Dates and values that couldn't be converted are stored as 0 and NaN, and
+    listed in `invalid`, keyed by index (see `heartbridge.validation.check_samples`).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.invalid = {}
+
+
+class _Record:
+    """A JSON object being parsed as a Shortcuts record."""
+
+    __slots__ = ("payload", "depth", "key")
+
+    def __init__(self, payload: ParsedPayload, depth: int):
+        self.payload = payload
+        self.depth = depth  # parser stack depth inside the object
+        self.key = None  # the key whose value is being parsed
+
+
+class ShortcutsStreamParser:
+    """Push parser for a Shortcuts JSON body. Call `feed()` with each chunk of
+    bytes as it arrives, then `close()` to get the parsed payload.
+
+    The payload returned by `close()` is a `ParsedPayload` with the same keys as
+    the decoded JSON object, except that date fields hold an `array("q")` of
+    epoch seconds and value fields an `array("d")` of floats. A single string
+    (which Shortcuts sends when there's only one sample) becomes a one-element
+    array. Keys other than the record type and the date/value fields are
+    tokenized but not kept.
+
+    Batches of several record types (a list of records, or an object keyed by
+    record type, see `heartbridge.health.batch_records`) are returned as a list
+    of `ParsedPayload` records, each with its `type` set.
+
+    Malformed JSON raises `json.JSONDecodeError`, like `json.loads` would.
+    Payloads of the wrong shape raise the same errors as when they're decoded
+    first and loaded with `Health.load_from_shortcuts`: a list or object inside
+    the dates or values is an invalid sample, and a date or value field that
+    isn't a list or a string raises `ValidationError`. Lists and objects
+    elsewhere in a record (e.g. as its type) are decoded and kept, so `Health`
+    can reject them.
+    """
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder("utf-8-sig")()
+        self._buffer = ""
+        self._stack = []
+        self._state = _VALUE
+        self._records = []  # records being parsed, innermost last
+        self._field = None  # date/value column currently being filled
+        self._field_payload = None  # the payload that column belongs to
+        self._top = None  # the top-level record, or list of records
+        self._keyed_records = []  # records nested in a top-level object, by type
+        self._flat = False  # whether the top-level object has non-object values
+        # A list or object being decoded whole, e.g. inside a date/value column,
+        # as [container, key] pairs, innermost last, and what to do with it:
+        self._nested = []
+        self._nested_done = None
+
+    def feed(self, chunk: bytes) -> None:
+        """Tokenizes as much of `chunk` as possible, keeping any incomplete
+        trailing token until the next call.
+        """
+        self._buffer += self._decoder.decode(chunk)
+        self._tokenize(final=False)
+
+    def close(self) -> Union[ParsedPayload, List[ParsedPayload]]:
+        """Finishes parsing and returns the payload (or list of records)."""
+        self._buffer += self._decoder.decode(b"", final=True)
+        self._tokenize(final=True)
+        if self._state != _DONE:
+            self._error("Expecting value" if not self._stack else "Unterminated JSON")
+        if self._keyed_records and not self._flat:
+            return self._keyed_records
+        return self._top
+
+    def _tokenize(self, final: bool) -> None:
+        buffer = self._buffer
+        pos = 0
+        end = len(buffer)
+        while True:
+            pos = _WHITESPACE.match(buffer, pos).end()
+            if pos >= end:
+                break
+            if (
+                self._field is not None
+                and not self._nested
+                and self._state in (_VALUE, _VALUE_OR_END)
+            ):
+                match = _STRING_RUN.match(buffer, pos)
+                if match is not None:
+                    self._extend(
+                        self._field_payload,
+                        self._field,
+                        _PLAIN_STRING.findall(buffer, pos, match.end()),
+                    )
+                    self._state = _VALUE
+                    pos = match.end()
+                    continue
+            char = buffer[pos]
+            if char in "{}[]:,":
+                self._punctuation(char, pos)
+                pos += 1
+            elif char == '"':
+                match = _STRING.match(buffer, pos)
+                if match is None:
+                    if final:
+                        self._error("Unterminated string", pos)
+                    break
+                raw = match.group(1)
+                self._scalar(json.loads(match.group(0)) if "\\" in raw else raw, pos)
+                pos = match.end()
+            elif char == "-" or char.isdigit():
+                match = _NUMBER.match(buffer, pos)
+                if not final and (match is None or match.end() == end):
+                    break  # the number may continue in the next chunk
+                if match is None:
+                    self._error("Invalid number", pos)
+                self._scalar(match.group(0), pos, number=True)
+                pos = match.end()
+            elif char in "tfn":
+                word = buffer[pos : pos + 5 if char == "f" else pos + 4]
+                if word not in _LITERALS:
+                    if not final and len(word) < (5 if char == "f" else 4):
+                        break
+                    self._error("Expecting value", pos)
+                self._scalar(_LITERALS[word], pos)
+                pos += len(word)
+            else:
+                self._error("Expecting value", pos)
+        self._buffer = buffer[pos:]
+
+    def _punctuation(self, char: str, pos: int) -> None:
+        state = self._state
+        if char in "{[":
+            if state not in (_VALUE, _VALUE_OR_END):
+                self._error("Expecting ',' delimiter or end of container", pos)
+            self._open(char)
+        elif char in "}]":
+            expected_close = "}" if self._stack and self._stack[-1] == "{" else "]"
+            allowed = (
+                (_KEY_OR_END, _COMMA_OR_END)
+                if expected_close == "}"
+                else (_VALUE_OR_END, _COMMA_OR_END)
+            )
+            if not self._stack or char != expected_close or state not in allowed:
+                self._error("Unexpected '{}'".format(char), pos)
+            self._close(char)
+            self._end_value()
+        elif char == ":":
+            if state != _COLON:
+                self._error("Unexpected ':'", pos)
+            self._state = _VALUE
+        else:
+            if state != _COMMA_OR_END:
+                self._error("Unexpected ','", pos)
+            self._state = _KEY if self._stack[-1] == "{" else _VALUE
+
+    def _open(self, char: str) -> None:
+        depth = len(self._stack)
+        record = self._records[-1] if self._records else None
+        if depth == 1 and self._stack[0] == "[" and char != "{":
+            raise LoadingError("Batches must be sent as a list of JSON objects")
+        if record is not None and depth == record.depth == 1:
+            # A value of the top-level object that isn't another object:
+            self._flat = self._flat or char == "["
+        if self._nested or self._field is not None:
+            self._open_nested(char)
+            return
+        at_record_depth = record is not None and depth == record.depth
+        if at_record_depth and record.key == "type":
+            self._open_nested(char, record.payload)
+            return
+        if at_record_depth and char == "{" and self._is_column(record.key):
+            raise ValidationError(
+                "The {} field must be a list of strings".format(record.key)
+            )
+
+        if char == "{":
+            if depth == 0:
+                self._top = ParsedPayload()
+                self._records.append(_Record(self._top, 1))
+            elif depth == 1 and self._stack[0] == "[":
+                self._top.append(ParsedPayload())
+                self._records.append(_Record(self._top[-1], 2))
+            elif depth == 1:
+                self._keyed_records.append(ParsedPayload(type=record.key))
+                self._records.append(_Record(self._keyed_records[-1], 2))
+        elif depth == 0:
+            self._top = []
+        elif record is not None and depth == record.depth:
+            if self._is_column(record.key):
+                self._field = record.payload[record.key]
+                self._field_payload = record.payload
+        self._stack.append(char)
+        self._state = _KEY_OR_END if char == "{" else _VALUE_OR_END
+
+    def _open_nested(self, char: str, payload: ParsedPayload = None) -> None:
+        """Starts decoding a list or object whole: an element of the date/value
+        column being filled, or the type of `payload`'s record.
+        """
+        container = {} if char == "{" else []
+        if self._nested:
+            self._add_nested(container)
+        elif payload is not None:
+            self._nested_done = lambda value: payload.__setitem__("type", value)
+        else:
+            payload, column = self._field_payload, self._field
+            self._nested_done = lambda value: self._append(payload, column, value)
+        self._nested.append([container, None])
+        self._stack.append(char)
+        self._state = _KEY_OR_END if char == "{" else _VALUE_OR_END
+
+    def _add_nested(self, value) -> None:
+        container, key = self._nested[-1]
+        if isinstance(container, list):
+            container.append(value)
+        else:
+            container[key] = value
+
+    def _close(self, char: str) -> None:
+        self._stack.pop()
+        if self._nested:
+            container, _ = self._nested.pop()
+            if not self._nested:
+                self._nested_done(container)
+                self._nested_done = None
+            return
+        depth = len(self._stack)
+        if self._records and self._records[-1].depth == depth + 1 and char == "}":
+            self._records.pop()
+        elif char == "]":
+            self._field = None
+
+    def _scalar(self, value, pos: int, number: bool = False) -> None:
+        state = self._state
+        record = self._records[-1] if self._records else None
+        at_record_depth = record is not None and len(self._stack) == record.depth
+        if state in (_KEY, _KEY_OR_END):
+            if number or not isinstance(value, str):
+                self._error("Expecting property name enclosed in double quotes", pos)
+            if self._nested:
+                self._nested[-1][1] = value
+            elif at_record_depth:
+                self._start_field(record, value)
+            self._state = _COLON
+            return
+        if state not in (_VALUE, _VALUE_OR_END):
+            self._error("Expecting ',' delimiter", pos)
+        if not self._stack:
+            raise LoadingError("Shortcuts data must be sent as a JSON object")
+        if len(self._stack) == 1 and self._stack[0] == "[":
+            raise LoadingError("Batches must be sent as a list of JSON objects")
+        if number:
+            value = float(value) if _FRACTION.search(value) else int(value)
+        if self._nested:
+            self._add_nested(value)
+        elif self._field is not None:
+            self._append(self._field_payload, self._field, value)
+        elif at_record_depth:
+            if record.depth == 1:
+                self._flat = True
+            if self._is_column(record.key):
+                if not isinstance(value, str):
+                    raise ValidationError(
+                        "The {} field must be a list of strings".format(record.key)
+                    )
+                # A lone string instead of a list, for a single sample:
+                self._append(record.payload, record.payload[record.key], value)
+            elif record.key == "type":
+                record.payload["type"] = value
+        self._end_value()
+
+    def _start_field(self, record: _Record, key: str) -> None:
+        record.key = key
+        if key in DATE_FIELDS:
+            record.payload[key] = array("q")
+        elif key in VALUE_FIELDS:
+            record.payload[key] = array("d")
+
+    def _is_column(self, key: str) -> bool:
+        return key in DATE_FIELDS or key in VALUE_FIELDS
+
+    def _append(self, payload: ParsedPayload, column: array, value) -> None:
+        try:
+            if column.typecode == "q":
+                column.append(parse_timestamp(value))
+            else:
+                column.append(float(value))
+        except (TypeError, ValueError):
+            if column.typecode == "q":
+                payload.invalid.setdefault(len(column), (0, value, INVALID_DATE))
+                column.append(0)
+            else:
+                payload.invalid.setdefault(len(column), (1, value, INVALID_VALUE))
+                column.append(float("nan"))
+
+    def _extend(self, payload: ParsedPayload, column: array, values: list) -> None:
+        try:
+            if column.typecode == "q":
+                column.extend(parse_many(values))
+            else:
+                column.extend(array("d", map(float, values)))
+        except (TypeError, ValueError):
+            for value in values:
+                self._append(payload, column, value)
+
+    def _end_value(self) -> None:
+        self._state = _COMMA_OR_END if self._stack else _DONE
+
+    def _error(self, message: str, pos: int = None) -> None:
+        # Positions are relative to the chunk of the body still being tokenized:
+        raise json.JSONDecodeError(
+            message, self._buffer, len(self._buffer) if pos is None else pos
+        )
+
+
+def parse_file(
+    path, chunk_size: int = 65536
+) -> Union[ParsedPayload, List[ParsedPayload]]:
+    """Parses a saved Shortcuts body with `ShortcutsStreamParser`, reading it
+    `chunk_size` bytes at a time.
+    """
+    parser = ShortcutsStreamParser()
+    with open(path, "rb") as body_file:
+        for chunk in iter(lambda: body_file.read(chunk_size), b""):
+            parser.feed(chunk)
+    return parser.close()
@@ -0,0 +1,119 @@
+"""Fast parsing and formatting of the fixed timestamp layout sent by Shortcuts
+(`YYYY-MM-DD HH:MM:SS`). Timestamps are handled as whole seconds since the
+Unix epoch, which is how `ReadingBatch` stores them.
+
+Fields are sliced positionally instead of going through `datetime.strptime`
+and `datetime.strftime`. The date part of a timestamp is cached, since
+thousands of samples usually share the same day. Strings that don't match the
+fixed layout fall back to `datetime.strptime`, so anything accepted before is
+still accepted.
+"""
+
+from array import array
+from datetime import datetime, date, timedelta
+from typing import Iterable, Iterator
+
+DATE_PARSE_STRING = "%Y-%m-%d %H:%M:%S"
+
+EPOCH = datetime(1970, 1, 1)
+ONE_SECOND = timedelta(seconds=1)
+SECONDS_PER_DAY = 86400
+
+# Two-digit field lookups: a dictionary hit both validates and converts a field.
+_TWO_DIGITS = {"%02d" % i: i for i in range(60)}
+_TWO_DIGIT_STRINGS = ["%02d" % i for i in range(60)]
+# "HH:MM:" for every minute of the day, so formatting is two lookups:
+_HOUR_MINUTE_STRINGS = ["%02d:%02d:" % divmod(i, 60) for i in range(1440)]
+
+
+def datetime_to_epoch(value: datetime) -> int:
+    """Converts a (naive) datetime to whole seconds since the Unix epoch."""
+    return (value - EPOCH) // ONE_SECOND
+
+
+def epoch_to_datetime(seconds: int) -> datetime:
+    """Converts whole seconds since the Unix epoch back to a naive datetime."""
+    return EPOCH + timedelta(seconds=seconds)
+
+
+class TimestampCodec:
+    """Parses and formats Shortcuts timestamps to and from epoch seconds.
+
+    Args:
+        max_cached_days: Upper bound on the number of days kept in each cache.
+            The caches are cleared when this is exceeded.
+    """
+
+    def __init__(self, max_cached_days: int = 4096):
+        self.max_cached_days = max_cached_days
+        self._parse_cache = {}
+        self._format_cache = {}
+
+    def parse(self, value: str) -> int:
+        """Parses one timestamp string into epoch seconds."""
+        day = self._parse_cache.get(value[:10])
+        if (
+            day is not None
+            and len(value) == 19
+            and value[10] == " "
+            and value[13] == ":"
+            and value[16] == ":"
+        ):
+            hour = _TWO_DIGITS.get(value[11:13])
+            minute = _TWO_DIGITS.get(value[14:16])
+            second = _TWO_DIGITS.get(value[17:19])
+            if (
+                hour is not None
+                and hour < 24
+                and minute is not None
+                and second is not None
+            ):
+                return day + hour * 3600 + minute * 60 + second
+        return self._parse_uncached(value)
+
+    def parse_many(self, values: Iterable[str]) -> array:
+        """Parses an iterable of timestamp strings into an array of epoch seconds."""
+        parse = self.parse
+        return array("q", [parse(value) for value in values])
+
+    def format(self, seconds: int) -> str:
+        """Formats epoch seconds as a `YYYY-MM-DD HH:MM:SS` string."""
+        day, remainder = divmod(seconds, SECONDS_PER_DAY)
+        prefix = self._format_cache.get(day)
+        if prefix is None:
+            prefix = self._format_day(day)
+        minute, second = divmod(remainder, 60)
+        return prefix + _HOUR_MINUTE_STRINGS[minute] + _TWO_DIGIT_STRINGS[second]
+
+    def format_many(self, values: Iterable[int]) -> Iterator[str]:
+        """Lazily formats an iterable of epoch seconds."""
+        return map(self.format, values)
+
+    def _parse_uncached(self, value: str) -> int:
+        """Parses with `datetime.strptime`, and caches the date part if the string
+        follows the fixed layout so the next timestamp on that day is fast.
+        """
+        parsed = datetime.strptime(value, DATE_PARSE_STRING)
+        timestamp = datetime_to_epoch(parsed)
+        # Only cache days written in the canonical zero-padded form, since the
+        # fast path relies on fixed positions:
+        if parsed.date().isoformat() == value[:10]:
+            if len(self._parse_cache) >= self.max_cached_days:
+                self._parse_cache.clear()
+            self._parse_cache[value[:10]] = timestamp - timestamp % SECONDS_PER_DAY
+        return timestamp
+
+    def _format_day(self, day: int) -> str:
+        if len(self._format_cache) >= self.max_cached_days:
+            self._format_cache.clear()
+        prefix = (date(1970, 1, 1) + timedelta(days=day)).isoformat() + " "
+        self._format_cache[day] = prefix
+        return prefix
+
+
+default_codec = TimestampCodec()
+
+parse_timestamp = default_codec.parse
+parse_many = default_codec.parse_many
+format_timestamp = default_codec.format
+format_many = default_codec.format_many
@@ -0,0 +1,258 @@
+"""Validation of individual samples, fused with parsing them into columns.
+
+Every date must be a `YYYY-MM-DD HH:MM:SS` timestamp, and every value a number
+within the reading class' `value_range`. Samples are checked while they're
+parsed (vectorized with NumPy when it's installed), so a bad sample is
+reported with its position instead of failing somewhere in the middle of an
+export. Without NumPy, columns are parsed in bulk first, and only when that
+fails are the samples gone through one by one to find the invalid ones.
+Invalid samples are either rejected with a `SampleValidationError` listing
+the first few of them, or dropped.
+"""
+
+import heapq
+from array import array
+from typing import Dict, List, Sequence, Tuple
+from .data import numpy
+from .exceptions import SampleValidationError
+from .timestamps import parse_many, parse_timestamp
+
+# Number of invalid samples listed in a `SampleValidationError`:
+MAX_REPORTED_ERRORS = 10
+
+INVALID_DATE = "not a YYYY-MM-DD HH:MM:SS timestamp"
+INVALID_VALUE = "not a number"
+OUT_OF_RANGE = "outside the range {} to {}"
+
+
+class SampleErrors:
+    """Collects invalid samples while a payload is parsed. Every invalid sample
+    is flagged (with a byte per sample), but the details are only kept for the
+    `max_errors` invalid samples with the lowest indices, since only those are
+    reported.
+    """
+
+    def __init__(self, fields: Tuple[str, str], max_errors: int):
+        self.fields = fields
+        self.max_errors = max_errors
+        self.count = 0
+        self._flags = bytearray()
+        # A heap of (-index, field, value, reason), so the highest index is first:
+        self._first: List[tuple] = []
+
+    def add(self, index: int, field: int, value, reason: str) -> None:
+        """Records the first problem found with the sample at `index` (`field` is
+        0 for its date and 1 for its value).
+        """
+        if index >= len(self._flags):
+            self._flags.extend(
+                bytes(max(index + 1, 2 * len(self._flags)) - len(self._flags))
+            )
+        if self._flags[index]:
+            return
+        self._flags[index] = 1
+        self.count += 1
+        error = (-index, self.fields[field], value, reason)
+        if len(self._first) < self.max_errors:
+            heapq.heappush(self._first, error)
+        elif self._first and index < -self._first[0][0]:
+            heapq.heapreplace(self._first, error)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def report(self) -> List[dict]:
+        """The first `max_errors` invalid samples, in order."""
+        return [
+            {"index": -index, "field": field, "value": value, "reason": reason}
+            for index, field, value, reason in sorted(self._first, reverse=True)
+        ]
+
+    def raise_or_drop(
+        self, timestamps: array, values: array, drop_invalid: bool
+    ) -> Tuple[array, array]:
+        """Raises a `SampleValidationError` if there are invalid samples, or with
+        `drop_invalid`, returns the columns without them.
+        """
+        if not self.count:
+            return timestamps, values
+        if not drop_invalid:
+            raise SampleValidationError(
+                "{} of the samples are invalid".format(len(self)),
+                self.report(),
+                len(self),
+            )
+        invalid = self._flags.ljust(len(timestamps), b"\0")
+        keep = [i for i in range(len(timestamps)) if not invalid[i]]
+        return (
+            array(timestamps.typecode, [timestamps[i] for i in keep]),
+            array(values.typecode, [values[i] for i in keep]),
+        )
+
+
+def parse_samples(
+    reading_cls: type,
+    dates: Sequence,
+    values: Sequence,
+    fields: Tuple[str, str] = ("dates", "values"),
+    max_errors: int = MAX_REPORTED_ERRORS,
+    drop_invalid: bool = False,
+) -> Tuple[array, array, List[dict]]:
+    """Parses and validates the raw dates and values sent by Shortcuts.
+
+    Returns the timestamp and value columns (in `reading_cls.value_typecode`),
+    and the invalid samples that were dropped (empty unless `drop_invalid`).
+    """
+    errors = SampleErrors(fields, max_errors)
+    if numpy is not None:
+        timestamps = _parse_dates(dates, errors)
+        numbers = _parse_numbers(values, errors)
+        values = _check_range(reading_cls, numbers, errors)
+    else:
+        try:
+            timestamps = parse_many(dates)
+            numbers = array("d", map(float, values))
+        except (TypeError, ValueError):
+            # Only go through samples one by one when some don't parse:
+            timestamps, values = _parse_fused(reading_cls, dates, values, errors)
+        else:
+            values = _check_range(reading_cls, numbers, errors)
+    timestamps, values = errors.raise_or_drop(timestamps, values, drop_invalid)
+    return timestamps, values, errors.report()
+
+
+def check_samples(
+    reading_cls: type,
+    timestamps: array,
+    numbers: Sequence[float],
+    invalid: Dict[int, Tuple[int, object, str]] = None,
+    fields: Tuple[str, str] = ("dates", "values"),
+    max_errors: int = MAX_REPORTED_ERRORS,
+    drop_invalid: bool = False,
+) -> Tuple[array, array, List[dict]]:
+    """Like `parse_samples`, for columns that were already parsed (e.g. by
+    `heartbridge.stream.ShortcutsStreamParser`). `invalid` holds the samples
+    that could not be parsed, keyed by index, as `(field, value, reason)` tuples
+    (see `SampleErrors.add`).
+    """
+    errors = SampleErrors(fields, max_errors)
+    for index, (field, value, reason) in (invalid or {}).items():
+        errors.add(index, field, value, reason)
+    if numpy is not None:
+        numbers = numpy.frombuffer(array("d", numbers), dtype=numpy.float64)
+    values = _check_range(reading_cls, numbers, errors)
+    timestamps, values = errors.raise_or_drop(timestamps, values, drop_invalid)
+    return timestamps, values, errors.report()
+
+
+def _parse_fused(reading_cls, dates, values, errors: SampleErrors):
+    """Single pass over both columns, finding every invalid sample (without NumPy)."""
+    parse_value = reading_cls.parse_value
+    low, high = reading_cls.value_range
+    out_of_range = OUT_OF_RANGE.format(low, high)
+    timestamps = array("q")
+    parsed = array(reading_cls.value_typecode)
+    for index, (date, value) in enumerate(zip(dates, values)):
+        try:
+            timestamp = parse_timestamp(date)
+        except (TypeError, ValueError):
+            errors.add(index, 0, date, INVALID_DATE)
+            timestamp = 0
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            errors.add(index, 1, value, INVALID_VALUE)
+            number = 0.0
+        else:
+            if number != number:
+                errors.add(index, 1, None, INVALID_VALUE)
+                number = 0.0
+            elif not low <= number <= high:
+                errors.add(index, 1, _number(number), out_of_range)
+                number = 0.0
+        timestamps.append(timestamp)
+        parsed.append(parse_value(number))
+    return timestamps, parsed
+
+
+def _parse_dates(dates: Sequence, errors: SampleErrors) -> array:
+    try:
+        return parse_many(dates)
+    except (TypeError, ValueError):
+        pass
+    # Find out which dates are invalid:
+    timestamps = array("q")
+    for index, date in enumerate(dates):
+        try:
+            timestamps.append(parse_timestamp(date))
+        except (TypeError, ValueError):
+            errors.add(index, 0, date, INVALID_DATE)
+            timestamps.append(0)
+    return timestamps
+
+
+def _parse_numbers(values: Sequence, errors: SampleErrors):
+    """Converts values to a float64 NumPy array. Invalid values become NaN."""
+    try:
+        numbers = numpy.array(values, dtype=numpy.float64)
+    except (TypeError, ValueError):
+        pass
+    else:
+        # Lists nested in `values` would make more dimensions:
+        if numbers.ndim == 1:
+            return numbers
+    numbers = numpy.empty(len(values), dtype=numpy.float64)
+    for index, value in enumerate(values):
+        try:
+            numbers[index] = float(value)
+        except (TypeError, ValueError):
+            errors.add(index, 1, value, INVALID_VALUE)
+            numbers[index] = numpy.nan
+    return numbers
+
+
+def _check_range(reading_cls: type, numbers, errors: SampleErrors) -> array:
+    """Flags values that are NaN (e.g. a null value converted by NumPy) or
+    outside the reading class' range, and converts the rest to the reading
+    class' value type. Flagged values become 0.
+    """
+    low, high = reading_cls.value_range
+    if numpy is not None and isinstance(numbers, numpy.ndarray):
+        in_range = (numbers >= low) & (numbers <= high)
+        if not in_range.all():
+            reason = OUT_OF_RANGE.format(low, high)
+            for index in numpy.flatnonzero(numpy.isnan(numbers)).tolist():
+                errors.add(index, 1, None, INVALID_VALUE)
+            for index in numpy.flatnonzero(~in_range).tolist():
+                errors.add(index, 1, _number(numbers[index]), reason)
+            numbers = numpy.where(in_range, numbers, 0.0)
+        if reading_cls.value_typecode == "q":
+            return _from_numpy("q", numbers.astype(numpy.int64))
+        return array("d", map(reading_cls.parse_value, numbers.tolist()))
+
+    parse_value = reading_cls.parse_value
+    if all(low <= number <= high for number in numbers):
+        return array(reading_cls.value_typecode, map(parse_value, numbers))
+    values = array(reading_cls.value_typecode)
+    reason = OUT_OF_RANGE.format(low, high)
+    for index, number in enumerate(numbers):
+        if number != number:
+            errors.add(index, 1, None, INVALID_VALUE)
+            number = 0.0
+        elif not low <= number <= high:
+            errors.add(index, 1, _number(number), reason)
+            number = 0.0
+        values.append(parse_value(number))
+    return values
+
+
+def _number(value: float):
+    """A float for a JSON response: NaN isn't valid JSON, so it's reported as None."""
+    value = float(value)
+    return None if value != value else value
+
+
+def _from_numpy(typecode: str, values) -> array:
+    result = array(typecode)
+    result.frombytes(values.tobytes())
+    return result
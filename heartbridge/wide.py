@@ -0,0 +1,239 @@
+"""Wide exports: the stored readings of several record types in one table,
+aligned on time buckets, with a column per record type:
+
+    timestamp,heart_rate,heart_rate_variability,steps
+    2021-04-01 08:00:00,74.5,,12
+    2021-04-01 08:01:00,76.0,48.2,
+
+Each record type's readings are read from storage in timestamp order (see
+`heartbridge.query.RangeQuery`) and reduced per bucket as they stream past (a
+sum for steps, flights climbed and cycling distance, and a mean for everything
+else). The reduced series are then joined with a k-way merge, so only the
+current bucket of each record type is held in memory, whatever the size of the
+stored exports.
+"""
+
+import heapq
+from itertools import groupby
+from operator import itemgetter
+from pathlib import Path
+from typing import Iterable, Iterator, Optional, Sequence, Tuple, Union
+from .aggregate import BUCKET_SECONDS, CUMULATIVE_READINGS, reducer_typecode
+from .constants import EXPORT_CLS_MAP, READING_MAPPING
+from .data import GenericHealthReading
+from .export import RowSchema, export_filepath, sqlite_table_name
+from .query import RangeQuery
+from .timestamps import format_timestamp
+
+# Record types exported by default:
+WIDE_READING_TYPES = (
+    "heart-rate",
+    "resting-heart-rate",
+    "heart-rate-variability",
+    "steps",
+    "flights-climbed",
+    "cycling-distance",
+)
+
+# How a bucket without samples of a record type is filled: left empty (null in
+# JSON), with the record type's previous value, or with zero.
+FILL_POLICIES = ("empty", "previous", "zero")
+
+
+def bucket_seconds(bucket: Union[str, int]) -> int:
+    """The size of a bucket given as minute, hour, day or a number of seconds."""
+    seconds = BUCKET_SECONDS.get(bucket, bucket)
+    if not isinstance(seconds, int) or seconds <= 0:
+        raise ValueError(
+            "bucket must be one of {} or a number of seconds".format(
+                ", ".join(BUCKET_SECONDS)
+            )
+        )
+    return seconds
+
+
+def bucket_reducer(reading_type: str) -> str:
+    """The reducer a record type's samples are combined with in each bucket."""
+    reading_cls = READING_MAPPING.get(reading_type, GenericHealthReading)
+    return "sum" if issubclass(reading_cls, CUMULATIVE_READINGS) else "mean"
+
+
+def reduce_buckets(
+    rows: Iterable[Tuple[int, float]], seconds: int, offset: int = 0, reducer="mean"
+) -> Iterator[Tuple[int, float]]:
+    """Reduces time-ordered `(timestamp, value)` rows into `(bucket start,
+    value)` pairs, one bucket at a time. Buckets are `seconds` long and start
+    `offset` seconds after a multiple of `seconds` (since the epoch).
+    """
+    for bucket, group in groupby(rows, key=lambda row: (row[0] - offset) // seconds):
+        values = [value for _, value in group]
+        total = sum(values)
+        yield (
+            bucket * seconds + offset,
+            total / len(values) if reducer == "mean" else total,
+        )
+
+
+def merge_join(
+    series: Sequence[Iterable[Tuple[int, float]]],
+    fill: str = "empty",
+    zeros: Sequence[Union[int, float]] = None,
+    fill_limit: int = None,
+) -> Iterator[tuple]:
+    """Joins time-ordered `(bucket, value)` series into `(bucket, value of each
+    series...)` rows, with a row for every bucket in which any series has a
+    value. Missing values are filled according to `fill` (see `FILL_POLICIES`),
+    with `zeros` (0 by default) as each series' zero. With `fill_limit`, a
+    previous value is only carried into buckets at most that many seconds after
+    its own.
+    """
+    if fill not in FILL_POLICIES:
+        raise ValueError("fill must be one of {}".format(", ".join(FILL_POLICIES)))
+    if zeros is None:
+        zeros = [0] * len(series)
+    empty = [None] * len(series)
+    previous, previous_buckets = list(empty), list(empty)
+    merged = heapq.merge(*(_tagged(values, i) for i, values in enumerate(series)))
+    for bucket, group in groupby(merged, key=itemgetter(0)):
+        if fill == "previous":
+            row = [bucket, *previous]
+            if fill_limit is not None:
+                for position, previous_bucket in enumerate(previous_buckets):
+                    if (
+                        previous_bucket is not None
+                        and bucket - previous_bucket > fill_limit
+                    ):
+                        row[position + 1] = None
+        elif fill == "zero":
+            row = [bucket, *zeros]
+        else:
+            row = [bucket, *empty]
+        for _, position, value in group:
+            row[position + 1] = value
+            previous[position], previous_buckets[position] = value, bucket
+        yield tuple(row)
+
+
+def _tagged(values: Iterable[Tuple[int, float]], position: int) -> Iterator[tuple]:
+    for bucket, value in values:
+        yield bucket, position, value
+
+
+class WideExport:
+    """Readings of several record types stored in `output_dir` (in
+    `output_format`), aligned on buckets and joined into one table.
+
+    Args:
+        output_dir: The directory readings were exported to
+        output_format: The format readings were exported in (a key of `EXPORT_CLS_MAP`)
+        reading_types: Record type slugs, one column each (in this order)
+        bucket: minute, hour, day or a bucket size in seconds
+        offset: Seconds bucket boundaries are shifted by, e.g. 1800 for
+            hourly buckets starting at half past
+        fill: How buckets without a record type's samples are filled (see
+            `FILL_POLICIES`)
+        fill_limit: The most seconds a previous value is carried forward for
+            (with the `previous` fill policy); None for no limit
+        start, end: Epoch seconds bounding the samples read; None for an open end
+    """
+
+    def __init__(
+        self,
+        output_dir: Union[str, Path, None],
+        output_format: str,
+        reading_types: Sequence[str] = WIDE_READING_TYPES,
+        bucket: Union[str, int] = "minute",
+        offset: int = 0,
+        fill: str = "empty",
+        fill_limit: int = None,
+        start: int = None,
+        end: int = None,
+    ):
+        if fill not in FILL_POLICIES:
+            raise ValueError("fill must be one of {}".format(", ".join(FILL_POLICIES)))
+        if not reading_types:
+            raise ValueError("At least one record type is needed")
+        self.output_dir = output_dir
+        self.output_format = output_format
+        self.reading_types = list(reading_types)
+        self.bucket = bucket
+        self.seconds = bucket_seconds(bucket)
+        self.offset = offset
+        self.fill = fill
+        self.fill_limit = fill_limit
+        self.start = start
+        self.end = end
+
+    @property
+    def reading_type(self) -> str:
+        """The name of the table, e.g. wide-per-minute."""
+        if isinstance(self.bucket, str):
+            return "wide-per-{}".format(self.bucket)
+        return "wide-per-{}s".format(self.seconds)
+
+    @property
+    def schema(self) -> RowSchema:
+        """The schema of the rows: `timestamp` and a column per record type.
+        Columns may have empty values unless buckets are filled with zeros.
+        """
+        field_names = ["timestamp"] + [
+            sqlite_table_name(reading_type) for reading_type in self.reading_types
+        ]
+        typecodes = tuple(
+            self._typecode(reading_type) if self.fill == "zero" else None
+            for reading_type in self.reading_types
+        )
+        return RowSchema(tuple(field_names), typecodes, self.reading_type)
+
+    def rows(self, format_timestamps: bool = True) -> Iterator[tuple]:
+        """Yields the rows in timestamp order, with bucket starts formatted as
+        timestamps, or left as epoch seconds if `format_timestamps` is False.
+        """
+        series = [
+            reduce_buckets(
+                RangeQuery(
+                    self.output_dir,
+                    self.output_format,
+                    reading_type,
+                    self.start,
+                    self.end,
+                ).rows(),
+                self.seconds,
+                self.offset,
+                bucket_reducer(reading_type),
+            )
+            for reading_type in self.reading_types
+        ]
+        zeros = [
+            0.0 if self._typecode(reading_type) == "d" else 0
+            for reading_type in self.reading_types
+        ]
+        rows = merge_join(series, self.fill, zeros, self.fill_limit)
+        if not format_timestamps:
+            return rows
+        return ((format_timestamp(row[0]), *row[1:]) for row in rows)
+
+    def export(self, export_format: str = "csv", filename=None) -> str:
+        """Writes the table with the exporter for `export_format` (see
+        `EXPORT_CLS_MAP`), and returns the file path. The file is named after
+        `reading_type` (e.g. wide-per-minute.csv) in the output directory,
+        unless `filename` is given; SQLite tables go to the shared database.
+        """
+        exporter = EXPORT_CLS_MAP[export_format]()
+        if filename is None:
+            filename = export_filepath(
+                exporter.shared_filename or self.reading_type,
+                self.output_dir,
+                export_format,
+            )
+        return exporter.rows_to_file(
+            self.schema,
+            self.rows(format_timestamps=not exporter.epoch_timestamps),
+            filename,
+        )
+
+    def _typecode(self, reading_type: str) -> Optional[str]:
+        reading_cls = READING_MAPPING.get(reading_type, GenericHealthReading)
+        return reducer_typecode(
+            bucket_reducer(reading_type), reading_cls.value_typecode
+        )
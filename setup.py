@@ -29,4 +29,5 @@ setup(
     keywords="heartrate apple watch shortcuts ios health",
     python_requires=">=3.8",
     install_requires=["uvicorn", "starlette"],
+    extras_require={"fast": ["orjson"]},
 )
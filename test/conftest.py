@@ -0,0 +1,16 @@
+import sys
+import pytest
+
+
+@pytest.fixture(params=["python", "numpy"])
+def engine(request, monkeypatch):
+    """Runs a test with NumPy, and again with every heartbridge module using its
+    pure Python path instead.
+    """
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+        return request.param
+    for name, module in list(sys.modules.items()):
+        if name.startswith("heartbridge.") and hasattr(module, "numpy"):
+            monkeypatch.setattr(module, "numpy", None)
+    return request.param
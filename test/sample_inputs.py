@@ -75,3 +75,13 @@ GENERIC_INPUT = {
     "dates": ["2021-04-13 23:29:00"],
     "values": ["90"],
 }
+
+BATCH_LIST_INPUT = [HR_TYPICAL_INPUT, STEPS_INPUT, HRV_INPUT]
+
+BATCH_DICT_INPUT = {
+    "Resting Heart Rate": {
+        "dates": RESTING_HR_INPUT["dates"],
+        "values": RESTING_HR_INPUT["values"],
+    },
+    "Steps": {"dates": STEPS_INPUT["dates"], "values": STEPS_INPUT["values"]},
+}
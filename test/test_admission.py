@@ -0,0 +1,69 @@
+import asyncio
+import pytest
+from heartbridge.admission import AdmissionControl
+from heartbridge.exceptions import QueueFullError, ServerBusyError
+
+
+def test_admission_shouldLimitConcurrentUploads():
+    admission = AdmissionControl(max_concurrent=2, max_queued=10)
+    running, most_running = 0, 0
+
+    async def upload():
+        nonlocal running, most_running
+        async with admission.admit():
+            running += 1
+            most_running = max(most_running, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+    async def main():
+        await asyncio.gather(*(upload() for _ in range(8)))
+
+    asyncio.run(main())
+
+    assert most_running == 2
+    assert admission.active == admission.waiting == 0
+
+
+def test_admission_queueFull_shouldRaise():
+    admission = AdmissionControl(max_concurrent=1, max_queued=1)
+
+    async def main():
+        started = asyncio.Event()
+
+        async def slow_upload():
+            async with admission.admit():
+                started.set()
+                await asyncio.sleep(0.1)
+
+        first = asyncio.ensure_future(slow_upload())
+        await started.wait()
+        second = asyncio.ensure_future(slow_upload())
+        await asyncio.sleep(0)
+        assert admission.waiting == 1
+        with pytest.raises(QueueFullError) as error:
+            async with admission.admit():
+                pass
+        await asyncio.gather(first, second)
+        return error.value
+
+    error = asyncio.run(main())
+
+    assert error.retry_after >= 1
+
+
+def test_admission_queueTimeout_shouldRaise():
+    admission = AdmissionControl(max_concurrent=1, max_queued=1, queue_timeout=0.01)
+
+    async def main():
+        async with admission.admit():
+            with pytest.raises(ServerBusyError) as error:
+                async with admission.admit():
+                    pass
+        assert not isinstance(error.value, QueueFullError)
+        # A turn is free again afterwards:
+        async with admission.admit():
+            assert admission.active == 1
+
+    asyncio.run(main())
+    assert admission.waiting == 0
@@ -0,0 +1,120 @@
+import pytest
+from starlette.testclient import TestClient
+from heartbridge import Health, aggregate
+from heartbridge.app import app
+from heartbridge.data import ColumnarBatch
+import test.sample_inputs as samples
+
+HR_INPUT = {
+    "type": "Heart Rate",
+    "dates": [
+        "2021-04-01 08:00:05",
+        "2021-04-01 08:00:50",
+        "2021-04-01 08:01:10",
+        "2021-04-01 09:30:00",
+    ],
+    "values": ["60", "70", "90", "100"],
+}
+
+
+def load(data):
+    health = Health()
+    health.load_from_shortcuts(dict(data))
+    return health.readings
+
+
+def test_resample_heartRate_perMinute(engine):
+    rollup = aggregate.resample(load(HR_INPUT), "minute")
+
+    assert rollup.reading_type == "heart-rate-per-minute"
+    assert rollup.field_names == [
+        "timestamp",
+        "heart_rate_mean",
+        "heart_rate_min",
+        "heart_rate_max",
+        "heart_rate_count",
+    ]
+    assert list(rollup.rows()) == [
+        ("2021-04-01 08:00:00", 65.0, 60, 70, 2),
+        ("2021-04-01 08:01:00", 90.0, 90, 90, 1),
+        ("2021-04-01 09:30:00", 100.0, 100, 100, 1),
+    ]
+
+
+@pytest.mark.parametrize(
+    "input_data, expected",
+    [
+        (samples.STEPS_INPUT, [("2021-04-10 00:00:00", 94)]),
+        (samples.FLIGHTS_INPUT, [("2021-04-05 00:00:00", 4)]),
+        (samples.CYCLING_INPUT, [("2021-04-13 00:00:00", 15.4)]),
+    ],
+)
+def test_resample_cumulative_perDay(engine, input_data, expected):
+    rollup = aggregate.resample(load(input_data), "day")
+    assert rollup.field_names[1].endswith("_sum")
+    assert list(rollup.rows()) == expected
+
+
+def test_resample_unsortedInput(engine):
+    readings = load(HR_INPUT)
+    readings.timestamps.reverse()
+    rollup = aggregate.resample(readings, "hour", reducers=["count"])
+    assert list(rollup.rows()) == [
+        ("2021-04-01 08:00:00", 3),
+        ("2021-04-01 09:00:00", 1),
+    ]
+
+
+@pytest.mark.parametrize("bucket, reducers", [("week", None), ("hour", ["median"])])
+def test_resample_invalidArguments(bucket, reducers):
+    with pytest.raises(ValueError):
+        aggregate.resample(load(HR_INPUT), bucket, reducers)
+
+
+@pytest.mark.parametrize("output_format", ["csv", "json", "sqlite"])
+def test_health_export_rollup(tmp_path, output_format):
+    health = Health(str(tmp_path), output_format, rollup="hour")
+    health.load_from_shortcuts(dict(HR_INPUT))
+    path = health.export()
+
+    if output_format == "sqlite":
+        assert path.endswith("heartbridge.sqlite")
+    else:
+        assert path.endswith(f"heart-rate-per-hour-Apr01-2021.{output_format}")
+
+
+@pytest.mark.parametrize("size", [1, 2, 3])
+def test_health_exportBatches_rollup_shouldMatchExport(tmp_path, size):
+    whole = Health(str(tmp_path / "whole"), "csv", rollup="minute")
+    whole.load_from_shortcuts(dict(HR_INPUT))
+    readings = whole.readings
+    # Batches may split a minute; its samples still make one row:
+    batches = [readings[i : i + size] for i in range(0, len(readings), size)]
+    health = Health(str(tmp_path / "batches"), "csv", rollup="minute")
+    health.reading_type_slug = readings.reading_type
+
+    path = health.export_batches(
+        batches, readings.timestamps[0], readings.timestamps[-1]
+    )
+
+    with open(whole.export()) as expected, open(path) as exported:
+        assert exported.read() == expected.read()
+
+
+def test_columnarBatch_isAbstract():
+    with pytest.raises(TypeError):
+        ColumnarBatch()
+
+
+@pytest.mark.parametrize("output_format", ["csv", "sqlite"])
+def test_endpoint_readings_rollup_shouldRaise400(tmp_path, monkeypatch, output_format):
+    health = Health(str(tmp_path), output_format, rollup="hour")
+    health.load_from_shortcuts(dict(HR_INPUT))
+    health.export()
+    monkeypatch.setattr(app.state, "OUTPUT_DIRECTORY", str(tmp_path))
+    monkeypatch.setattr(app.state, "OUTPUT_FORMAT", output_format)
+
+    response = TestClient(app).get("/readings/heart-rate-per-hour")
+
+    assert response.status_code == 400
+    assert "rollups" in response.json()["message"]
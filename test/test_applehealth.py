@@ -0,0 +1,157 @@
+import tracemalloc, zipfile
+import pytest
+from click.testing import CliRunner
+from heartbridge.app import cli
+from heartbridge.applehealth import import_export, iter_batches, iter_records
+from heartbridge.exceptions import LoadingError
+from heartbridge.query import RangeQuery
+
+EXPORT_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE HealthData [
+<!ELEMENT HealthData (ExportDate,Me,(Record|Correlation|Workout)*)>
+<!ATTLIST HealthData locale CDATA #REQUIRED>
+]>
+<HealthData locale="en_CA">
+ <ExportDate value="2021-04-14 09:00:00 -0400"/>
+ <Me HKCharacteristicTypeIdentifierDateOfBirth=""/>
+ <Record type="HKQuantityTypeIdentifierHeartRate" sourceName="Watch" unit="count/min" startDate="2019-12-16 08:24:36 -0500" endDate="2019-12-16 08:24:36 -0500" value="74">
+  <MetadataEntry key="HKMetadataKeyHeartRateMotionContext" value="0"/>
+ </Record>
+ <Record type="HKQuantityTypeIdentifierHeartRate" sourceName="Watch" unit="count/min" startDate="2019-12-16 09:32:17 -0500" endDate="2019-12-16 09:32:17 -0500" value="83"/>
+ <Record type="HKQuantityTypeIdentifierHeartRate" sourceName="Watch" unit="count/min" startDate="2019-12-17 10:00:00 -0500" endDate="2019-12-17 10:00:00 -0500" value="91"/>
+ <Record type="HKQuantityTypeIdentifierStepCount" sourceName="iPhone" unit="count" startDate="2021-04-10 09:20:10 -0400" endDate="2021-04-10 09:25:10 -0400" value="34"/>
+ <Record type="HKQuantityTypeIdentifierBodyMass" sourceName="Scale" unit="kg" startDate="2021-04-10 07:00:00 -0400" endDate="2021-04-10 07:00:00 -0400" value="70"/>
+ <Correlation type="HKCorrelationTypeIdentifierBloodPressure" startDate="2021-04-10 07:00:00 -0400" endDate="2021-04-10 07:00:00 -0400">
+  <Record type="HKQuantityTypeIdentifierHeartRate" sourceName="Cuff" unit="count/min" startDate="2021-04-10 07:00:00 -0400" endDate="2021-04-10 07:00:00 -0400" value="60"/>
+ </Correlation>
+</HealthData>
+"""
+
+
+@pytest.fixture(params=["xml", "zip"])
+def export_path(request, tmp_path):
+    if request.param == "xml":
+        path = tmp_path / "export.xml"
+        path.write_text(EXPORT_XML)
+    else:
+        path = tmp_path / "export.zip"
+        with zipfile.ZipFile(path, "w") as archive:
+            archive.writestr("apple_health_export/export.xml", EXPORT_XML)
+    return path
+
+
+def test_iter_records(export_path):
+    records = list(iter_records(export_path))
+    assert records == [
+        ("heart-rate", 1576484676, 74.0),
+        ("heart-rate", 1576488737, 83.0),
+        ("heart-rate", 1576576800, 91.0),
+        ("steps", 1618046410, 34.0),
+    ]
+
+
+def test_iter_records_filters(export_path):
+    records = list(
+        iter_records(
+            export_path, types={"heart-rate"}, start=1576488737, end=1576576800
+        )
+    )
+    assert records == [("heart-rate", 1576488737, 83.0)]
+
+
+def test_iter_batches_chunksOnDayBoundaries(export_path):
+    batches = list(iter_batches(export_path, types={"heart-rate"}, chunk_size=1))
+    # The first two samples are on the same day, so they stay in one batch:
+    assert [list(batch.timestamps) for batch in batches] == [
+        [1576484676, 1576488737],
+        [1576576800],
+    ]
+    assert list(batches[0].values) == [74, 83]
+
+
+def test_iter_records_invalidXml_shouldRaise(tmp_path):
+    path = tmp_path / "export.xml"
+    path.write_text("<HealthData><Record")
+    with pytest.raises(LoadingError):
+        list(iter_records(path))
+
+
+def test_iter_records_constantMemory(tmp_path):
+    record = (
+        '<Record type="HKQuantityTypeIdentifierHeartRate" unit="count/min" '
+        'startDate="2019-12-16 08:24:36 -0500" value="74"/>\n'
+    )
+    path = tmp_path / "export.xml"
+    with open(path, "w") as export_file:
+        export_file.write("<HealthData>\n")
+        for _ in range(50_000):
+            export_file.write(record)
+        export_file.write("</HealthData>\n")
+
+    tracemalloc.start()
+    try:
+        count = sum(1 for _ in iter_records(path))
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert count == 50_000
+    assert peak < 2 * 1024 * 1024
+
+
+def test_import_export(export_path, tmp_path):
+    summary = import_export(export_path, str(tmp_path / "out"), "csv")
+    assert summary["heart-rate"]["samples"] == 3
+    assert summary["steps"]["samples"] == 1
+    assert (tmp_path / "out/heart-rate-Dec16-2019-Dec17-2019.csv").exists()
+    assert (tmp_path / "out/steps-Apr10-2021.csv").exists()
+
+
+def test_import_export_interleavedSources(tmp_path):
+    def record(source, date, value):
+        return (
+            f'<Record type="HKQuantityTypeIdentifierHeartRate" sourceName="{source}" '
+            f'unit="count/min" startDate="{date} -0400" value="{value}"/>\n'
+        )
+
+    path = tmp_path / "export.xml"
+    path.write_text(
+        "<HealthData>\n"
+        + record("Watch", "2021-04-02 06:00:00", 70)
+        + record("Watch", "2021-04-05 06:00:00", 72)
+        + record("iPhone", "2021-04-01 06:00:00", 80)
+        + record("iPhone", "2021-04-03 06:00:00", 82)
+        + "</HealthData>\n"
+    )
+
+    import_export(path, str(tmp_path / "out"), "csv")
+
+    exported = tmp_path / "out/heart-rate-Apr01-2021-Apr05-2021.csv"
+    assert exported.read_text().splitlines()[1:] == [
+        "2021-04-01 06:00:00,80",
+        "2021-04-02 06:00:00,70",
+        "2021-04-03 06:00:00,82",
+        "2021-04-05 06:00:00,72",
+    ]
+    query = RangeQuery(tmp_path / "out", "csv", "heart-rate", end=1617321600)
+    assert [value for _, value in query.rows()] == [80]
+
+
+def test_cli_import(export_path, tmp_path):
+    result = CliRunner().invoke(
+        cli,
+        [
+            "import",
+            str(export_path),
+            "--directory",
+            str(tmp_path / "out"),
+            "--type",
+            "sqlite",
+            "--record-type",
+            "steps",
+            "--start",
+            "2021-01-01",
+        ],
+    )
+    assert result.exit_code == 0, result.output
+    assert "Imported 1 steps samples" in result.output
+    assert (tmp_path / "out/heartbridge.sqlite").exists()
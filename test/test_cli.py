@@ -0,0 +1,124 @@
+import json, os
+import pytest
+from click.testing import CliRunner
+from heartbridge import app as heartbridge_app
+
+
+@pytest.fixture
+def runs(monkeypatch):
+    """Arguments of every `uvicorn.run` call, without running the server."""
+    runs = []
+    monkeypatch.setattr(
+        heartbridge_app.uvicorn,
+        "run",
+        lambda app, **kwargs: runs.append(dict(kwargs, app=app)),
+    )
+    # Restore every setting the CLI changes once the test is done:
+    for setting in (
+        "OUTPUT_DIRECTORY",
+        "OUTPUT_FORMAT",
+        "ROLLUP",
+        "STREAMING_INGEST",
+        "EXECUTOR",
+        "SPOOL_DIRECTORY",
+        "MAX_DECOMPRESSED_SIZE",
+        "METRICS",
+        "LOG_METRICS",
+        "DROP_INVALID",
+        "UPLOAD_CACHE",
+        "PARTITION",
+        "RUN_ID",
+        "SUMMARY",
+        "GAP_THRESHOLD",
+        "MAX_BODY_SIZE",
+        "MAX_SAMPLES",
+        "ADMISSION",
+    ):
+        monkeypatch.setattr(
+            heartbridge_app.app.state,
+            setting,
+            getattr(heartbridge_app.app.state, setting),
+        )
+    # Set first, so the variable the CLI sets is removed again afterwards:
+    monkeypatch.setenv(heartbridge_app.SETTINGS_VARIABLE, "")
+    monkeypatch.delenv(heartbridge_app.SETTINGS_VARIABLE)
+    return runs
+
+
+def test_cli_setsAppState(tmp_path, runs):
+    result = CliRunner().invoke(
+        heartbridge_app.cli,
+        [
+            "--directory",
+            str(tmp_path),
+            "--type",
+            "json",
+            "--rollup",
+            "hour",
+            "--port",
+            "9999",
+            "--max-decompressed-size",
+            "64",
+            "--metrics",
+            "--drop-invalid",
+            "--dedup",
+            "--partition",
+            "--summary",
+            "--gap-threshold",
+            "15",
+            "--max-body-size",
+            "32",
+            "--max-samples",
+            "100000",
+            "--max-concurrent-uploads",
+            "2",
+            "--max-queued-uploads",
+            "8",
+        ],
+    )
+
+    assert result.exit_code == 0, result.output
+    assert runs[0]["port"] == 9999
+    assert heartbridge_app.app.state.OUTPUT_FORMAT == "json"
+    assert heartbridge_app.app.state.ROLLUP == "hour"
+    assert heartbridge_app.app.state.MAX_DECOMPRESSED_SIZE == 64 * 1024 * 1024
+    assert heartbridge_app.app.state.METRICS is not None
+    assert heartbridge_app.app.state.DROP_INVALID is True
+    assert heartbridge_app.app.state.UPLOAD_CACHE is not None
+    assert heartbridge_app.app.state.PARTITION is True
+    assert heartbridge_app.app.state.RUN_ID is not None
+    assert heartbridge_app.app.state.SUMMARY is True
+    assert heartbridge_app.app.state.GAP_THRESHOLD == 15 * 60
+    assert heartbridge_app.app.state.MAX_BODY_SIZE == 32 * 1024 * 1024
+    assert heartbridge_app.app.state.MAX_SAMPLES == 100000
+    assert heartbridge_app.app.state.ADMISSION.max_concurrent == 2
+    assert heartbridge_app.app.state.ADMISSION.max_queued == 8
+
+
+def test_cli_workers_shouldConfigureEachWorker(tmp_path, runs):
+    result = CliRunner().invoke(
+        heartbridge_app.cli,
+        ["--directory", str(tmp_path), "--type", "json", "--workers", "4"],
+    )
+
+    assert result.exit_code == 0, result.output
+    assert runs[0]["app"] == "heartbridge.app:create_app"
+    assert runs[0]["factory"] is True
+    assert runs[0]["workers"] == 4
+    # Worker processes are configured from the environment:
+    assert heartbridge_app.create_app() is heartbridge_app.app
+    assert heartbridge_app.app.state.OUTPUT_DIRECTORY == str(tmp_path)
+    assert heartbridge_app.app.state.OUTPUT_FORMAT == "json"
+    assert (
+        heartbridge_app.app.state.RUN_ID
+        == json.loads(os.environ[heartbridge_app.SETTINGS_VARIABLE])["run_id"]
+    )
+    heartbridge_app.app.state.EXECUTOR.shutdown()
+
+
+def test_cli_noArguments_shouldStartServer(runs):
+    result = CliRunner().invoke(heartbridge_app.cli, [])
+
+    assert result.exit_code == 0, result.output
+    assert runs[0]["port"] == 8888
+    assert heartbridge_app.app.state.SPOOL_DIRECTORY is None
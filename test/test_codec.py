@@ -0,0 +1,51 @@
+import json
+import pytest
+from starlette.testclient import TestClient
+from heartbridge import codec
+from heartbridge.app import app
+import test.sample_inputs as samples
+
+
+@pytest.fixture(params=codec.available_codecs())
+def json_codec(request, monkeypatch):
+    selected = codec.get_codec(request.param)
+    monkeypatch.setattr(codec, "codec", selected)
+    return selected
+
+
+@pytest.mark.parametrize(
+    "body", [b'{"a": [1, "\\u00e9"]}', bytearray(b'{"a": [1, "\xc3\xa9"]}')]
+)
+def test_codec_loads(json_codec, body):
+    assert codec.loads(body) == {"a": [1, "é"]}
+
+
+def test_codec_loads_withBom(json_codec):
+    assert codec.loads(b'\xef\xbb\xbf{"a": 1}') == {"a": 1}
+
+
+def test_codec_loads_invalid_shouldRaiseJSONDecodeError(json_codec):
+    with pytest.raises(json.JSONDecodeError):
+        codec.loads(b'{"a": ')
+
+
+def test_codec_dumps(json_codec):
+    encoded = codec.dumps({"message": "café", "values": [1, 2.5, float("nan")]})
+    assert json.loads(encoded) == {"message": "café", "values": [1, 2.5, None]}
+    assert b" " not in encoded
+
+
+def test_get_codec_unknown_shouldRaise():
+    with pytest.raises(ValueError):
+        codec.get_codec("yaml")
+
+
+def test_endpoint_withEachCodec(tmp_path, json_codec):
+    app.state.OUTPUT_DIRECTORY = str(tmp_path)
+    app.state.OUTPUT_FORMAT = "json"
+
+    response = TestClient(app).post("/", json=samples.HR_TYPICAL_INPUT)
+
+    assert response.json()["message"] == "Data exported successfully"
+    exported = json.loads((tmp_path / "heart-rate-Dec16-2019.json").read_text())
+    assert len(exported) == len(samples.HR_TYPICAL_INPUT["values"])
@@ -0,0 +1,71 @@
+import gzip, json, zlib
+import pytest
+from heartbridge.compression import BodyDecompressor
+from heartbridge.exceptions import BodyTooLargeError, LoadingError
+import test.sample_inputs as samples
+
+BODY = json.dumps(samples.HR_TYPICAL_INPUT).encode()
+
+
+def decompress_in_chunks(decompressor, body: bytes, chunk_size: int) -> bytes:
+    pieces = []
+    for i in range(0, len(body), chunk_size):
+        pieces.extend(decompressor.decompress(body[i : i + chunk_size]))
+    pieces.extend(decompressor.flush())
+    return b"".join(pieces)
+
+
+def raw_deflate(data: bytes) -> bytes:
+    compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+@pytest.mark.parametrize("chunk_size", [1, 16, 65536])
+@pytest.mark.parametrize(
+    "encoding, compress",
+    [
+        (None, lambda data: data),
+        ("identity", lambda data: data),
+        ("gzip", gzip.compress),
+        ("GZIP", gzip.compress),
+        ("deflate", zlib.compress),
+        ("deflate", raw_deflate),
+    ],
+)
+def test_decompressor_roundTrip(encoding, compress, chunk_size):
+    decompressor = BodyDecompressor(encoding)
+    assert decompress_in_chunks(decompressor, compress(BODY), chunk_size) == BODY
+
+
+def test_decompressor_rawDeflate_withZlibLikeHeader():
+    # A stored block's header is 0x01 and the low byte of its length, which
+    # makes a multiple of 31 for a length of 23 (mod 256 and 31):
+    body = BODY + b" " * ((23 - len(BODY)) % 256)
+    compressor = zlib.compressobj(level=0, wbits=-zlib.MAX_WBITS)
+    compressed = compressor.compress(body) + compressor.flush()
+    assert (compressed[0] << 8 | compressed[1]) % 31 == 0
+
+    decompressor = BodyDecompressor("deflate")
+    assert decompress_in_chunks(decompressor, compressed, 1) == body
+
+
+def test_decompressor_limitsDecompressedSize():
+    bomb = gzip.compress(b" " * (10 * 1024 * 1024))
+    decompressor = BodyDecompressor("gzip", max_size=1024 * 1024)
+    with pytest.raises(BodyTooLargeError):
+        decompress_in_chunks(decompressor, bomb, 1024)
+    assert decompressor.size <= 1024 * 1024 + 256 * 1024
+
+
+@pytest.mark.parametrize(
+    "encoding, body",
+    [
+        ("br", BODY),
+        ("gzip", BODY),
+        ("gzip", gzip.compress(BODY)[:-10]),
+        ("gzip", gzip.compress(BODY) + b"garbage"),
+    ],
+)
+def test_decompressor_invalidBody_shouldRaise(encoding, body):
+    with pytest.raises(LoadingError):
+        decompress_in_chunks(BodyDecompressor(encoding), body, 7)
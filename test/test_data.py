@@ -0,0 +1,74 @@
+import pytest
+from datetime import datetime
+from heartbridge import Health, data
+from heartbridge.data import (
+    HeartRateReading,
+    HeartRateVariabilityReading,
+    ReadingBatch,
+    datetime_to_epoch,
+    epoch_to_datetime,
+)
+import test.sample_inputs as samples
+
+
+def test_epoch_roundtrip():
+    timestamp = datetime(2019, 12, 16, 8, 24, 36)
+    assert epoch_to_datetime(datetime_to_epoch(timestamp)) == timestamp
+
+
+def test_reading_batch_lazyView():
+    health = Health()
+    health.load_from_shortcuts(samples.HR_TYPICAL_INPUT)
+    batch = health.readings
+
+    assert isinstance(batch, ReadingBatch)
+    assert batch.values.typecode == "q"
+    assert batch[3] == HeartRateReading(
+        timestamp=datetime(2019, 12, 16, 16, 13, 35), value=157
+    )
+    assert batch[-1].to_dict() == {"timestamp": "2019-12-16 23:56:25", "heart_rate": 80}
+    assert [r.heart_rate for r in batch[1:3]] == [83, 89]
+
+
+def test_reading_batch_rows():
+    health = Health()
+    health.load_from_shortcuts(samples.HRV_INPUT)
+
+    assert health.readings.field_names == ["timestamp", "heart_rate_variability"]
+    assert list(health.readings.rows())[0] == ("2021-04-05 08:05:20", 56.8)
+
+
+def test_reading_batch_fromReadings():
+    readings = [
+        HeartRateVariabilityReading(
+            timestamp=datetime(2021, 4, 5, 8, 5, 20), value=56.8
+        ),
+        HeartRateVariabilityReading(
+            timestamp=datetime(2021, 4, 8, 13, 45, 10), value=55.2
+        ),
+    ]
+    batch = ReadingBatch.from_readings(readings)
+    assert batch.reading_cls is HeartRateVariabilityReading
+    assert list(batch) == readings
+    assert ReadingBatch.from_readings(batch) is batch
+
+
+def test_reading_batch_mismatchedLengths():
+    with pytest.raises(ValueError):
+        ReadingBatch(HeartRateReading, [1, 2], [60])
+
+
+@pytest.mark.parametrize("engine", ["python", "numpy"])
+def test_reading_batch_sorted(engine, monkeypatch):
+    if engine == "numpy":
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(data, "numpy", None)
+    batch = ReadingBatch(HeartRateReading, [30, 10, 20, 10], [3, 1, 2, 4])
+
+    assert list(batch.sorted().timestamps) == [10, 10, 20, 30]
+    assert list(batch.sorted().values) == [1, 4, 2, 3]
+    unique = batch.sorted(unique=True)
+    assert (list(unique.timestamps), list(unique.values)) == ([10, 20, 30], [4, 2, 3])
+    assert unique.values.typecode == "q"
+    assert unique.sorted() is unique
@@ -0,0 +1,194 @@
+import sqlite3
+from heartbridge import Health, dedup
+
+DAY_ONE = {
+    "type": "Steps",
+    "dates": ["2021-04-10 09:00:00", "2021-04-10 10:00:00"],
+    "values": ["10", "20"],
+}
+DAYS_ONE_TO_TWO = {
+    "type": "Steps",
+    "dates": [
+        "2021-04-10 09:00:00",
+        "2021-04-10 10:00:00",
+        "2021-04-11 09:00:00",
+        "2021-04-11 10:00:00",
+    ],
+    "values": ["10", "20", "30", "40"],
+}
+
+
+def load(data, output_dir, output_format="csv", rollup=None, partition=False):
+    health = Health(
+        output_dir=str(output_dir),
+        output_format=output_format,
+        rollup=rollup,
+        partition=partition,
+    )
+    health.load_from_shortcuts(
+        {
+            key: list(value) if isinstance(value, list) else value
+            for key, value in data.items()
+        }
+    )
+    return health
+
+
+def export(cache, health):
+    """Exports like `heartbridge.app.export_health` does."""
+    key = cache.digest(health)
+    previous = cache.lookup(key)
+    if previous is not None:
+        return previous, None
+    new = cache.new_samples(health)
+    health.readings = new
+    file = health.export()
+    cache.add(key, health, new, file)
+    return file, new
+
+
+def test_cache_identicalUpload_shouldReturnPreviousFile(tmp_path):
+    cache = dedup.UploadCache()
+    file, _ = export(cache, load(DAY_ONE, tmp_path))
+
+    assert export(cache, load(DAY_ONE, tmp_path)) == (file, None)
+
+
+def test_cache_differentScope_shouldNotMatch(tmp_path):
+    cache = dedup.UploadCache()
+    export(cache, load(DAY_ONE, tmp_path))
+
+    assert cache.lookup(cache.digest(load(DAY_ONE, tmp_path, "json"))) is None
+
+
+def test_cache_overlappingUpload_shouldExportNewSamplesOnly(tmp_path, engine):
+    cache = dedup.UploadCache()
+    export(cache, load(DAY_ONE, tmp_path))
+
+    file, new = export(cache, load(DAYS_ONE_TO_TWO, tmp_path))
+
+    assert list(new.values) == [30, 40]
+    assert file.endswith("steps-Apr11-2021.csv")
+    assert (tmp_path / "steps-Apr10-2021.csv").exists()
+
+
+def test_cache_overlappingUpload_sameFile_shouldExportEverything(tmp_path, engine):
+    cache = dedup.UploadCache()
+    export(cache, load(DAY_ONE, tmp_path))
+    same_day = dict(DAY_ONE)
+    same_day["dates"] = DAY_ONE["dates"] + ["2021-04-10 11:00:00"]
+    same_day["values"] = DAY_ONE["values"] + ["5"]
+
+    _, new = export(cache, load(same_day, tmp_path))
+
+    # Only exporting the 11:00 sample would overwrite the file with the others:
+    assert list(new.values) == [10, 20, 5]
+
+
+def test_cache_sqlite_shouldSkipExportedSamples(tmp_path, engine):
+    cache = dedup.UploadCache()
+    export(cache, load(DAY_ONE, tmp_path, "sqlite"))
+    same_day = dict(DAY_ONE)
+    same_day["dates"] = ["2021-04-10 08:00:00"] + DAY_ONE["dates"]
+    same_day["values"] = ["5"] + DAY_ONE["values"]
+
+    _, new = export(cache, load(same_day, tmp_path, "sqlite"))
+
+    assert list(new.values) == [5]
+
+
+def test_cache_partitioned_shouldSkipExportedSamples(tmp_path, engine):
+    cache = dedup.UploadCache()
+    export(cache, load(DAY_ONE, tmp_path, partition=True))
+    same_day = dict(DAY_ONE)
+    same_day["dates"] = DAY_ONE["dates"] + ["2021-04-10 11:00:00"]
+    same_day["values"] = DAY_ONE["values"] + ["5"]
+
+    _, new = export(cache, load(same_day, tmp_path, partition=True))
+
+    assert list(new.values) == [5]
+    rows = (tmp_path / "steps/2021/04/10.csv").read_text().splitlines()
+    assert len(rows) == 4
+
+
+def test_cache_lateSample_shouldBeExported(tmp_path, engine):
+    cache = dedup.UploadCache()
+    export(cache, load(DAY_ONE, tmp_path, "sqlite"))
+    late = dict(DAY_ONE)
+    late["dates"] = [DAY_ONE["dates"][0], "2021-04-10 09:30:00", DAY_ONE["dates"][1]]
+    late["values"] = ["10", "15", "20"]
+
+    _, new = export(cache, load(late, tmp_path, "sqlite"))
+
+    # 09:30 falls inside the range already exported, but wasn't stored:
+    assert list(new.values) == [15]
+
+
+def test_cache_correctedValue_shouldBeExported(tmp_path, engine):
+    cache = dedup.UploadCache()
+    export(cache, load(DAY_ONE, tmp_path, "sqlite"))
+    corrected = dict(DAY_ONE)
+    corrected["values"] = ["10", "25"]
+
+    _, new = export(cache, load(corrected, tmp_path, "sqlite"))
+
+    assert list(new.values) == [25]
+    with sqlite3.connect(tmp_path / "heartbridge.sqlite") as connection:
+        rows = connection.execute(
+            "SELECT step_count FROM steps ORDER BY timestamp"
+        ).fetchall()
+    assert rows == [(10,), (25,)]
+
+
+def test_cache_rollup_shouldExportEverything(tmp_path):
+    cache = dedup.UploadCache()
+    export(cache, load(DAY_ONE, tmp_path, rollup="day"))
+
+    _, new = export(cache, load(DAYS_ONE_TO_TWO, tmp_path, rollup="day"))
+
+    assert len(new) == 4
+
+
+def test_cache_changedFile_shouldBeForgotten(tmp_path):
+    cache = dedup.UploadCache()
+    file, _ = export(cache, load(DAY_ONE, tmp_path))
+    with open(file, "a") as export_file:
+        export_file.write("2021-04-10 11:00:00,1\n")
+
+    assert cache.lookup(cache.digest(load(DAY_ONE, tmp_path))) is None
+
+
+def test_cache_shouldEvictLeastRecentlyUsed(tmp_path):
+    cache = dedup.UploadCache(max_entries=1)
+    export(cache, load(DAY_ONE, tmp_path))
+    export(cache, load(DAYS_ONE_TO_TWO, tmp_path, "json"))
+
+    assert len(cache) == 1
+    assert cache.lookup(cache.digest(load(DAY_ONE, tmp_path))) is None
+
+
+def test_cache_persistence(tmp_path):
+    cache_path = tmp_path / "cache.json"
+    file, _ = export(dedup.UploadCache(path=cache_path), load(DAY_ONE, tmp_path))
+
+    reloaded = dedup.UploadCache(path=cache_path)
+
+    assert reloaded.lookup(reloaded.digest(load(DAY_ONE, tmp_path))) == file
+
+
+def test_cache_sharedFile_shouldMergeEntries(tmp_path):
+    """Server worker processes share the cache file, each with its own cache."""
+    cache_path = tmp_path / "cache.json"
+    first, second = dedup.UploadCache(path=cache_path), dedup.UploadCache(
+        path=cache_path
+    )
+    day_one, _ = export(first, load(DAY_ONE, tmp_path))
+    days_one_to_two, _ = export(second, load(DAYS_ONE_TO_TWO, tmp_path, "json"))
+
+    reloaded = dedup.UploadCache(path=cache_path)
+
+    assert reloaded.lookup(reloaded.digest(load(DAY_ONE, tmp_path))) == day_one
+    assert (
+        reloaded.lookup(reloaded.digest(load(DAYS_ONE_TO_TWO, tmp_path, "json")))
+        == days_one_to_two
+    )
@@ -1,7 +1,9 @@
 from starlette.testclient import TestClient
-from heartbridge.app import app
+from heartbridge.admission import AdmissionControl
+from heartbridge.app import app, make_executor
+from heartbridge.dedup import UploadCache
 import test.sample_inputs as samples
-import pathlib
+import asyncio, gzip, json, pathlib, zlib
 import pytest
 
 
@@ -71,3 +73,449 @@ def test_endpoint_validationError_shouldRaise422(tmp_path):
     client = TestClient(app)
     response = client.post("/", json=data)
     assert response.status_code == 422
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_endpoint_invalidSamples_shouldListErrors(tmp_path, monkeypatch, streaming):
+    app.state.OUTPUT_DIRECTORY = str(tmp_path)
+    app.state.OUTPUT_FORMAT = "csv"
+    monkeypatch.setattr(app.state, "STREAMING_INGEST", streaming)
+    data = {
+        "type": "Heart Rate",
+        "dates": ["2020-03-20 09:40:22", "2020-03-20 09:41", "2020-03-20 09:42:22"],
+        "values": ["70", "71", "-5"],
+    }
+
+    response = TestClient(app).post("/", json=data)
+
+    assert response.status_code == 422
+    assert response.json()["invalid_samples"] == 2
+    assert [error["index"] for error in response.json()["errors"]] == [1, 2]
+    assert not list(tmp_path.glob("*.csv"))
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_endpoint_dropInvalid_shouldExportTheRest(tmp_path, monkeypatch, streaming):
+    app.state.OUTPUT_DIRECTORY = str(tmp_path)
+    app.state.OUTPUT_FORMAT = "csv"
+    monkeypatch.setattr(app.state, "STREAMING_INGEST", streaming)
+    monkeypatch.setattr(app.state, "DROP_INVALID", True)
+    data = {
+        "type": "Heart Rate",
+        "dates": ["2020-03-20 09:40:22", "2020-03-20 09:41:22"],
+        "values": ["70", "abc"],
+    }
+
+    response = TestClient(app).post("/", json=data)
+
+    assert response.status_code == 200
+    assert response.json()["dropped_samples"] == 1
+    assert response.json()["errors"][0]["field"] == "values"
+    rows = (tmp_path / "heart-rate-Mar20-2020.csv").read_text().splitlines()
+    assert len(rows) == 2
+
+
+def test_endpoint_dedup_shouldNotExportTwice(tmp_path, monkeypatch):
+    app.state.OUTPUT_DIRECTORY = str(tmp_path)
+    app.state.OUTPUT_FORMAT = "csv"
+    monkeypatch.setattr(app.state, "UPLOAD_CACHE", UploadCache())
+    client = TestClient(app)
+
+    first = client.post("/", json=samples.HR_TYPICAL_INPUT)
+    exported = tmp_path / "heart-rate-Dec16-2019.csv"
+    mtime = exported.stat().st_mtime_ns
+    second = client.post("/", json=samples.HR_TYPICAL_INPUT)
+
+    assert first.status_code == second.status_code == 200
+    assert second.json()["duplicate"] is True
+    assert second.json()["file"] == first.json()["file"] == str(exported.resolve())
+    assert exported.stat().st_mtime_ns == mtime
+
+
+@pytest.mark.parametrize(
+    "input_data, status_code",
+    [
+        (samples.HR_TYPICAL_INPUT, 200),
+        (samples.HR_ONE_ITEM_INPUT, 200),
+        ({"dates": [], "values": []}, 400),
+        ({"type": "Heart Rate", "dates": ["2020-03-20 09:40:22"]}, 422),
+    ],
+)
+def test_endpoint_streamingIngest(tmp_path, monkeypatch, input_data, status_code):
+    app.state.OUTPUT_DIRECTORY = str(tmp_path)
+    app.state.OUTPUT_FORMAT = "csv"
+    monkeypatch.setattr(app.state, "STREAMING_INGEST", True)
+
+    client = TestClient(app)
+    response = client.post("/", json=input_data)
+
+    assert response.status_code == status_code
+    if status_code == 200:
+        assert (tmp_path / "heart-rate-Dec16-2019.csv").exists()
+
+
+def test_endpoint_streamingIngest_invalidJson_shouldRaise400(tmp_path, monkeypatch):
+    app.state.OUTPUT_DIRECTORY = str(tmp_path)
+    app.state.OUTPUT_FORMAT = "csv"
+    monkeypatch.setattr(app.state, "STREAMING_INGEST", True)
+
+    client = TestClient(app)
+    response = client.post("/", content=b'{"type": "Heart Rate", "dates": [')
+
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("pool", ["thread", "process"])
+def test_endpoint_executorPool(tmp_path, monkeypatch, pool):
+    app.state.OUTPUT_DIRECTORY = str(tmp_path)
+    app.state.OUTPUT_FORMAT = "json"
+    executor = make_executor(pool, max_workers=2)
+    monkeypatch.setattr(app.state, "EXECUTOR", executor)
+
+    client = TestClient(app)
+    try:
+        valid = client.post("/", json=samples.STEPS_INPUT)
+        invalid = client.post("/", json={"type": "Steps", "dates": []})
+        invalid_value = client.post(
+            "/",
+            json={"type": "Steps", "dates": ["2021-04-10 08:00:00"], "values": ["abc"]},
+        )
+        not_json = client.post("/", content=b"{")
+        # The pool still works after a worker raised a SampleValidationError:
+        valid_again = client.post("/", json=samples.STEPS_INPUT)
+    finally:
+        executor.shutdown()
+
+    assert valid.status_code == 200
+    assert (tmp_path / "steps-Apr10-2021.json").exists()
+    assert invalid.status_code == 422
+    assert invalid_value.status_code == 422
+    assert invalid_value.json()["errors"][0]["value"] == "abc"
+    assert not_json.status_code == 400
+    assert valid_again.status_code == 200
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+@pytest.mark.parametrize(
+    "input_data, expected_files",
+    [
+        (
+            samples.BATCH_LIST_INPUT,
+            [
+                "heart-rate-Dec16-2019",
+                "steps-Apr10-2021",
+                "heart-rate-variability-Apr05-2021-Apr10-2021",
+            ],
+        ),
+        (
+            samples.BATCH_DICT_INPUT,
+            ["resting-heart-rate-Apr10-2021-Apr12-2021", "steps-Apr10-2021"],
+        ),
+    ],
+)
+def test_endpoint_batch_shouldExportEveryType(
+    tmp_path, monkeypatch, streaming, input_data, expected_files
+):
+    app.state.OUTPUT_DIRECTORY = str(tmp_path)
+    app.state.OUTPUT_FORMAT = "csv"
+    monkeypatch.setattr(app.state, "STREAMING_INGEST", streaming)
+
+    client = TestClient(app)
+    response = client.post("/", json=input_data)
+
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [result["status_code"] for result in results] == [200] * len(expected_files)
+    for name in expected_files:
+        assert (tmp_path / "{}.csv".format(name)).exists()
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_endpoint_batch_partialFailure_shouldReturn207(
+    tmp_path, monkeypatch, streaming
+):
+    app.state.OUTPUT_DIRECTORY = str(tmp_path)
+    app.state.OUTPUT_FORMAT = "json"
+    monkeypatch.setattr(app.state, "STREAMING_INGEST", streaming)
+    data = [
+        samples.STEPS_INPUT,
+        {"type": "Heart Rate", "dates": ["2020-03-20 09:40:22"]},
+        {"type": "Flights Climbed", "dates": [], "values": []},
+    ]
+
+    client = TestClient(app)
+    response = client.post("/", json=data)
+
+    assert response.status_code == 207
+    results = response.json()["results"]
+    assert [result["status_code"] for result in results] == [200, 422, 400]
+    assert results[0]["samples"] == 3
+    assert (tmp_path / "steps-Apr10-2021.json").exists()
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_endpoint_emptyBatch_shouldRaise400(tmp_path, monkeypatch, streaming):
+    app.state.OUTPUT_DIRECTORY = str(tmp_path)
+    monkeypatch.setattr(app.state, "STREAMING_INGEST", streaming)
+
+    client = TestClient(app)
+    response = client.post("/", json=[])
+
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+@pytest.mark.parametrize(
+    "encoding, compress", [("gzip", gzip.compress), ("deflate", zlib.compress)]
+)
+def test_endpoint_compressedBody(tmp_path, monkeypatch, streaming, encoding, compress):
+    app.state.OUTPUT_DIRECTORY = str(tmp_path)
+    app.state.OUTPUT_FORMAT = "csv"
+    monkeypatch.setattr(app.state, "STREAMING_INGEST", streaming)
+    body = compress(json.dumps(samples.HR_TYPICAL_INPUT).encode())
+
+    client = TestClient(app)
+    response = client.post("/", content=body, headers={"Content-Encoding": encoding})
+
+    assert response.status_code == 200
+    assert (tmp_path / "heart-rate-Dec16-2019.csv").exists()
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_endpoint_compressedBody_tooLarge_shouldRaise413(
+    tmp_path, monkeypatch, streaming
+):
+    app.state.OUTPUT_DIRECTORY = str(tmp_path)
+    monkeypatch.setattr(app.state, "STREAMING_INGEST", streaming)
+    monkeypatch.setattr(app.state, "MAX_DECOMPRESSED_SIZE", 100)
+    body = gzip.compress(json.dumps(samples.HR_TYPICAL_INPUT).encode())
+
+    client = TestClient(app)
+    response = client.post("/", content=body, headers={"Content-Encoding": "gzip"})
+
+    assert response.status_code == 413
+
+
+def test_endpoint_corruptCompressedBody_shouldRaise400(tmp_path):
+    app.state.OUTPUT_DIRECTORY = str(tmp_path)
+
+    client = TestClient(app)
+    response = client.post("/", content=b"{}", headers={"Content-Encoding": "gzip"})
+
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_endpoint_summary_shouldBeReturnedAndSaved(tmp_path, monkeypatch, streaming):
+    app.state.OUTPUT_DIRECTORY = str(tmp_path)
+    app.state.OUTPUT_FORMAT = "csv"
+    monkeypatch.setattr(app.state, "STREAMING_INGEST", streaming)
+    monkeypatch.setattr(app.state, "SUMMARY", True)
+    monkeypatch.setattr(app.state, "GAP_THRESHOLD", 4 * 3600)
+
+    response = TestClient(app).post("/", json=samples.HR_TYPICAL_INPUT)
+
+    summary = response.json()["summary"]
+    assert response.status_code == 200
+    assert (summary["samples"], summary["min"], summary["max"]) == (6, 74, 157)
+    assert summary["gaps"] == [
+        {
+            "start": "2019-12-16 09:32:17",
+            "end": "2019-12-16 14:53:35",
+            "seconds": 19278,
+        },
+        {
+            "start": "2019-12-16 19:23:28",
+            "end": "2019-12-16 23:56:25",
+            "seconds": 16377,
+        },
+    ]
+    saved = tmp_path / "heart-rate-Dec16-2019.stats.json"
+    assert json.loads(saved.read_text()) == summary
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_endpoint_bodyTooLarge_shouldRaise413(tmp_path, monkeypatch, streaming):
+    app.state.OUTPUT_DIRECTORY = str(tmp_path)
+    monkeypatch.setattr(app.state, "STREAMING_INGEST", streaming)
+    monkeypatch.setattr(app.state, "MAX_BODY_SIZE", 100)
+    body = json.dumps(samples.HR_TYPICAL_INPUT).encode()
+
+    client = TestClient(app)
+    response = client.post("/", content=body)
+    # Without a Content-Length header:
+    chunked = client.post("/", content=iter([body[:50], body[50:]]))
+
+    assert response.status_code == chunked.status_code == 413
+    assert not (tmp_path / "heart-rate-Dec16-2019.csv").exists()
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+@pytest.mark.parametrize(
+    "data",
+    [
+        samples.HR_TYPICAL_INPUT,
+        [samples.STEPS_INPUT, samples.HR_TYPICAL_INPUT],
+    ],
+)
+def test_endpoint_tooManySamples_shouldRaise413(tmp_path, monkeypatch, streaming, data):
+    app.state.OUTPUT_DIRECTORY = str(tmp_path)
+    monkeypatch.setattr(app.state, "STREAMING_INGEST", streaming)
+    monkeypatch.setattr(app.state, "MAX_SAMPLES", 5)
+
+    response = TestClient(app).post("/", json=data)
+
+    assert response.status_code == 413
+    assert response.json()["message"] == "Too many samples were sent"
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.parametrize(
+    "max_queued, status_code",
+    [(0, 429), (1, 503)],
+)
+def test_endpoint_serverBusy_shouldSetRetryAfter(
+    tmp_path, monkeypatch, max_queued, status_code
+):
+    app.state.OUTPUT_DIRECTORY = str(tmp_path)
+    admission = AdmissionControl(1, max_queued=max_queued, queue_timeout=0.01)
+    # Every turn is taken:
+    admission._semaphore = asyncio.Semaphore(0)
+    monkeypatch.setattr(app.state, "ADMISSION", admission)
+
+    response = TestClient(app).post("/", json=samples.HR_TYPICAL_INPUT)
+
+    assert response.status_code == status_code
+    assert int(response.headers["Retry-After"]) >= 1
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_endpoint_uploadSession_shouldResumeAndExport(tmp_path, monkeypatch):
+    app.state.OUTPUT_DIRECTORY = str(tmp_path)
+    app.state.OUTPUT_FORMAT = "csv"
+    monkeypatch.setattr(app.state, "SUMMARY", True)
+    client = TestClient(app)
+    dates, values = (
+        samples.HR_TYPICAL_INPUT["dates"],
+        samples.HR_TYPICAL_INPUT["values"],
+    )
+    chunks = [
+        {"dates": dates[i : i + 2], "values": values[i : i + 2]} for i in (0, 2, 4)
+    ]
+
+    opened = client.post("/uploads", json={"type": "Heart Rate", "chunks": 3})
+    session_url = opened.json()["session_url"]
+    client.post(session_url + "/chunks/0", json=chunks[0])
+    client.post(session_url + "/chunks/2", json=chunks[2])
+    # The transfer was interrupted; the missing chunk is sent again:
+    early_commit = client.post(session_url + "/commit")
+    status = client.get(session_url).json()
+    resent = client.post(session_url + "/chunks/2", json=chunks[2])
+    client.post(session_url + "/chunks/1", json=chunks[1])
+    committed = client.post(session_url + "/commit")
+
+    assert opened.status_code == 201
+    assert early_commit.status_code == 409
+    assert early_commit.json()["missing_chunks"] == [1]
+    assert status["received_chunks"] == [0, 2]
+    assert status["missing_chunks"] == [1]
+    assert resent.json()["duplicate"] is True
+    assert committed.status_code == 200
+    assert committed.json()["samples"] == 6
+    assert committed.json()["summary"]["max"] == 157
+    exported = tmp_path / "heart-rate-Dec16-2019.csv"
+    assert committed.json()["file"] == str(exported.resolve())
+    assert exported.read_text().splitlines()[1:] == [
+        "{},{}".format(date, value) for date, value in zip(dates, values)
+    ]
+    # Committing again returns the same result without exporting again:
+    assert client.post(session_url + "/commit").json() == committed.json()
+    assert client.post(session_url + "/chunks/3", json=chunks[0]).status_code == 409
+
+
+def test_endpoint_uploadSession_chunksOutOfOrder_shouldExportSorted(tmp_path):
+    app.state.OUTPUT_DIRECTORY = str(tmp_path)
+    app.state.OUTPUT_FORMAT = "csv"
+    client = TestClient(app)
+    session_url = client.post("/uploads", json={"type": "Steps"}).json()["session_url"]
+    # The later days are sent first, and both chunks have the Apr 05 sample:
+    client.post(
+        session_url + "/chunks/0",
+        json={
+            "dates": ["2021-04-05 09:00:00", "2021-04-06 09:00:00"],
+            "values": ["50", "60"],
+        },
+    )
+    client.post(
+        session_url + "/chunks/1",
+        json={
+            "dates": [
+                "2021-04-01 09:00:00",
+                "2021-04-02 09:00:00",
+                "2021-04-05 09:00:00",
+            ],
+            "values": ["10", "20", "55"],
+        },
+    )
+
+    committed = client.post(session_url + "/commit")
+
+    assert committed.status_code == 200
+    assert committed.json()["samples"] == 4
+    exported = tmp_path / "steps-Apr01-2021-Apr06-2021.csv"
+    assert committed.json()["file"] == str(exported.resolve())
+    assert client.get("/readings/steps?start=2021-04-02").json() == [
+        {"timestamp": "2021-04-02 09:00:00", "step_count": 20},
+        {"timestamp": "2021-04-05 09:00:00", "step_count": 55},
+        {"timestamp": "2021-04-06 09:00:00", "step_count": 60},
+    ]
+
+
+@pytest.mark.parametrize("chunks", ["3", 3 * 10**7])
+def test_endpoint_uploadSession_invalidChunkCount_shouldRaise400(tmp_path, chunks):
+    app.state.OUTPUT_DIRECTORY = str(tmp_path)
+    client = TestClient(app)
+    session_url = client.post("/uploads", json={"type": "Steps"}).json()["session_url"]
+    client.post(
+        session_url + "/chunks/0",
+        json={"dates": ["2021-04-01 09:00:00"], "values": ["10"]},
+    )
+
+    response = client.post(session_url + "/commit", json={"chunks": chunks})
+
+    assert response.status_code == 400
+    assert client.get(session_url).json()["status"] == "open"
+
+
+def test_endpoint_uploadSession_invalidChunkJson_shouldRaise400(tmp_path):
+    app.state.OUTPUT_DIRECTORY = str(tmp_path)
+    client = TestClient(app)
+    session_url = client.post("/uploads", json={"type": "Steps"}).json()["session_url"]
+
+    response = client.post(
+        session_url + "/chunks/0",
+        content=b'{"dates": ["2021-04-01 09:00:00"], "values": [',
+        headers={"Content-Type": "application/json"},
+    )
+
+    assert response.status_code == 400
+    assert client.get(session_url).json()["received_chunks"] == []
+
+
+def test_endpoint_uploadSession_invalidChunk_shouldRaise422(tmp_path):
+    app.state.OUTPUT_DIRECTORY = str(tmp_path)
+    client = TestClient(app)
+    session_url = client.post("/uploads", json={"type": "Heart Rate"}).json()[
+        "session_url"
+    ]
+
+    response = client.post(
+        session_url + "/chunks/0",
+        json={"dates": ["2020-03-20 09:40:22"], "values": ["abc"]},
+    )
+
+    assert response.status_code == 422
+    assert client.get(session_url).json()["received_chunks"] == []
+    assert client.get("/uploads/" + "0" * 32).status_code == 404
+    assert client.delete(session_url).status_code == 200
+    assert client.get(session_url).status_code == 404
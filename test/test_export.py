@@ -1,7 +1,17 @@
-import csv, json, pathlib
+import csv, json, pathlib, sqlite3
 import pytest
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
 from heartbridge import Health
-from heartbridge.export import CSVExporter, JSONExporter, export_filepath
+from heartbridge.data import GenericHealthReading
+from heartbridge.export import (
+    CSVExporter,
+    JSONExporter,
+    RowSchema,
+    SQLiteExporter,
+    export_filepath,
+)
+from heartbridge.exceptions import ExportError
 import test.sample_inputs as samples
 
 
@@ -16,6 +26,12 @@ def test_export_filepath_directoryDoesNotExist(tmp_path):
     assert path == tmp_path / "apples/test.csv"
 
 
+def test_export_filepath_nestedDirectoryDoesNotExist(tmp_path):
+    path = export_filepath("test", tmp_path / "apples" / "pears", "csv")
+    assert path == tmp_path / "apples/pears/test.csv"
+    assert path.parent.is_dir()
+
+
 def test_export_filepath_useCurrentWorkingDir():
     """If output_dir is not specified, the filepath returned should be in the
     current working directory
@@ -81,3 +97,169 @@ def test_json_exporter(tmp_path, input_data, output_value_column):
             health_sample = health.readings[i]
             assert health_sample.timestamp_string == reading["timestamp"]
             assert health_sample.get_value() == reading[output_value_column]
+
+
+@pytest.mark.parametrize(
+    "input_data, table, output_value_column",
+    [
+        (samples.HR_TYPICAL_INPUT, "heart_rate", "heart_rate"),
+        (samples.HRV_INPUT, "heart_rate_variability", "heart_rate_variability"),
+        (samples.CYCLING_INPUT, "cycling_distance", "distance_cycled"),
+        (samples.GENERIC_INPUT, "memes_sent", "reading"),
+    ],
+)
+def test_sqlite_exporter(tmp_path, input_data, table, output_value_column):
+    health = Health()
+    health.load_from_shortcuts(input_data)
+
+    filepath = SQLiteExporter().readings_to_file(
+        health.readings, filename=tmp_path / "test.sqlite"
+    )
+
+    with sqlite3.connect(filepath) as connection:
+        rows = connection.execute(
+            f'SELECT timestamp, "{output_value_column}" FROM "{table}" ORDER BY timestamp'
+        ).fetchall()
+    assert rows == list(zip(health.readings.timestamps, health.readings.values))
+
+
+def test_sqlite_exporter_overlappingUploads_shouldUpsert(tmp_path):
+    first, second = Health(tmp_path, "sqlite"), Health(tmp_path, "sqlite")
+    first.load_from_shortcuts(
+        {
+            "type": "Steps",
+            "dates": ["2021-04-10 09:20:10", "2021-04-10 13:14:00"],
+            "values": ["34", "50"],
+        }
+    )
+    second.load_from_shortcuts(
+        {
+            "type": "Steps",
+            "dates": ["2021-04-10 13:14:00", "2021-04-10 23:10:59"],
+            "values": ["55", "10"],
+        }
+    )
+
+    assert first.export() == second.export() == str(tmp_path / "heartbridge.sqlite")
+    with sqlite3.connect(tmp_path / "heartbridge.sqlite") as connection:
+        rows = connection.execute(
+            "SELECT step_count FROM steps ORDER BY timestamp"
+        ).fetchall()
+    assert rows == [(34,), (55,), (10,)]
+
+
+@pytest.mark.parametrize("exporter_cls", [CSVExporter, JSONExporter])
+def test_exporter_readingObjects_shouldMatchBatch(tmp_path, exporter_cls):
+    health = Health()
+    health.load_from_shortcuts(dict(samples.HR_TYPICAL_INPUT))
+    exporter = exporter_cls()
+    exporter.chunk_size = 4
+
+    from_batch = exporter.readings_to_file(health.readings, tmp_path / "batch")
+    # A generator of reading objects is written without building a list of them:
+    readings = (health.readings[i] for i in range(len(health.readings)))
+    from_objects = exporter.readings_to_file(readings, tmp_path / "objects")
+
+    assert (
+        pathlib.Path(from_batch).read_bytes() == pathlib.Path(from_objects).read_bytes()
+    )
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 10000])
+def test_json_exporter_shouldMatchJsonDump(tmp_path, chunk_size):
+    health = Health()
+    health.load_from_shortcuts(dict(samples.HRV_INPUT))
+    exporter = JSONExporter()
+    exporter.chunk_size = chunk_size
+
+    filepath = exporter.readings_to_file(health.readings, tmp_path / "test.json")
+
+    expected = json.dumps([reading.to_dict() for reading in health.readings])
+    assert pathlib.Path(filepath).read_text() == expected
+
+
+def test_exporters_nonNumericValues(tmp_path):
+    readings = [
+        GenericHealthReading(datetime(2021, 4, 1, 8), 'say "hi", please'),
+        GenericHealthReading(datetime(2021, 4, 1, 9), float("nan")),
+    ]
+
+    csv_path = CSVExporter().readings_to_file(iter(readings), tmp_path / "a.csv")
+    json_path = JSONExporter().readings_to_file(iter(readings), tmp_path / "a.json")
+
+    with open(csv_path, newline="") as export_file:
+        assert list(csv.reader(export_file))[1:] == [
+            ["2021-04-01 08:00:00", 'say "hi", please'],
+            ["2021-04-01 09:00:00", "nan"],
+        ]
+    # NaN isn't valid JSON, so it's written as null:
+    assert json.loads(pathlib.Path(json_path).read_text()) == [
+        {"timestamp": "2021-04-01 08:00:00", "reading": 'say "hi", please'},
+        {"timestamp": "2021-04-01 09:00:00", "reading": None},
+    ]
+
+
+def test_exporters_emptyData(tmp_path):
+    json_path = JSONExporter().readings_to_file([], tmp_path / "empty.json")
+    assert pathlib.Path(json_path).read_text() == "[]"
+
+
+@pytest.mark.parametrize("exporter_cls", [CSVExporter, JSONExporter])
+def test_exporter_failedWrite_shouldKeepPreviousFile(tmp_path, exporter_cls):
+    path = tmp_path / "export.out"
+    path.write_text("previous export")
+
+    def rows():
+        yield ("2021-04-01 08:00:00", 1.0)
+        raise RuntimeError("disk full")
+
+    schema = RowSchema(("timestamp", "reading"), ("d",))
+    with pytest.raises(ExportError):
+        exporter_cls().rows_to_file(schema, rows(), path)
+
+    assert path.read_text() == "previous export"
+    assert [p.name for p in tmp_path.iterdir()] == ["export.out"]
+
+
+def export_heart_rate(output_dir: str, value: str) -> str:
+    """Exports the same day of heart rate samples, with every value set to `value`."""
+    health = Health(output_dir=output_dir, output_format="json")
+    data = dict(samples.HR_TYPICAL_INPUT)
+    data["values"] = [value] * len(data["dates"])
+    health.load_from_shortcuts(data)
+    return health.export()
+
+
+def test_export_concurrentProcesses_sameFile(tmp_path):
+    """Server worker processes exporting the same record type and date range at
+    once should leave one complete file, and one index entry for it.
+    """
+    with ProcessPoolExecutor(max_workers=4) as executor:
+        files = set(
+            executor.map(
+                export_heart_rate, [str(tmp_path)] * 16, map(str, range(60, 76))
+            )
+        )
+
+    assert len(files) == 1
+    exported = json.loads(pathlib.Path(files.pop()).read_text())
+    assert len(exported) == len(samples.HR_TYPICAL_INPUT["dates"])
+    # Every row comes from the same upload:
+    assert len({row["heart_rate"] for row in exported}) == 1
+    index = json.loads((tmp_path / ".heartbridge-index.json").read_text())
+    assert len(index) == 1
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_export_differentDates_shouldShareLockFile(tmp_path):
+    for date in ("2021-04-01", "2021-04-02", "2021-04-03"):
+        health = Health(output_dir=str(tmp_path), output_format="csv")
+        health.load_from_shortcuts(
+            {"type": "Steps", "dates": [date + " 09:00:00"], "values": ["10"]}
+        )
+        health.export()
+
+    assert sorted(p.name for p in tmp_path.glob(".*.lock")) == [
+        ".heartbridge-index.json.lock",
+        ".steps.lock",
+    ]
@@ -1,6 +1,7 @@
 import pytest
 from datetime import datetime
 from heartbridge import Health
+from heartbridge.health import batch_records
 from heartbridge.exceptions import LoadingError, ValidationError
 from heartbridge.constants import LEGACY_RECORD_TYPE
 import test.sample_inputs as samples
@@ -83,3 +84,27 @@ def test_recognize_date_range_multiDay():
     health = Health()
     health.load_from_shortcuts(data)
     assert health._string_date_range() == "May20-2020-Jun14-2020"
+
+
+@pytest.mark.parametrize(
+    "input_data, expected_types",
+    [
+        (samples.HR_TYPICAL_INPUT, None),
+        ({"dates": [], "values": []}, None),
+        ({}, None),
+        (samples.BATCH_LIST_INPUT, ["Heart Rate", "Steps", "Heart Rate Variability"]),
+        (samples.BATCH_DICT_INPUT, ["Resting Heart Rate", "Steps"]),
+    ],
+)
+def test_batch_records(input_data, expected_types):
+    records = batch_records(input_data)
+    if expected_types is None:
+        assert records is None
+    else:
+        assert [record["type"] for record in records] == expected_types
+
+
+@pytest.mark.parametrize("input_data", [[], [1, 2], "Heart Rate"])
+def test_batch_records_invalid_shouldRaise(input_data):
+    with pytest.raises(LoadingError):
+        batch_records(input_data)
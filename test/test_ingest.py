@@ -0,0 +1,65 @@
+import gzip, json
+from click.testing import CliRunner
+from heartbridge.app import cli
+from heartbridge.ingest import find_payloads, ingest_file
+import test.sample_inputs as samples
+
+
+def write_payloads(directory):
+    (directory / "nested").mkdir(parents=True)
+    (directory / "steps.json").write_text(json.dumps(samples.STEPS_INPUT))
+    with gzip.open(directory / "nested" / "hr.json.gz", "wt") as payload_file:
+        json.dump(samples.HR_TYPICAL_INPUT, payload_file)
+    (directory / "nested" / "notes.txt").write_text("not a payload")
+
+
+def test_find_payloads(tmp_path):
+    write_payloads(tmp_path)
+    assert [p.name for p in find_payloads([tmp_path])] == ["hr.json.gz", "steps.json"]
+    assert find_payloads([tmp_path / "steps.json"]) == [tmp_path / "steps.json"]
+
+
+def test_ingest_file_batchAndErrors(tmp_path):
+    batch = tmp_path / "batch.json"
+    batch.write_text(json.dumps(samples.BATCH_DICT_INPUT))
+    invalid = tmp_path / "invalid.json"
+    invalid.write_text(json.dumps({"type": "Steps", "dates": []}))
+    options = {"output_dir": str(tmp_path / "out"), "output_format": "json"}
+
+    result = ingest_file(batch, options)
+    assert result["types"] == ["resting-heart-rate", "steps"]
+    assert result["samples"] == 6
+    assert len(result["exported"]) == 2
+    assert "ValidationError" in ingest_file(invalid, options)["error"]
+
+
+def test_cli_ingest(tmp_path):
+    write_payloads(tmp_path / "archive")
+    out = tmp_path / "out"
+
+    result = CliRunner().invoke(
+        cli,
+        [
+            "ingest",
+            str(tmp_path / "archive"),
+            "--directory",
+            str(out),
+            "--workers",
+            "2",
+        ],
+    )
+
+    assert result.exit_code == 0, result.output
+    assert "Ingested 2 files (0 failed): 9 samples" in result.output
+    assert (out / "steps-Apr10-2021.csv").exists()
+    assert (out / "heart-rate-Dec16-2019.csv").exists()
+
+
+def test_cli_ingest_failure_shouldExit1(tmp_path):
+    payload = tmp_path / "bad.json"
+    payload.write_text("{")
+
+    result = CliRunner().invoke(cli, ["ingest", str(payload)])
+
+    assert result.exit_code == 1
+    assert "Could not ingest" in result.output
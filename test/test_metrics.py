@@ -0,0 +1,122 @@
+import json, logging
+import pytest
+from starlette.testclient import TestClient
+from heartbridge import Health, metrics
+from heartbridge.app import app
+from heartbridge.metrics import Histogram, MetricsRegistry, UploadMetrics
+import test.sample_inputs as samples
+
+
+def test_histogram_cumulativeCounts():
+    histogram = Histogram(buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value)
+    assert list(histogram.cumulative_counts()) == [("0.1", 2), ("1", 3), ("+Inf", 4)]
+    assert histogram.count == 4
+    assert histogram.sum == pytest.approx(3.65)
+
+
+def test_registry_render():
+    registry = MetricsRegistry(buckets=(1,))
+    upload = UploadMetrics("heart-rate")
+    upload.samples, upload.bytes = 6, 300
+    upload.timings = {"parse": 0.5}
+    upload.finish(200)
+    registry.observe(upload)
+
+    text = registry.render()
+    assert 'heartbridge_uploads_total{type="heart-rate",status="200"} 1' in text
+    assert 'heartbridge_samples_total{type="heart-rate"} 6' in text
+    assert 'heartbridge_bytes_total{type="heart-rate"} 300' in text
+    assert "# TYPE heartbridge_stage_seconds histogram" in text
+    assert (
+        'heartbridge_stage_seconds_bucket{type="heart-rate",stage="parse",le="1"} 1'
+        in text
+    )
+    assert 'heartbridge_stage_seconds_sum{type="heart-rate",stage="parse"} 0.5' in text
+
+
+def test_disabled_doesNothing():
+    upload = metrics.DISABLED
+    upload.samples = 10
+    with upload.time("parse"):
+        pass
+    assert upload.samples == 0
+    assert upload.timings is None
+    registry = MetricsRegistry()
+    registry.observe(upload)
+    assert "heartbridge_samples_total{" not in registry.render()
+
+
+def test_health_timings_onlyWhenInstrumented():
+    health = Health()
+    health.load_from_shortcuts(dict(samples.HR_TYPICAL_INPUT))
+    assert health.timings is None
+
+    health = Health(instrument=True)
+    health.load_from_shortcuts(dict(samples.HR_TYPICAL_INPUT))
+    assert set(health.timings) == {"validate", "parse"}
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_endpoint_metrics(tmp_path, monkeypatch, streaming):
+    app.state.OUTPUT_DIRECTORY = str(tmp_path)
+    app.state.OUTPUT_FORMAT = "csv"
+    monkeypatch.setattr(app.state, "STREAMING_INGEST", streaming)
+    monkeypatch.setattr(app.state, "METRICS", MetricsRegistry())
+
+    client = TestClient(app)
+    client.post("/", json=samples.HR_TYPICAL_INPUT)
+    client.post("/", json={"type": "Heart Rate", "dates": ["2020-03-20 09:40:22"]})
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    text = response.text
+    assert 'heartbridge_uploads_total{type="heart-rate",status="200"} 1' in text
+    assert 'heartbridge_uploads_total{type="unknown",status="422"} 1' in text
+    assert 'heartbridge_samples_total{type="heart-rate"} 6' in text
+    for stage in ("decode", "validate", "parse", "export"):
+        assert f'stage="{stage}",le="+Inf"' in text
+
+
+def test_endpoint_metrics_batchAndUnknownTypes(tmp_path, monkeypatch):
+    app.state.OUTPUT_DIRECTORY = str(tmp_path)
+    app.state.OUTPUT_FORMAT = "csv"
+    monkeypatch.setattr(app.state, "METRICS", MetricsRegistry())
+    unknown = dict(samples.STEPS_INPUT, type="Sleep Analysis")
+
+    client = TestClient(app)
+    client.post("/", json=[samples.HR_TYPICAL_INPUT, unknown])
+    text = client.get("/metrics").text
+
+    assert 'heartbridge_uploads_total{type="batch",status="200"} 1' in text
+    assert 'heartbridge_samples_total{type="heart-rate"} 6' in text
+    assert 'heartbridge_uploads_total{type="other",status="200"} 1' in text
+    assert 'heartbridge_samples_total{type="batch"} 0' in text
+    assert "sleep-analysis" not in text
+
+
+def test_endpoint_metrics_disabled_shouldReturn404():
+    client = TestClient(app)
+    assert client.get("/metrics").status_code == 404
+
+
+def test_endpoint_jsonLog(tmp_path, monkeypatch, caplog):
+    app.state.OUTPUT_DIRECTORY = str(tmp_path)
+    app.state.OUTPUT_FORMAT = "csv"
+    monkeypatch.setattr(app.state, "LOG_METRICS", True)
+    caplog.set_level(logging.INFO, logger="heartbridge.metrics")
+
+    client = TestClient(app)
+    client.post("/", json=samples.STEPS_INPUT)
+
+    records = [
+        json.loads(r.message) for r in caplog.records if r.name == metrics.logger.name
+    ]
+    assert len(records) == 1
+    assert records[0]["type"] == "steps"
+    assert records[0]["status"] == 200
+    assert records[0]["samples"] == 3
+    assert records[0]["bytes"] > 0
+    assert {"decode", "validate", "parse", "export"} <= set(records[0]["stages"])
@@ -0,0 +1,80 @@
+import json
+import pytest
+from heartbridge import Health
+from heartbridge.index import ExportIndex
+from heartbridge.query import RangeQuery
+
+FIRST_UPLOAD = {
+    "type": "Heart Rate",
+    "dates": ["2021-04-01 09:00:00", "2021-04-01 08:00:00", "2021-04-02 10:00:00"],
+    "values": ["70", "60", "80"],
+}
+OVERLAPPING_UPLOAD = {
+    "type": "Heart Rate",
+    "dates": ["2021-04-02 10:00:00", "2021-04-02 09:00:00", "2021-04-03 11:00:00"],
+    "values": ["85", "75", "90"],
+}
+
+
+def export(upload, directory, output_format="csv", rollup=None):
+    health = Health(str(directory), output_format, rollup, partition=True)
+    health.load_from_shortcuts(json.loads(json.dumps(upload)))
+    return health.export()
+
+
+def test_partition_layout(tmp_path):
+    exported = export(FIRST_UPLOAD, tmp_path)
+
+    assert exported == str((tmp_path / "heart-rate").resolve())
+    assert (tmp_path / "heart-rate/2021/04/01.csv").read_text().splitlines() == [
+        "timestamp,heart_rate",
+        "2021-04-01 08:00:00,60",
+        "2021-04-01 09:00:00,70",
+    ]
+    assert (tmp_path / "heart-rate/2021/04/02.csv").exists()
+
+
+@pytest.mark.parametrize("output_format", ["csv", "json"])
+def test_partition_mergeOnWrite(tmp_path, output_format):
+    export(FIRST_UPLOAD, tmp_path, output_format)
+    export(OVERLAPPING_UPLOAD, tmp_path, output_format)
+
+    rows = list(RangeQuery(tmp_path, output_format, "heart-rate").rows())
+    assert [value for _, value in rows] == [60, 70, 75, 85, 90]
+    manifest = {
+        entry["file"]: (entry["start"], entry["end"], entry["rows"])
+        for entry in ExportIndex(tmp_path).entries()
+    }
+    assert manifest == {
+        f"heart-rate/2021/04/01.{output_format}": (1617264000, 1617267600, 2),
+        f"heart-rate/2021/04/02.{output_format}": (1617354000, 1617357600, 2),
+        f"heart-rate/2021/04/03.{output_format}": (1617447600, 1617447600, 1),
+    }
+
+
+def test_partition_duplicateTimestampsInUpload_shouldKeepLast(tmp_path):
+    upload = {
+        "type": "Steps",
+        "dates": ["2021-04-10 09:00:00", "2021-04-10 09:00:00"],
+        "values": ["10", "12"],
+    }
+    export(upload, tmp_path)
+
+    rows = (tmp_path / "steps/2021/04/10.csv").read_text().splitlines()
+    assert rows[1:] == ["2021-04-10 09:00:00,12"]
+
+
+def test_partition_rollup(tmp_path):
+    export(FIRST_UPLOAD, tmp_path, rollup="day")
+    export(OVERLAPPING_UPLOAD, tmp_path, rollup="day")
+
+    rows = (tmp_path / "heart-rate-per-day/2021/04/02.csv").read_text().splitlines()
+    assert rows == [
+        "timestamp,heart_rate_mean,heart_rate_min,heart_rate_max,heart_rate_count",
+        "2021-04-02 00:00:00,80.0,75,85,2",
+    ]
+
+
+def test_partition_sqlite_shouldUseDatabase(tmp_path):
+    exported = export(FIRST_UPLOAD, tmp_path, "sqlite")
+    assert exported.endswith("heartbridge.sqlite")
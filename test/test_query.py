@@ -0,0 +1,122 @@
+import pytest
+from starlette.testclient import TestClient
+from heartbridge import Health
+from heartbridge.app import app
+from heartbridge.index import ExportIndex
+from heartbridge.query import RangeQuery, parse_time_bound
+
+FIRST_UPLOAD = {
+    "type": "Heart Rate",
+    "dates": ["2021-04-01 08:00:00", "2021-04-01 09:00:00", "2021-04-02 10:00:00"],
+    "values": ["60", "70", "80"],
+}
+OVERLAPPING_UPLOAD = {
+    "type": "Heart Rate",
+    "dates": ["2021-04-02 10:00:00", "2021-04-03 11:00:00"],
+    "values": ["80", "90"],
+}
+
+
+def export_uploads(directory, output_format):
+    for upload in (FIRST_UPLOAD, OVERLAPPING_UPLOAD):
+        health = Health(str(directory), output_format)
+        health.load_from_shortcuts(dict(upload))
+        health.export()
+
+
+def test_export_index_lookup(tmp_path):
+    export_uploads(tmp_path, "csv")
+    index = ExportIndex(tmp_path)
+
+    assert len(index.entries()) == 2
+    files = [e["file"] for e in index.lookup("heart-rate", start=1617408000)]
+    assert files == ["heart-rate-Apr02-2021-Apr03-2021.csv"]
+    assert index.lookup("steps") == []
+
+
+@pytest.mark.parametrize("output_format", ["csv", "json", "sqlite"])
+def test_range_query_rows(tmp_path, output_format):
+    export_uploads(tmp_path, output_format)
+
+    query = RangeQuery(
+        tmp_path,
+        output_format,
+        "heart-rate",
+        start=parse_time_bound("2021-04-01 09:00:00"),
+        end=parse_time_bound("2021-04-03"),
+    )
+    assert [value for _, value in query.rows()] == [70, 80]
+
+
+def test_range_query_rows_sameTimestampInTwoFiles(tmp_path):
+    export_uploads(tmp_path, "csv")
+    health = Health(str(tmp_path), "csv")
+    health.load_from_shortcuts(
+        {"type": "Heart Rate", "dates": ["2021-04-02 10:00:00"], "values": ["85"]}
+    )
+    health.export()
+
+    query = RangeQuery(tmp_path, "csv", "heart-rate", start=1617321600)
+    # The value from the latest export wins:
+    assert list(query.rows()) == [(1617357600, 85), (1617447600, 90)]
+
+
+def test_range_query_etag_sqliteValuesSwapped(tmp_path):
+    export_uploads(tmp_path, "sqlite")
+    query = RangeQuery(tmp_path, "sqlite", "heart-rate")
+    etag = query.etag()
+
+    health = Health(str(tmp_path), "sqlite")
+    health.load_from_shortcuts(
+        {
+            "type": "Heart Rate",
+            "dates": ["2021-04-01 08:00:00", "2021-04-01 09:00:00"],
+            "values": ["70", "60"],
+        }
+    )
+    health.export()
+
+    assert [value for _, value in query.rows()][:2] == [70, 60]
+    assert query.etag() != etag
+
+
+@pytest.mark.parametrize("output_format", ["csv", "sqlite"])
+def test_endpoint_readings(tmp_path, monkeypatch, output_format):
+    export_uploads(tmp_path, output_format)
+    monkeypatch.setattr(app.state, "OUTPUT_DIRECTORY", str(tmp_path))
+    monkeypatch.setattr(app.state, "OUTPUT_FORMAT", output_format)
+
+    client = TestClient(app)
+    response = client.get("/readings/heart-rate?start=2021-04-02")
+
+    assert response.status_code == 200
+    assert response.json() == [
+        {"timestamp": "2021-04-02 10:00:00", "heart_rate": 80},
+        {"timestamp": "2021-04-03 11:00:00", "heart_rate": 90},
+    ]
+
+    etag = response.headers["etag"]
+    cached = client.get(
+        "/readings/heart-rate?start=2021-04-02", headers={"If-None-Match": etag}
+    )
+    assert cached.status_code == 304
+
+    health = Health(str(tmp_path), output_format)
+    health.load_from_shortcuts(
+        {"type": "Heart Rate", "dates": ["2021-04-04 12:00:00"], "values": ["100"]}
+    )
+    health.export()
+    changed = client.get(
+        "/readings/heart-rate?start=2021-04-02", headers={"If-None-Match": etag}
+    )
+    assert changed.status_code == 200
+    assert len(changed.json()) == 3
+
+
+def test_endpoint_readings_emptyAndInvalid(tmp_path, monkeypatch):
+    monkeypatch.setattr(app.state, "OUTPUT_DIRECTORY", str(tmp_path))
+    monkeypatch.setattr(app.state, "OUTPUT_FORMAT", "csv")
+
+    client = TestClient(app)
+    assert client.get("/readings/steps").json() == []
+    assert client.get("/readings/steps?start=yesterday").status_code == 400
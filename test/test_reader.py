@@ -0,0 +1,121 @@
+import pytest
+from heartbridge import Health, reader
+from heartbridge.aggregate import resample
+from heartbridge.data import HeartRateReading, ReadingBatch, StepsReading
+from heartbridge.exceptions import LoadingError
+from heartbridge.export import CSVExporter, JSONExporter
+from heartbridge.reader import ExportReader, read_export
+
+START = 1617235200  # 2021-04-01 00:00:00
+TIMESTAMPS = [START + i * 60 for i in range(500)]
+VALUES = [60 + i % 90 for i in range(500)]
+
+
+def export(path, timestamps=TIMESTAMPS, values=VALUES, reading_cls=HeartRateReading):
+    exporter = CSVExporter if path.suffix == ".csv" else JSONExporter
+    batch = ReadingBatch(reading_cls, timestamps, values)
+    return exporter().readings_to_file(batch, path)
+
+
+@pytest.mark.parametrize("filename", ["heart-rate.csv", "heart-rate.json"])
+def test_reader_window(tmp_path, engine, filename):
+    path = export(tmp_path / filename)
+
+    with ExportReader(path) as export_reader:
+        window = export_reader.window(TIMESTAMPS[100], TIMESTAMPS[110])
+        assert len(export_reader) == 500
+        assert (export_reader.start, export_reader.end) == (START, TIMESTAMPS[-1])
+
+    assert isinstance(window, ReadingBatch)
+    assert window.reading_cls is HeartRateReading
+    assert window.reading_type == "heart-rate"
+    assert list(window.timestamps) == TIMESTAMPS[100:110]
+    assert list(window.values) == VALUES[100:110]
+
+
+@pytest.mark.parametrize("filename", ["heart-rate.csv", "heart-rate.json"])
+def test_reader_unorderedExport_shouldReadInTimestampOrder(tmp_path, engine, filename):
+    """Uploads are exported in the order Shortcuts sent them, e.g. newest first."""
+    path = export(tmp_path / filename, TIMESTAMPS[::-1], VALUES[::-1])
+
+    with ExportReader(path) as export_reader:
+        assert not export_reader.index.ordered
+        window = export_reader.window(TIMESTAMPS[100], TIMESTAMPS[110])
+        rows = list(export_reader.rows(end=TIMESTAMPS[3]))
+
+    assert list(window.timestamps) == TIMESTAMPS[100:110]
+    assert list(window.values) == VALUES[100:110]
+    assert rows == list(zip(TIMESTAMPS[:3], VALUES[:3]))
+
+
+def test_reader_readings_shouldBeLazy(tmp_path, engine):
+    path = export(tmp_path / "heart-rate.csv")
+
+    with ExportReader(path) as export_reader:
+        readings = export_reader.readings(start=TIMESTAMPS[498])
+        first = next(readings)
+        assert isinstance(first, HeartRateReading)
+        assert first.heart_rate == VALUES[498]
+        assert [r.heart_rate for r in readings] == VALUES[499:]
+
+
+@pytest.mark.parametrize("filename", ["steps.csv", "steps.json"])
+def test_reader_rollup(tmp_path, engine, filename):
+    batch = ReadingBatch(StepsReading, TIMESTAMPS, VALUES, reading_type="steps")
+    rollup = resample(batch, "hour", reducers=["sum", "count"])
+    exporter = CSVExporter if filename.endswith(".csv") else JSONExporter
+    path = exporter().readings_to_file(rollup, tmp_path / filename)
+
+    with ExportReader(path) as export_reader:
+        assert export_reader.reducers == ["sum", "count"]
+        window = export_reader.window()
+        with pytest.raises(LoadingError):
+            next(export_reader.readings())
+
+    assert window.field_names == ["timestamp", "step_count_sum", "step_count_count"]
+    assert window.timestamps == rollup.timestamps
+    assert window.columns() == rollup.columns()
+
+
+def test_reader_shouldCacheIndex(tmp_path, engine, monkeypatch):
+    path = export(tmp_path / "heart-rate.csv")
+    with ExportReader(path) as export_reader:
+        index = export_reader.index
+    assert export_reader.index_path.exists()
+
+    def scan(self):
+        raise AssertionError("the index should have been loaded")
+
+    monkeypatch.setattr(ExportReader, "_build_index", scan)
+    with ExportReader(path) as export_reader:
+        assert export_reader.index == index
+    monkeypatch.undo()
+
+    # A changed export is indexed again:
+    export(tmp_path / "heart-rate.csv", TIMESTAMPS[:10], VALUES[:10])
+    assert len(read_export(path)) == 10
+
+
+def test_reader_emptyExports(tmp_path, engine):
+    assert len(read_export(export(tmp_path / "empty.csv", [], []))) == 0
+    assert len(read_export(export(tmp_path / "empty.json", [], []))) == 0
+
+
+def test_reader_notAnExport(tmp_path):
+    (tmp_path / "notes.csv").write_text("name,age\r\nMatt,30\r\n")
+    (tmp_path / "notes.txt").write_text("hello")
+
+    with pytest.raises(LoadingError):
+        ExportReader(tmp_path / "notes.csv")
+    with pytest.raises(LoadingError):
+        ExportReader(tmp_path / "notes.txt")
+
+
+def test_health_load_from_export(tmp_path):
+    path = export(tmp_path / "heart-rate.json")
+
+    health = Health()
+    health.load_from_export(path, start=TIMESTAMPS[10], end=TIMESTAMPS[20])
+
+    assert health.reading_type_slug == "heart-rate"
+    assert list(health.readings.values) == VALUES[10:20]
@@ -0,0 +1,163 @@
+import os, time
+import pytest
+from heartbridge import sessions
+from heartbridge.data import HeartRateReading, ReadingBatch
+from heartbridge.exceptions import LoadingError, UploadSessionError
+from heartbridge.sessions import UploadSessions, session_status
+
+START = 1617235200  # 2021-04-01 00:00:00
+
+
+def read(store, session_id, size=sessions.BATCH_SIZE):
+    """Joins the batches a committed session is exported in."""
+    batches = list(store.batches(session_id, size))
+    assert all(0 < len(batch) <= size for batch in batches)
+    readings = ReadingBatch(
+        batches[0].reading_cls, reading_type=batches[0].reading_type
+    )
+    for batch in batches:
+        readings.timestamps.extend(batch.timestamps)
+        readings.values.extend(batch.values)
+    return readings
+
+
+def chunk(first, count):
+    timestamps = [START + i * 60 for i in range(first, first + count)]
+    return ReadingBatch(HeartRateReading, timestamps, [60 + i for i in range(count)])
+
+
+def test_sessions_chunks_shouldBeReadInTimestampOrder(tmp_path):
+    store = UploadSessions(tmp_path)
+    session_id = store.open("Heart Rate")["id"]
+
+    # Chunks may arrive in any order:
+    store.add_chunk(session_id, 1, b"second", chunk(10, 5))
+    state, duplicate = store.add_chunk(session_id, 0, b"first", chunk(0, 10))
+    store.begin_commit(session_id)
+    readings = read(store, session_id)
+
+    assert duplicate is False
+    assert state["samples"] == 15
+    assert readings.reading_type == "heart-rate"
+    assert readings.reading_cls is HeartRateReading
+    assert list(readings.timestamps) == list(chunk(0, 10).timestamps) + list(
+        chunk(10, 5).timestamps
+    )
+
+
+def test_sessions_overlappingChunks_shouldKeepLastChunksSamples(tmp_path):
+    store = UploadSessions(tmp_path)
+    session_id = store.open("Heart Rate")["id"]
+    store.add_chunk(session_id, 0, b"first", chunk(5, 5))
+    store.add_chunk(session_id, 1, b"second", chunk(0, 7))
+    store.begin_commit(session_id)
+
+    readings = read(store, session_id, size=3)
+
+    assert store.time_range(session_id) == (START, START + 9 * 60)
+    assert list(readings.timestamps) == list(chunk(0, 10).timestamps)
+    # Samples 5 and 6 are in both chunks; chunk 1 has the last say:
+    assert list(readings.values) == [60, 61, 62, 63, 64, 65, 66, 62, 63, 64]
+
+
+def test_sessions_emptyChunks_shouldNotCommit(tmp_path):
+    store = UploadSessions(tmp_path)
+    session_id = store.open("Heart Rate")["id"]
+    store.add_chunk(session_id, 0, b"first", chunk(0, 0))
+
+    with pytest.raises(UploadSessionError):
+        store.begin_commit(session_id)
+    assert list(store.batches(session_id)) == []
+    with pytest.raises(LoadingError):
+        store.time_range(session_id)
+
+
+def test_sessions_retransmittedChunk_shouldBeSkipped(tmp_path):
+    store = UploadSessions(tmp_path)
+    session_id = store.open("Heart Rate")["id"]
+    store.add_chunk(session_id, 0, b"first", chunk(0, 10))
+
+    state, duplicate = store.add_chunk(session_id, 0, b"first", chunk(0, 10))
+
+    assert duplicate is True
+    assert state["samples"] == 10
+    assert store.has_chunk(session_id, 0, b"first")
+    with pytest.raises(UploadSessionError):
+        store.has_chunk(session_id, 0, b"something else")
+
+
+def test_sessions_commit_shouldRequireEveryChunk(tmp_path):
+    store = UploadSessions(tmp_path)
+    session_id = store.open("Heart Rate", chunks=3)["id"]
+    store.add_chunk(session_id, 1, b"second", chunk(10, 5))
+
+    with pytest.raises(UploadSessionError) as error:
+        store.begin_commit(session_id)
+    assert error.value.missing == [0, 2]
+    assert session_status(store.state(session_id))["missing_chunks"] == [0, 2]
+
+    store.add_chunk(session_id, 0, b"first", chunk(0, 10))
+    store.add_chunk(session_id, 2, b"third", chunk(15, 5))
+    store.begin_commit(session_id)
+    with pytest.raises(UploadSessionError):
+        store.add_chunk(session_id, 3, b"fourth", chunk(20, 5))
+
+
+@pytest.mark.parametrize(
+    "chunks, error",
+    [
+        ("3", LoadingError),
+        (sessions.MAX_CHUNKS + 1, LoadingError),
+        (True, LoadingError),
+        (2, UploadSessionError),
+    ],
+)
+def test_sessions_commit_invalidChunkCount(tmp_path, chunks, error):
+    store = UploadSessions(tmp_path)
+    session_id = store.open("Heart Rate", chunks=3)["id"]
+    for number in range(3):
+        store.add_chunk(session_id, number, bytes([number]), chunk(number * 5, 5))
+
+    with pytest.raises(error):
+        store.begin_commit(session_id, chunks)
+    assert store.state(session_id)["status"] == sessions.OPEN
+
+
+def test_sessions_finish(tmp_path):
+    store = UploadSessions(tmp_path)
+    session_id = store.open("Heart Rate")["id"]
+    store.add_chunk(session_id, 0, b"first", chunk(0, 10))
+
+    # A failed export opens the session again:
+    store.begin_commit(session_id)
+    assert store.finish(session_id)["status"] == sessions.OPEN
+
+    store.begin_commit(session_id)
+    state = store.finish(session_id, status=sessions.COMMITTED, result={"rows": 10})
+    assert state["result"] == {"rows": 10}
+    assert not list((tmp_path / session_id).glob("*.chunk"))
+
+
+def test_sessions_expire(tmp_path):
+    store = UploadSessions(tmp_path)
+    old = store.open("Heart Rate")["id"]
+    used = time.time() - sessions.SESSION_TTL - 1
+    os.utime(tmp_path / old / sessions.STATE_FILENAME, (used, used))
+
+    new = store.open("Steps")["id"]
+
+    assert store.state(old) is None
+    assert store.state(new)["type"] == "Steps"
+
+
+@pytest.mark.parametrize("reading_type, chunks", [(None, None), ("Steps", 0)])
+def test_sessions_open_invalid(tmp_path, reading_type, chunks):
+    with pytest.raises(LoadingError):
+        UploadSessions(tmp_path).open(reading_type, chunks)
+
+
+def test_sessions_unknownSession(tmp_path):
+    store = UploadSessions(tmp_path)
+    assert store.state("../../etc") is None
+    assert store.state("0" * 32) is None
+    assert store.remove("0" * 32) is False
@@ -0,0 +1,100 @@
+import json, time
+from starlette.testclient import TestClient
+from heartbridge import spool
+from heartbridge.app import app
+import test.sample_inputs as samples
+
+
+def wait_for_job(client, job_id, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = client.get(f"/jobs/{job_id}").json()
+        if status["status"] not in spool.PENDING_STATES:
+            return status
+        time.sleep(0.01)
+    raise TimeoutError(job_id)
+
+
+def test_spool_submit_and_update(tmp_path):
+    job_spool = spool.Spool(tmp_path)
+    job_id = job_spool.submit(b"{}")
+
+    assert job_spool.status(job_id)["status"] == spool.QUEUED
+    assert job_spool.body_path(job_id).read_bytes() == b"{}"
+    assert job_spool.pending() == [job_id]
+
+    job_spool.update(job_id, status=spool.DONE)
+    assert job_spool.pending() == []
+    assert not job_spool.body_path(job_id).exists()
+
+
+def test_spool_claim_shouldReplayEachJobOnce(tmp_path):
+    previous_run = spool.Spool(tmp_path)
+    job_id = previous_run.submit(b"{}")
+    # Two server processes of the next run:
+    first, second = spool.Spool(tmp_path, "run"), spool.Spool(tmp_path, "run")
+
+    assert first.claim(job_id) is True
+    assert second.claim(job_id) is False
+    assert second.claim(second.submit(b"{}")) is False
+
+
+def test_spool_status_unknownOrInvalidId(tmp_path):
+    job_spool = spool.Spool(tmp_path)
+    assert job_spool.status("0" * 32) is None
+    assert job_spool.status("../../etc/passwd") is None
+
+
+def test_endpoint_spooled_shouldReturn202AndExport(tmp_path, monkeypatch):
+    app.state.OUTPUT_DIRECTORY = str(tmp_path / "out")
+    app.state.OUTPUT_FORMAT = "csv"
+    monkeypatch.setattr(app.state, "SPOOL_DIRECTORY", str(tmp_path / "spool"))
+
+    with TestClient(app) as client:
+        response = client.post("/", json=samples.RESTING_HR_INPUT)
+        assert response.status_code == 202
+        status = wait_for_job(client, response.json()["job_id"])
+        invalid = client.post("/", json={"type": "Heart Rate", "dates": []})
+        invalid_status = wait_for_job(client, invalid.json()["job_id"])
+
+    assert status["status"] == spool.DONE
+    assert status["samples"] == 3
+    assert (tmp_path / "out/resting-heart-rate-Apr10-2021-Apr12-2021.csv").exists()
+    assert invalid_status["status"] == spool.FAILED
+    assert invalid_status["error"]["status_code"] == 422
+
+
+def test_endpoint_spooled_replaysPendingJobs(tmp_path, monkeypatch):
+    app.state.OUTPUT_DIRECTORY = str(tmp_path / "out")
+    app.state.OUTPUT_FORMAT = "json"
+    monkeypatch.setattr(app.state, "SPOOL_DIRECTORY", str(tmp_path / "spool"))
+    # A job left behind by a previous run:
+    job_id = spool.Spool(tmp_path / "spool").submit(
+        json.dumps(samples.STEPS_INPUT).encode()
+    )
+
+    with TestClient(app) as client:
+        status = wait_for_job(client, job_id)
+
+    assert status["status"] == spool.DONE
+    assert (tmp_path / "out/steps-Apr10-2021.json").exists()
+
+
+def test_endpoint_spooled_batch(tmp_path, monkeypatch):
+    app.state.OUTPUT_DIRECTORY = str(tmp_path / "out")
+    app.state.OUTPUT_FORMAT = "csv"
+    monkeypatch.setattr(app.state, "SPOOL_DIRECTORY", str(tmp_path / "spool"))
+
+    with TestClient(app) as client:
+        response = client.post("/", json=samples.BATCH_DICT_INPUT)
+        status = wait_for_job(client, response.json()["job_id"])
+
+    assert status["status"] == spool.DONE
+    assert status["samples"] == 6
+    assert [result["status_code"] for result in status["results"]] == [200, 200]
+    assert (tmp_path / "out/steps-Apr10-2021.csv").exists()
+
+
+def test_job_status_notFound():
+    client = TestClient(app)
+    assert client.get("/jobs/" + "0" * 32).status_code == 404
@@ -0,0 +1,180 @@
+import random, statistics
+import pytest
+from heartbridge import Health, stats
+from heartbridge.data import HeartRateReading, HeartRateVariabilityReading, ReadingBatch
+from heartbridge.stats import (
+    QuantileSketch,
+    RunningStats,
+    Summarizer,
+    find_gaps,
+    summarize,
+)
+import test.sample_inputs as samples
+
+START = 1617235200  # 2021-04-01 00:00:00
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    # So NumPy tests cover several chunks:
+    monkeypatch.setattr(stats, "CHUNK_SIZE", 100)
+
+
+def test_runningStats(engine):
+    values = [random.gauss(70, 12) for _ in range(1000)]
+    running = RunningStats()
+    running.add_many(values)
+
+    assert running.count == 1000
+    assert running.mean == pytest.approx(statistics.mean(values))
+    assert running.stddev == pytest.approx(statistics.stdev(values))
+    assert (running.min, running.max) == (min(values), max(values))
+
+
+def test_runningStats_merge_shouldMatchOnePass(engine):
+    values = [random.uniform(40, 180) for _ in range(500)]
+    first, second, combined = RunningStats(), RunningStats(), RunningStats()
+    first.add_many(values[:123])
+    second.add_many(values[123:])
+    combined.add_many(values)
+
+    first.merge(second)
+
+    assert first.count == combined.count
+    assert first.mean == pytest.approx(combined.mean)
+    assert first.variance == pytest.approx(combined.variance)
+    assert (first.min, first.max) == (combined.min, combined.max)
+
+
+def test_runningStats_shouldIgnoreNonFiniteValues(engine):
+    running = RunningStats()
+    running.add_many([1.0, float("nan"), 3.0, float("inf")])
+    assert (running.count, running.mean) == (2, 2.0)
+
+
+@pytest.mark.parametrize("q", [0.01, 0.5, 0.95, 0.99])
+def test_quantileSketch_shouldBeWithinRelativeAccuracy(engine, q):
+    values = sorted(random.lognormvariate(4, 1) for _ in range(5000))
+    sketch = QuantileSketch(relative_accuracy=0.01)
+    sketch.add_many(values)
+
+    expected = values[int(q * (len(values) - 1))]
+    assert sketch.quantile(q) == pytest.approx(expected, rel=0.01)
+
+
+def test_quantileSketch_merge_shouldMatchOneSketch(engine):
+    values = [random.uniform(-50, 200) for _ in range(1000)] + [0.0] * 10
+    first, second, combined = QuantileSketch(), QuantileSketch(), QuantileSketch()
+    first.add_many(values[:400])
+    second.add_many(values[400:])
+    combined.add_many(values)
+
+    first.merge(second)
+
+    assert first.count == combined.count
+    for q in (0, 0.25, 0.5, 0.75, 1):
+        assert first.quantile(q) == combined.quantile(q)
+    with pytest.raises(ValueError):
+        first.merge(QuantileSketch(relative_accuracy=0.05))
+
+
+def test_quantileSketch_empty():
+    assert QuantileSketch().quantile(0.5) is None
+
+
+def test_findGaps_unsortedTimestamps(engine):
+    timestamps = [START + i * 60 for i in range(10)] + [START + 7200, START + 9000]
+    random.shuffle(timestamps)
+
+    gaps = find_gaps(timestamps, threshold=1800)
+
+    assert gaps == [(START + 540, START + 7200)]
+    assert find_gaps([], threshold=1800) == []
+
+
+def test_summarize(engine):
+    timestamps = [START + i * 60 for i in range(100)] + [START + 86400]
+    values = [60 + i % 40 for i in range(101)]
+    batch = ReadingBatch(HeartRateReading, timestamps[::-1], values[::-1])
+
+    summary = summarize(batch, gap_threshold=3600)
+
+    assert summary["samples"] == 101
+    assert (summary["start"], summary["end"]) == (
+        "2021-04-01 00:00:00",
+        "2021-04-02 00:00:00",
+    )
+    assert (summary["min"], summary["max"]) == (60, 99)
+    assert isinstance(summary["min"], int)
+    assert summary["mean"] == pytest.approx(statistics.mean(values))
+    assert summary["stddev"] == pytest.approx(statistics.stdev(values))
+    assert summary["p50"] == pytest.approx(statistics.median(values), rel=0.01)
+    assert 60 <= summary["p95"] <= summary["p99"] <= 99
+    assert summary["gap_count"] == 1
+    assert summary["gaps"] == [
+        {
+            "start": "2021-04-01 01:39:00",
+            "end": "2021-04-02 00:00:00",
+            "seconds": 86400 - 99 * 60,
+        }
+    ]
+
+
+def test_summarizer_batches_shouldMatchSummarize(engine):
+    timestamps = [START + i * 60 for i in range(100)] + [START + 86400]
+    batch = ReadingBatch(
+        HeartRateReading, timestamps, [60 + i % 40 for i in range(101)]
+    )
+    summarizer = Summarizer(gap_threshold=3600)
+
+    # The gap is between two batches:
+    for i in range(0, 101, 25):
+        summarizer.add(batch[i : i + 25])
+
+    assert summarizer.summary() == pytest.approx(summarize(batch, gap_threshold=3600))
+
+
+def test_summarize_emptyBatch(engine):
+    summary = summarize(ReadingBatch(HeartRateVariabilityReading, [], []))
+    assert summary["samples"] == 0
+    assert summary["mean"] is summary["p50"] is summary["start"] is None
+    assert summary["gaps"] == []
+
+
+@pytest.mark.parametrize("output_format", ["csv", "sqlite"])
+def test_health_summarize_shouldWriteSidecar(tmp_path, output_format):
+    health = Health(
+        output_dir=tmp_path,
+        output_format=output_format,
+        summarize=True,
+        gap_threshold=3600,
+    )
+    health.load_from_shortcuts(samples.HR_TYPICAL_INPUT)
+    health.export()
+
+    assert health.summary["samples"] == 6
+    assert health.summary["gap_count"] == 5
+    assert health.summary_path() == tmp_path / "heart-rate-Dec16-2019.stats.json"
+    assert health.summary_path().exists()
+
+
+def test_health_summarize_partialExport_shouldNameSidecarByLoadedRange(tmp_path):
+    health = Health(output_dir=tmp_path, output_format="csv", summarize=True)
+    health.load_from_shortcuts(
+        {
+            "type": "Steps",
+            "dates": ["2021-04-10 09:00:00", "2021-04-11 09:00:00"],
+            "values": ["10", "20"],
+        }
+    )
+    # Like `heartbridge.app.export_health` with --dedup, exporting new samples only:
+    health.readings = ReadingBatch(
+        health.readings.reading_cls,
+        health.readings.timestamps[1:],
+        health.readings.values[1:],
+        reading_type=health.readings.reading_type,
+    )
+    health.export()
+
+    assert health.summary["samples"] == 2
+    assert (tmp_path / "steps-Apr10-2021-Apr11-2021.stats.json").exists()
@@ -0,0 +1,125 @@
+import json
+import pytest
+from heartbridge import Health
+from heartbridge.exception_handlers import error_details, error_response
+from heartbridge.exceptions import LoadingError
+from heartbridge.stream import ShortcutsStreamParser
+import test.sample_inputs as samples
+
+
+def parse_in_chunks(body: bytes, chunk_size: int) -> dict:
+    parser = ShortcutsStreamParser()
+    for i in range(0, len(body), chunk_size):
+        parser.feed(body[i : i + chunk_size])
+    return parser.close()
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 4096])
+def test_stream_parser_matchesJsonLoads(chunk_size):
+    body = json.dumps(samples.HRV_INPUT, indent=2).encode()
+    payload = parse_in_chunks(body, chunk_size)
+
+    assert payload["type"] == "Heart Rate Variability"
+    assert list(payload["dates"]) == [1617609920, 1617889510, 1618041841]
+    assert list(payload["values"]) == [float(x) for x in samples.HRV_INPUT["values"]]
+
+
+def test_stream_parser_singleSample():
+    body = json.dumps(samples.HR_ONE_ITEM_INPUT).encode()
+    payload = parse_in_chunks(body, 3)
+    assert list(payload["dates"]) == [1576484676]
+    assert list(payload["values"]) == [74.0]
+
+
+def test_stream_parser_ignoresOtherKeys():
+    body = b'{"device": {"name": "iPhone", "tags": [1, [2]]}, "type": "Steps", "dates": [], "values": []}'
+    assert set(parse_in_chunks(body, 5)) == {"type", "dates", "values"}
+
+
+@pytest.mark.parametrize(
+    "body",
+    [b"", b"{", b'{"type":}', b'{"dates": ["2019-12-16', b'{"a": 1,}', b'{"a": 1}}'],
+)
+def test_stream_parser_invalidJson_shouldRaise(body):
+    with pytest.raises(json.JSONDecodeError):
+        parse_in_chunks(body, 2)
+
+
+def test_stream_parser_nonObject_shouldRaise():
+    with pytest.raises(LoadingError):
+        parse_in_chunks(b"[1, 2]", 2)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 4096])
+def test_stream_parser_batchList(chunk_size):
+    body = json.dumps(samples.BATCH_LIST_INPUT).encode()
+    records = parse_in_chunks(body, chunk_size)
+
+    assert [record["type"] for record in records] == [
+        "Heart Rate",
+        "Steps",
+        "Heart Rate Variability",
+    ]
+    assert list(records[1]["dates"]) == [1618046410, 1618060440, 1618096259]
+    assert list(records[1]["values"]) == [34.0, 50.0, 10.0]
+
+
+def test_stream_parser_batchKeyedByType():
+    body = json.dumps(samples.BATCH_DICT_INPUT).encode()
+    records = parse_in_chunks(body, 5)
+
+    assert [record["type"] for record in records] == ["Resting Heart Rate", "Steps"]
+    assert list(records[0]["values"]) == [60.0, 59.0, 62.0]
+
+
+def test_stream_parser_objectWithNestedKeys_isNotBatch():
+    body = b'{"device": {"name": "iPhone"}, "type": "Steps", "dates": [], "values": []}'
+    payload = parse_in_chunks(body, 5)
+    assert payload["type"] == "Steps"
+
+
+def test_stream_parser_invalidSamples_shouldBeRecorded():
+    body = b'{"type": "Heart Rate", "dates": ["2021-04-01 08:00:00", "later", "2021-04-01 08:02:00"], "values": ["60", "61", "x"]}'
+    payload = parse_in_chunks(body, 4096)
+
+    assert list(payload["dates"]) == [1617264000, 0, 1617264120]
+    assert payload.invalid[1][0] == 0
+    assert payload.invalid[2][:2] == (1, "x")
+
+
+@pytest.mark.parametrize(
+    "payload",
+    [
+        {"type": "Heart Rate", "dates": [["2021-04-01 08:00:00"]], "values": ["60"]},
+        {"type": "Heart Rate", "dates": ["2021-04-01 08:00:00"], "values": [["60"]]},
+        {"type": "Heart Rate", "dates": [{"a": 1}], "values": ["60"]},
+        {"type": "Heart Rate", "dates": None, "values": ["60"]},
+        {"type": "Heart Rate", "dates": 5, "values": 6},
+        {"type": "Heart Rate", "dates": {"a": "b"}, "values": ["60"]},
+        {"type": 5, "dates": ["2021-04-01 08:00:00"], "values": ["60"]},
+        {"type": ["Heart Rate"], "dates": ["2021-04-01 08:00:00"], "values": ["60"]},
+        {"type": None, "dates": ["2021-04-01 08:00:00"], "values": ["60"]},
+        {"type": "Heart Rate", "dates": [None], "values": [60]},
+        {"type": "Heart Rate", "dates": "2021-04-01 08:00:00", "values": ["60"]},
+        {"type": "Heart Rate", "dates": ["2021-04-01 08:00:00"]},
+    ],
+)
+def test_stream_parser_malformedPayload_shouldMatchBufferedPath(payload):
+    """Payloads of the wrong shape get the same response whether the body is
+    decoded first or tokenized as it arrives.
+    """
+    body = json.dumps(payload).encode()
+    responses = []
+    for streaming in (False, True):
+        health = Health()
+        try:
+            if streaming:
+                health.load_from_columns(parse_in_chunks(body, 3))
+            else:
+                health.load_from_shortcuts(json.loads(body))
+        except Exception as e:
+            responses.append((error_response(e), error_details(e)))
+        else:
+            responses.append((list(health.readings.timestamps), None))
+
+    assert responses[0] == responses[1]
@@ -0,0 +1,52 @@
+import pytest
+from datetime import datetime
+from heartbridge.timestamps import TimestampCodec, datetime_to_epoch, DATE_PARSE_STRING
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        "2019-12-16 08:24:36",
+        "2019-12-16 23:59:59",
+        "1969-12-31 23:59:59",
+        "2020-02-29 00:00:00",
+        "2019-12-16 8:4:36",  # not zero-padded, handled by the strptime fallback
+    ],
+)
+def test_parse_matchesStrptime(value):
+    codec = TimestampCodec()
+    expected = datetime_to_epoch(datetime.strptime(value, DATE_PARSE_STRING))
+    # Parse twice so the second call goes through the cached day:
+    assert codec.parse(value) == expected
+    assert codec.parse(value) == expected
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        "2019-12-16 24:00:00",
+        "2019-12-16 08:60:00",
+        "2019-12-16 08:24:60",
+        "2019-12-16 +8:24:36",
+        "2019-02-29 00:00:00",
+        "2019-12-16T08:24:36",
+    ],
+)
+def test_parse_invalid_shouldRaise(value):
+    codec = TimestampCodec()
+    codec.parse("2019-12-16 00:00:00")  # warm the cache for the fast path
+    with pytest.raises(ValueError):
+        codec.parse(value)
+
+
+def test_parse_many():
+    codec = TimestampCodec()
+    parsed = codec.parse_many(["2019-12-16 08:24:36", "2019-12-16 09:32:17"])
+    assert parsed.typecode == "q"
+    assert list(parsed) == [1576484676, 1576488737]
+
+
+def test_format_roundtrip():
+    codec = TimestampCodec(max_cached_days=2)
+    dates = ["1969-12-31 23:59:59", "2019-12-16 08:24:36", "2021-04-13 23:29:00"]
+    assert list(codec.format_many(codec.parse_many(dates))) == dates
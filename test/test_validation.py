@@ -0,0 +1,108 @@
+import math, pickle
+import pytest
+from heartbridge import validation
+from heartbridge.data import HeartRateReading, StepsReading
+from heartbridge.exceptions import SampleValidationError
+
+DATES = ["2021-04-01 08:00:00", "2021-04-01 08:01:00", "2021-04-01 08:02:00"]
+
+
+def test_parse_samples_valid(engine):
+    timestamps, values, dropped = validation.parse_samples(
+        StepsReading, DATES, ["10", "20.0", "30"]
+    )
+    assert list(timestamps) == [1617264000, 1617264060, 1617264120]
+    assert list(values) == [10, 20, 30]
+    assert values.typecode == "q"
+    assert dropped == []
+
+
+def test_parse_samples_invalid_shouldReportIndices(engine):
+    dates = DATES + ["yesterday"]
+    values = ["72", "abc", "400", "80"]
+    with pytest.raises(SampleValidationError) as info:
+        validation.parse_samples(HeartRateReading, dates, values)
+
+    assert info.value.invalid == 3
+    assert info.value.errors == [
+        {"index": 1, "field": "values", "value": "abc", "reason": "not a number"},
+        {
+            "index": 2,
+            "field": "values",
+            "value": 400.0,
+            "reason": "outside the range 1 to 300",
+        },
+        {
+            "index": 3,
+            "field": "dates",
+            "value": "yesterday",
+            "reason": "not a YYYY-MM-DD HH:MM:SS timestamp",
+        },
+    ]
+
+
+def test_parse_samples_reportsFirstErrorsOnly(engine):
+    dates = ["bad"] * 50
+    with pytest.raises(SampleValidationError) as info:
+        validation.parse_samples(HeartRateReading, dates, ["60"] * 50, max_errors=3)
+
+    assert info.value.invalid == 50
+    assert [error["index"] for error in info.value.errors] == [0, 1, 2]
+
+
+def test_parse_samples_nullAndNaN_shouldBeInvalidValues(engine):
+    with pytest.raises(SampleValidationError) as info:
+        validation.parse_samples(HeartRateReading, DATES, [None, "nan", "400"])
+
+    assert [(error["value"], error["reason"]) for error in info.value.errors] == [
+        (None, validation.INVALID_VALUE),
+        (None, validation.INVALID_VALUE),
+        (400.0, "outside the range 1 to 300"),
+    ]
+
+
+def test_sampleErrors_keepsFirstErrorsOnly():
+    errors = validation.SampleErrors(("dates", "values"), max_errors=3)
+    for index in reversed(range(1000)):
+        errors.add(index, 1, index, validation.INVALID_VALUE)
+    errors.add(5, 0, "again", validation.INVALID_DATE)
+
+    assert len(errors) == 1000
+    assert [error["index"] for error in errors.report()] == [0, 1, 2]
+    assert errors.report()[0]["value"] == 0
+
+
+def test_sample_validation_error_shouldPickle():
+    """Errors raised in a process pool are pickled back to the server."""
+    error = SampleValidationError("Invalid samples", [{"index": 0}], 1)
+    copy = pickle.loads(pickle.dumps(error))
+    assert (str(copy), copy.errors, copy.invalid) == (
+        "Invalid samples",
+        [{"index": 0}],
+        1,
+    )
+
+
+def test_parse_samples_dropInvalid(engine):
+    timestamps, values, dropped = validation.parse_samples(
+        HeartRateReading, DATES, ["72", "nan", "0"], drop_invalid=True
+    )
+    assert list(timestamps) == [1617264000]
+    assert list(values) == [72.0]
+    assert [(error["index"], error["value"]) for error in dropped] == [
+        (1, None),
+        (2, 0.0),
+    ]
+
+
+def test_check_samples_withParseErrors(engine):
+    timestamps, values, dropped = validation.check_samples(
+        HeartRateReading,
+        validation.array("q", [1617264000, 0]),
+        [60.0, math.nan],
+        invalid={1: (0, "soon", validation.INVALID_DATE)},
+        drop_invalid=True,
+    )
+    assert list(timestamps) == [1617264000]
+    assert list(values) == [60.0]
+    assert dropped[0]["field"] == "dates"
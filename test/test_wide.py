@@ -0,0 +1,153 @@
+import csv, json, sqlite3
+import pytest
+from click.testing import CliRunner
+from heartbridge import Health
+from heartbridge.app import cli
+from heartbridge.wide import WideExport, merge_join, reduce_buckets
+
+UPLOADS = [
+    {
+        "type": "Heart Rate",
+        "dates": [
+            "2021-04-01 08:00:10",
+            "2021-04-01 08:00:50",
+            "2021-04-01 08:02:00",
+            "2021-04-01 08:03:30",
+        ],
+        "values": ["70", "80", "90", "66"],
+    },
+    {
+        "type": "Steps",
+        "dates": ["2021-04-01 08:00:00", "2021-04-01 08:00:30", "2021-04-01 08:01:00"],
+        "values": ["10", "15", "7"],
+    },
+]
+START = 1617264000  # 2021-04-01 08:00:00
+
+
+def export_uploads(directory, output_format):
+    for upload in UPLOADS:
+        health = Health(str(directory), output_format)
+        health.load_from_shortcuts(dict(upload))
+        health.export()
+
+
+def test_reduceBuckets_withOffset():
+    rows = [(0, 1), (20, 3), (40, 5), (70, 7)]
+    assert list(reduce_buckets(rows, 60)) == [(0, 3.0), (60, 7.0)]
+    assert list(reduce_buckets(rows, 60, offset=30, reducer="sum")) == [
+        (-30, 4),
+        (30, 12),
+    ]
+
+
+@pytest.mark.parametrize(
+    "fill, fill_limit, expected",
+    [
+        ("empty", None, [(0, 1, None), (60, None, 5), (180, 2, None)]),
+        ("zero", None, [(0, 1, 0.0), (60, 0, 5), (180, 2, 0.0)]),
+        ("previous", None, [(0, 1, None), (60, 1, 5), (180, 2, 5)]),
+        ("previous", 60, [(0, 1, None), (60, 1, 5), (180, 2, None)]),
+    ],
+)
+def test_mergeJoin_fillPolicies(fill, fill_limit, expected):
+    series = [[(0, 1), (180, 2)], [(60, 5)]]
+    rows = merge_join(series, fill, zeros=[0, 0.0], fill_limit=fill_limit)
+    assert list(rows) == expected
+
+
+def test_mergeJoin_invalidFill():
+    with pytest.raises(ValueError):
+        list(merge_join([[]], "interpolate"))
+
+
+@pytest.mark.parametrize("output_format", ["csv", "sqlite"])
+def test_wideExport_rows(tmp_path, output_format):
+    export_uploads(tmp_path, output_format)
+    wide = WideExport(tmp_path, output_format, ["heart-rate", "steps"])
+
+    assert wide.schema.field_names == ("timestamp", "heart_rate", "steps")
+    assert list(wide.rows(format_timestamps=False)) == [
+        (START, 75.0, 25),
+        (START + 60, None, 7),
+        (START + 120, 90.0, None),
+        (START + 180, 66.0, None),
+    ]
+
+
+def test_wideExport_bucketAndRange(tmp_path):
+    export_uploads(tmp_path, "csv")
+    wide = WideExport(
+        tmp_path,
+        "csv",
+        ["heart-rate", "steps"],
+        bucket=120,
+        fill="zero",
+        start=START + 30,
+    )
+
+    assert wide.reading_type == "wide-per-120s"
+    assert list(wide.rows()) == [
+        ("2021-04-01 08:00:00", 80.0, 22),
+        ("2021-04-01 08:02:00", 78.0, 0),
+    ]
+
+
+@pytest.mark.parametrize("export_format", ["csv", "json", "sqlite"])
+def test_wideExport_export(tmp_path, export_format):
+    export_uploads(tmp_path, "csv")
+    wide = WideExport(tmp_path, "csv", ["heart-rate", "steps"], bucket="hour")
+
+    path = wide.export(export_format)
+
+    if export_format == "csv":
+        with open(path) as f:
+            assert list(csv.reader(f)) == [
+                ["timestamp", "heart_rate", "steps"],
+                ["2021-04-01 08:00:00", "76.5", "32"],
+            ]
+    elif export_format == "json":
+        with open(path) as f:
+            assert json.load(f) == [
+                {"timestamp": "2021-04-01 08:00:00", "heart_rate": 76.5, "steps": 32}
+            ]
+    else:
+        with sqlite3.connect(path) as db:
+            rows = db.execute("SELECT * FROM wide_per_hour").fetchall()
+        assert rows == [(START, 76.5, 32)]
+
+
+def test_wideExport_invalidBucket(tmp_path):
+    with pytest.raises(ValueError):
+        WideExport(tmp_path, "csv", bucket="week")
+
+
+def test_cli_wide(tmp_path):
+    export_uploads(tmp_path, "csv")
+    output = tmp_path / "out.csv"
+
+    result = CliRunner().invoke(
+        cli,
+        [
+            "wide",
+            "--directory",
+            str(tmp_path),
+            "--record-type",
+            "heart-rate",
+            "--record-type",
+            "steps",
+            "--fill",
+            "previous",
+            "--output",
+            str(output),
+        ],
+    )
+
+    assert result.exit_code == 0, result.output
+    assert str(output) in result.output
+    with open(output) as f:
+        rows = list(csv.reader(f))
+    assert rows[2] == ["2021-04-01 08:01:00", "75.0", "7"]
+
+    result = CliRunner().invoke(cli, ["wide", "--bucket", "fortnight"])
+    assert result.exit_code == 2